@@ -6,9 +6,16 @@ from munch import munchify
 from utils.util import opt_get
 
 
-def create_dataloader(dataset, dataset_opt, opt=None, sampler=None, collate_fn=None, shuffle=True):
+def create_dataloader(dataset, dataset_opt, opt=None, sampler=None, collate_fn=None, shuffle=True, batch_sampler=None):
     phase = dataset_opt['phase']
     pin_memory = opt_get(dataset_opt, ['pin_memory'], True)
+    if batch_sampler is not None:
+        # The batch sampler determines batch composition (and per-rank splitting); see data.data_sampler.
+        return torch.utils.data.DataLoader(dataset, batch_sampler=batch_sampler, num_workers=dataset_opt['n_workers'],
+                                           pin_memory=pin_memory, collate_fn=collate_fn)
+    if isinstance(dataset, torch.utils.data.IterableDataset):
+        # Iterable datasets shuffle and split themselves across workers and ranks.
+        shuffle, sampler = False, None
     if phase == 'train':
         if opt_get(opt, ['dist'], False):
             world_size = torch.distributed.get_world_size()
@@ -71,10 +78,14 @@ def create_dataset(dataset_opt, return_collate=False):
             collate = C()
     elif mode == 'paired_voice_audio':
         from data.audio.paired_voice_audio_dataset import TextWavLoader as D
+        from data.zero_pad_dict_collate import ZeroPadDictCollate as C
         from models.audio.tts.tacotron2 import create_hparams
         default_params = create_hparams()
         default_params.update(dataset_opt)
         dataset_opt = munchify(default_params)
+        if opt_get(dataset_opt, ['zero_pad_collate'], False):
+            # The dataset already outputs the lengths of the keys that matter.
+            collate = C(emit_lengths=opt_get(dataset_opt, ['collate_emit_lengths'], False), tensorize_numbers=True)
     elif mode == 'fast_paired_voice_audio':
         from data.audio.fast_paired_dataset import FastPairedVoiceDataset as D
         from models.audio.tts.tacotron2 import create_hparams
@@ -87,21 +98,30 @@ def create_dataset(dataset_opt, return_collate=False):
         default_params = create_hparams()
         default_params.update(dataset_opt)
         dataset_opt = munchify(default_params)
+    elif mode == 'packed_paired_voice_audio':
+        from data.audio.packed_voice_dataset import PackedVoiceDataset as D
     elif mode == 'gpt_tts':
         from data.audio.gpt_tts_dataset import GptTtsDataset as D
         from data.audio.gpt_tts_dataset import GptTtsCollater as C
         collate = C(dataset_opt)
     elif mode == 'unsupervised_audio':
         from data.audio.unsupervised_audio_dataset import UnsupervisedAudioDataset as D
+        from data.zero_pad_dict_collate import ZeroPadDictCollate as C
+        if opt_get(dataset_opt, ['zero_pad_collate'], False):
+            collate = C(emit_lengths=opt_get(dataset_opt, ['collate_emit_lengths'], False), tensorize_numbers=True)
+    elif mode == 'unsupervised_audio_shards':
+        from data.audio.audio_shard_dataset import ShardedAudioDataset as D
     elif mode == 'unsupervised_audio_with_noise':
         from data.audio.audio_with_noise_dataset import AudioWithNoiseDataset as D
     elif mode == 'preprocessed_mel':
         from data.audio.preprocessed_mel_dataset import PreprocessedMelDataset as D
+    elif mode == 'packed_mel':
+        from data.audio.preprocessed_mel_dataset import PackedMelDataset as D
     elif mode == 'grand_conjoined_voice':
         from data.audio.grand_conjoined_dataset import GrandConjoinedDataset as D
         from data.zero_pad_dict_collate import ZeroPadDictCollate as C
         if opt_get(dataset_opt, ['needs_collate'], False):
-            collate = C()
+            collate = C(emit_lengths=opt_get(dataset_opt, ['collate_emit_lengths'], False))
     else:
         raise NotImplementedError('Dataset [{:s}] is not recognized.'.format(mode))
     dataset = D(dataset_opt)
@@ -0,0 +1,213 @@
+import io
+import json
+import os
+import random
+import sys
+import tarfile
+
+import torch
+import torch.utils.data
+import torchaudio
+from tqdm import tqdm
+
+from data.audio.unsupervised_audio_dataset import make_clip_output
+from utils.audio_resampler import resample
+from utils.util import opt_get
+
+# The original path of every clip is recorded in a pax header of its tar member.
+PATH_HEADER = 'dlas.path'
+
+
+def shard_index_path(output_dir):
+    return os.path.join(output_dir, 'shards.json')
+
+
+def write_audio_shards(paths, output_dir, clips_per_shard=2000):
+    """
+    Copies the (still encoded) audio files in [paths] into tar shards of [clips_per_shard] files each under
+    [output_dir], along with a shards.json index readable by ShardedAudioDataset. Paths are shuffled first so every
+    shard is a random sample of the corpus, which is what lets the dataset get away with shuffling shards and a bounded
+    buffer rather than individual clips.
+    """
+    paths = list(paths)
+    random.Random(0).shuffle(paths)
+    os.makedirs(output_dir, exist_ok=True)
+    shards = []
+    tar = None
+    for i, path in enumerate(tqdm(paths)):
+        if i % clips_per_shard == 0:
+            if tar is not None:
+                tar.close()
+            shards.append({'path': f'shard-{len(shards):06d}.tar', 'num_clips': 0})
+            tar = tarfile.open(os.path.join(output_dir, shards[-1]['path']), 'w', format=tarfile.PAX_FORMAT)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except:
+            print(f'Error reading {path}: {sys.exc_info()}')
+            continue
+        info = tarfile.TarInfo(f'{i:09d}{os.path.splitext(path)[-1]}')
+        info.size = len(data)
+        info.pax_headers = {PATH_HEADER: path}
+        tar.addfile(info, io.BytesIO(data))
+        shards[-1]['num_clips'] += 1
+    if tar is not None:
+        tar.close()
+    with open(shard_index_path(output_dir), 'w', encoding='utf-8') as f:
+        json.dump({'num_clips': sum(s['num_clips'] for s in shards), 'shards': shards}, f, indent=2)
+    return shards
+
+
+def decode_audio_bytes(data, ext, sampling_rate):
+    if ext in ['.wav', '.flac', '.ogg']:
+        import soundfile as sf
+        audio, lsr = sf.read(io.BytesIO(data), dtype='float32', always_2d=True)
+        audio = torch.from_numpy(audio[:, 0])
+    else:
+        audio, lsr = torchaudio.load(io.BytesIO(data), format=ext[1:])
+        audio = audio[0]
+    if lsr != sampling_rate:
+        audio = resample(audio, lsr, sampling_rate)
+    audio.clip_(-1, 1)
+    return audio.unsqueeze(0)
+
+
+class ShardedAudioDataset(torch.utils.data.IterableDataset):
+    """
+    Streaming counterpart of UnsupervisedAudioDataset, reading tar shards written by write_audio_shards() (see
+    scripts/audio/preparation/pack_audio_shards.py) sequentially instead of opening every clip individually.
+
+    Every epoch the shard order is shuffled (identically on every rank) and the shards are dealt out across all DDP
+    ranks and dataloader workers. Clips are then shuffled locally through a buffer of [shuffle_buffer] decoded clips.
+    Each worker yields a fixed quota of clips, cycling through its shards if needed, so that all ranks see the same
+    number of batches per epoch.
+
+    Conditioning clips ('extra_samples') are not supported, since they require random access.
+    """
+    def __init__(self, opt):
+        index_paths = opt['path']
+        if not isinstance(index_paths, list):
+            index_paths = [index_paths]
+        self.shards = []
+        self.num_clips = 0
+        for p in index_paths:
+            with open(p, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            base = os.path.dirname(p)
+            self.shards.extend(os.path.join(base, s['path']) for s in index['shards'] if s['num_clips'] > 0)
+            self.num_clips += index['num_clips']
+        assert opt_get(opt, ['extra_samples'], 0) == 0, 'extra_samples is not supported when streaming shards.'
+
+        self.sampling_rate = opt_get(opt, ['sampling_rate'], 22050)
+        self.pad_to = opt_get(opt, ['pad_to_seconds'], None)
+        if self.pad_to is not None:
+            self.pad_to *= self.sampling_rate
+        self.pad_to = opt_get(opt, ['pad_to_samples'], self.pad_to)
+        self.min_length = opt_get(opt, ['min_length'], 0)
+        self.dont_clip = opt_get(opt, ['dont_clip'], False)
+        self.should_resample_clip = opt_get(opt, ['resample_clip'], False)
+        self.shuffle_buffer = opt_get(opt, ['shuffle_buffer'], 1000)
+        self.seed = opt_get(opt, ['seed'], 0)
+        self.debug_loading_failures = opt_get(opt, ['debug_loading_failures'], True)
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        # Called from the main process before workers are started, so the workers inherit it.
+        self.epoch = epoch
+
+    def get_rank(self):
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_rank(), torch.distributed.get_world_size()
+        return 0, 1
+
+    def get_consumer(self):
+        """
+        Returns (consumer_id, num_consumers, quota): this worker's position among all workers of all ranks and the
+        number of clips it must produce this epoch.
+        """
+        rank, world_size = self.get_rank()
+        worker = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+        rank_quota = self.num_clips // world_size
+        quota = rank_quota // num_workers + (1 if worker_id < rank_quota % num_workers else 0)
+        return rank * num_workers + worker_id, world_size * num_workers, quota
+
+    def assign_shards(self, consumer, num_consumers):
+        shards = list(self.shards)
+        random.Random(self.seed + self.epoch).shuffle(shards)
+        if len(shards) < num_consumers:
+            print(f'Warning: only {len(shards)} shards for {num_consumers} dataloader workers; some clips will be '
+                  f'seen more than once per epoch. Write smaller shards.')
+            return [shards[consumer % len(shards)]]
+        return shards[consumer::num_consumers]
+
+    def iterate_clips(self, shards, rng):
+        while True:
+            produced = 0
+            rng.shuffle(shards)
+            for shard in shards:
+                try:
+                    tar = tarfile.open(shard, 'r|')  # Stream mode: strictly sequential reads.
+                except:
+                    print(f'Error opening shard {shard}: {sys.exc_info()}')
+                    continue
+                with tar:
+                    for member in tar:
+                        if not member.isfile():
+                            continue
+                        path = member.pax_headers.get(PATH_HEADER, member.name)
+                        try:
+                            audio = decode_audio_bytes(tar.extractfile(member).read(), os.path.splitext(member.name)[-1],
+                                                       self.sampling_rate)
+                            assert audio.shape[1] > self.min_length
+                            if self.dont_clip:
+                                assert audio.shape[1] <= self.pad_to
+                        except:
+                            if self.debug_loading_failures:
+                                print(f"Error loading audio for file {path} {sys.exc_info()}")
+                            continue
+                        produced += 1
+                        yield audio, path
+            if produced == 0:
+                raise ValueError(f'No clips could be loaded from {shards}.')
+
+    def __iter__(self):
+        consumer, num_consumers, quota = self.get_consumer()
+        rng = random.Random(self.seed * 1000003 + self.epoch * 1009 + consumer)
+        shards = self.assign_shards(consumer, num_consumers)
+        buffer = []
+        clips = self.iterate_clips(shards, rng)
+        for i in range(quota):
+            # Keep the buffer full (but never decode more clips than are left in the quota), then emit a random one.
+            while len(buffer) < min(self.shuffle_buffer, quota - i):
+                buffer.append(next(clips))
+            j = rng.randrange(len(buffer))
+            buffer[j], buffer[-1] = buffer[-1], buffer[j]
+            audio, path = buffer.pop()
+            yield make_clip_output(audio, path, self.pad_to, self.should_resample_clip)
+
+    def __len__(self):
+        # The number of clips this rank yields per epoch (see get_consumer()), which is what the trainer's epoch
+        # arithmetic expects from a dataset under DDP.
+        return self.num_clips // self.get_rank()[1]
+
+
+if __name__ == '__main__':
+    params = {
+        'mode': 'unsupervised_audio_shards',
+        'path': ['Y:\\shards\\bt-music\\shards.json'],
+        'sampling_rate': 22050,
+        'pad_to_samples': 200000,
+        'resample_clip': False,
+        'shuffle_buffer': 1000,
+        'phase': 'train',
+        'n_workers': 2,
+        'batch_size': 16,
+    }
+    from data import create_dataset, create_dataloader
+
+    ds = create_dataset(params)
+    dl = create_dataloader(ds, params, shuffle=False)
+    for i, b in tqdm(enumerate(dl)):
+        if i > 100:
+            break
@@ -11,11 +11,11 @@ from tqdm import tqdm
 import torch.nn.functional as F
 from data.audio.unsupervised_audio_dataset import UnsupervisedAudioDataset, load_audio
 from data.util import load_paths_from_cache, find_files_of_type, is_audio_file
-
-# Just all ones.
+from utils.fft_conv import FftConvolver
 from utils.util import opt_get
 
 
+# Just all ones.
 def _integration_fn_fully_enabled(n):
     return torch.ones((n,))
 
@@ -59,14 +59,28 @@ def _integration_fn_smooth(n):
     return fn
 
 
-def load_rir(path, sr, max_sz):
+def load_rir(path, sr, max_sz, flip=True):
+    # Kernels are flipped for use with conv1d (which computes a cross-correlation) unless flip=False.
     rir = load_audio(path, sr).abs()
     if rir.shape[-1] > max_sz:
         rir = rir[:, :max_sz]
-    rir = (rir / torch.norm(rir, p=2)).flip([1])
+    rir = rir / torch.norm(rir, p=2)
+    if flip:
+        rir = rir.flip([1])
     return rir
 
 
+def load_rir_convolver(paths, sr, max_sz):
+    """
+    Loads the impulse responses in [paths] into an FftConvolver.
+    """
+    rirs = [load_rir(p, sr, max_sz, flip=False)[0] for p in paths]
+    bank = torch.zeros((len(rirs), max(r.shape[-1] for r in rirs)))
+    for i, r in enumerate(rirs):
+        bank[i, :r.shape[-1]] = r
+    return FftConvolver(bank)
+
+
 '''
 Wraps a unsupervised_audio_dataset and applies noise to the output clips, then provides labels depending on what
 noise was added.
@@ -80,17 +94,16 @@ class AudioWithNoiseDataset(Dataset):
         self.min_volume = opt_get(opt, ['min_noise_volume'], .2)
         self.max_volume = opt_get(opt, ['max_noise_volume'], .5)
         self.sampling_rate = self.underlying_dataset.sampling_rate
-        self.use_gpu_for_reverb_compute = opt_get(opt, ['use_gpu_for_reverb_compute'], True)
-        self.openair_kernels = None
+        self.reverb = None
         self.current_item_fetch = 0
         self.fetch_error_count = 0
 
     def load_openair_kernels(self):
-        if self.use_gpu_for_reverb_compute and self.openair_kernels is None:
-            # Load the openair reverbs as CUDA tensors.
-            self.openair_kernels = []
-            for oa in self.openair_paths:
-                self.openair_kernels.append(load_rir(oa, self.underlying_dataset.sampling_rate, self.underlying_dataset.sampling_rate*2).cuda())
+        if self.reverb is None:
+            # Reverb is computed by FFT convolution, which is cheap enough to do on the CPU inside the dataloader
+            # workers.
+            self.reverb = load_rir_convolver(self.openair_paths, self.underlying_dataset.sampling_rate,
+                                             self.underlying_dataset.sampling_rate*2)
 
     def __getitem__(self, item):
         if self.current_item_fetch != item:
@@ -162,15 +175,9 @@ class AudioWithNoiseDataset(Dataset):
             elif label == 4:
                 # Perform reverb (to simulate being in a large room with an omni-mic). This is performed by convolving
                 # impulse recordings from openair over the input clip.
-                if self.use_gpu_for_reverb_compute:
-                    rir = random.choice(self.openair_kernels)
-                else:
-                    augpath = random.choice(self.openair_paths)
-                    rir = load_rir(augpath, self.underlying_dataset.sampling_rate, clip.shape[-1])
-                clip = torch.nn.functional.pad(clip, (rir.shape[1]-1, 0))
-                if self.use_gpu_for_reverb_compute:
-                    clip = clip.cuda()
-                clip = torch.nn.functional.conv1d(clip.unsqueeze(0), rir.unsqueeze(0)).squeeze(0).cpu()
+                rir_index = random.randint(0, len(self.reverb)-1)
+                augpath = self.openair_paths[rir_index]
+                clip = self.reverb(clip, rir_index)
             elif label == 5:
                 # Apply the GSM codec to simulate cellular phone audio.
                 clip = torchaudio.functional.apply_codec(clip, self.underlying_dataset.sampling_rate, format="gsm")
@@ -214,7 +221,6 @@ if __name__ == '__main__':
         'music_paths': ['E:\\audio\\music\\FMA\\fma_large', 'E:\\audio\\music\\maestro\\maestro-v3.0.0'],
         'music_cache': 'E:\\audio\\music\\cache.pth',
         'openair_path': 'D:\\data\\audio\\openair\\resampled',
-        'use_gpu_for_reverb_compute': False,
     }
     from data import create_dataset, create_dataloader, util
 
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+
+import torch
+
+
+def hash_file_contents(path, chunk_size=1 << 20):
+    """
+    Returns a hex digest of the raw bytes of the file at [path]. This is the key used to address entries in the DVAE
+    code cache, so renaming or moving a clip does not invalidate its cached codes but re-encoding it does.
+    """
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class DvaeCodeCache:
+    """
+    Content-addressed on-disk store of DVAE codes (and, optionally, the normalized MELs they were computed from) for
+    audio clips. Entries are sharded into 256 subdirectories by the first byte of their key.
+
+    The cache also records the parameters it was built with (in cache_info.json) so datasets can refuse to read a cache
+    that was computed at a different sample rate or padding length.
+
+    Hashing a clip means reading all of it, so the key of every file the cache was built from is also recorded in
+    path_index.json along with the file's size and mtime. key_for_file() only hashes files that are missing from it or
+    changed since.
+    """
+    INFO_FILE = 'cache_info.json'
+    PATH_INDEX_FILE = 'path_index.json'
+
+    def __init__(self, cache_dir, create=False):
+        self.cache_dir = cache_dir
+        if create:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.info = {}
+        self.path_index = None  # path -> [size, mtime_ns, key], loaded on first use.
+        info_path = os.path.join(cache_dir, self.INFO_FILE)
+        if os.path.exists(info_path):
+            with open(info_path, 'r', encoding='utf-8') as f:
+                self.info = json.load(f)
+
+    def write_info(self, **info):
+        self.info.update(info)
+        with open(os.path.join(self.cache_dir, self.INFO_FILE), 'w', encoding='utf-8') as f:
+            json.dump(self.info, f, indent=2)
+
+    def check_compatible(self, **expected):
+        for k, v in expected.items():
+            if k in self.info and self.info[k] != v:
+                raise ValueError(f'DVAE code cache at {self.cache_dir} was built with {k}={self.info[k]}, but {v} was requested.')
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.pth')
+
+    def contains(self, key):
+        return os.path.exists(self.entry_path(key))
+
+    def put(self, key, codes, mel=None):
+        entry = {'codes': codes.to(torch.int16).cpu()}
+        if mel is not None:
+            entry['mel'] = mel.half().cpu()
+        outp = self.entry_path(key)
+        os.makedirs(os.path.dirname(outp), exist_ok=True)
+        # Write to a temporary file first so that readers never observe a partially written entry.
+        tmp = outp + '.tmp'
+        torch.save(entry, tmp)
+        os.replace(tmp, outp)
+
+    def get(self, key, load_mel=False):
+        """
+        Returns (codes, mel) for the given key, or None if there is no such entry. mel is None unless load_mel is set.
+        """
+        path = self.entry_path(key)
+        if not os.path.exists(path):
+            return None
+        entry = torch.load(path)
+        codes = entry['codes'].long()
+        mel = None
+        if load_mel:
+            if 'mel' not in entry.keys():
+                raise ValueError(f'DVAE code cache entry {path} does not contain a MEL.')
+            mel = entry['mel'].float()
+        return codes, mel
+
+    def load_path_index(self):
+        if self.path_index is None:
+            self.path_index = {}
+            index_path = os.path.join(self.cache_dir, self.PATH_INDEX_FILE)
+            if os.path.exists(index_path):
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    self.path_index = json.load(f)
+        return self.path_index
+
+    def record_path(self, path, key, size, mtime_ns):
+        self.load_path_index()[path] = [size, mtime_ns, key]
+
+    def save_path_index(self):
+        outp = os.path.join(self.cache_dir, self.PATH_INDEX_FILE)
+        tmp = outp + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.load_path_index(), f)
+        os.replace(tmp, outp)
+
+    def key_for_file(self, path):
+        st = os.stat(path)
+        entry = self.load_path_index().get(path)
+        if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+        # Unknown or modified since the index was written. Remember the result for the rest of this process.
+        key = hash_file_contents(path)
+        self.record_path(path, key, st.st_size, st.st_mtime_ns)
+        return key
+
+    def get_for_file(self, path, load_mel=False):
+        return self.get(self.key_for_file(path), load_mel=load_mel)
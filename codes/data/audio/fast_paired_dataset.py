@@ -1,3 +1,4 @@
+import bisect
 import hashlib
 import os
 import random
@@ -5,6 +6,7 @@ import sys
 import time
 from itertools import groupby
 
+import numpy as np
 import torch
 import torch.nn.functional as F
 import torch.utils.data
@@ -13,6 +15,7 @@ from tqdm import tqdm
 from transformers import Wav2Vec2CTCTokenizer
 
 from data.audio.paired_voice_audio_dataset import CharacterTokenizer
+from data.audio.similarity_index import SimilarityIndex
 from data.audio.unsupervised_audio_dataset import load_audio, load_similar_clips
 from utils.util import opt_get
 
@@ -29,6 +32,33 @@ def parse_tsv_aligned_codes(line, base_path):
     return os.path.join(base_path, f'{fpt[1]}'), fpt[0], convert_string_list_to_tensor(fpt[2])
 
 
+def build_line_index(path, chunk_size=1 << 24):
+    """
+    Returns a memory mapped uint64 array of the byte offset at which every line in [path] starts. The array is cached
+    next to the file as <path>.lineidx.npy and rebuilt whenever the file is newer than the cache.
+    """
+    index_path = f'{path}.lineidx.npy'
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(path):
+        print(f"Building line index for {path}..")
+        offsets = [np.zeros((1,), dtype=np.uint64)]
+        pos = 0
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord('\n'))
+                offsets.append((newlines + pos + 1).astype(np.uint64))
+                pos += len(chunk)
+        offsets = np.concatenate(offsets)
+        if offsets[-1] >= pos:
+            offsets = offsets[:-1]  # The file ends in a newline; there is no line after it.
+        tmp_path = f'{index_path}.tmp.npy'
+        np.save(tmp_path, offsets)
+        os.replace(tmp_path, index_path)
+    return np.load(index_path, mmap_mode='r')
+
+
 class FastPairedVoiceDataset(torch.utils.data.Dataset):
     """
     This dataset is derived from paired_voice_audio, but it only supports loading from TSV files generated from the
@@ -42,6 +72,10 @@ class FastPairedVoiceDataset(torch.utils.data.Dataset):
     2) This dataset has a slight bias for items with longer text or longer filenames.
 
     The upshot is that this dataset loads extremely quickly and consumes almost no system memory.
+
+    Alternatively, setting 'use_line_index' builds (once) a memory mapped index of line offsets for each TSV. In that
+    mode index {i} always refers to the same line, lines are sampled uniformly and the dataset can be used for
+    validation.
     """
     def __init__(self, hparams):
         self.paths = hparams['path']
@@ -54,6 +88,9 @@ class FastPairedVoiceDataset(torch.utils.data.Dataset):
         self.load_conditioning = opt_get(hparams, ['load_conditioning'], False)
         self.conditioning_candidates = opt_get(hparams, ['num_conditioning_candidates'], 1)
         self.conditioning_length = opt_get(hparams, ['conditioning_length'], 44100)
+        self.similarity_index = opt_get(hparams, ['similarity_index'], None)  # Built by scripts/audio/preparation/build_similarity_index.py
+        if self.similarity_index is not None:
+            self.similarity_index = SimilarityIndex(self.similarity_index)
         self.produce_ctc_metadata = opt_get(hparams, ['produce_ctc_metadata'], False)
         self.debug_failures = opt_get(hparams, ['debug_loading_failures'], False)
         self.text_cleaners = hparams.text_cleaners
@@ -76,6 +113,13 @@ class FastPairedVoiceDataset(torch.utils.data.Dataset):
         self.load_times = torch.zeros((256,))
         self.load_ind = 0
 
+        self.use_line_index = opt_get(hparams, ['use_line_index'], False)
+        if self.use_line_index:
+            self.line_indices = [build_line_index(p) for p in self.paths]
+            self.cumulative_lines = np.cumsum([len(li) for li in self.line_indices]).tolist()
+            self.open_files = None
+            self.open_files_pid = None
+
     def get_wav_text_pair(self, audiopath_and_text):
         # separate filename and text
         audiopath, text = audiopath_and_text[0], audiopath_and_text[1]
@@ -121,6 +165,19 @@ class FastPairedVoiceDataset(torch.utils.data.Dataset):
                 print(f"error parsing random offset: {sys.exc_info()}")
         return self.load_random_line(depth=depth+1), type  # On failure, just recurse and try again.
 
+    def load_line(self, index):
+        # File objects are not shared with the parent process after a fork: a shared file offset would be seeked
+        # concurrently by every worker.
+        if self.open_files is None or self.open_files_pid != os.getpid():
+            self.open_files = [open(p, 'rb') for p in self.paths]
+            self.open_files_pid = os.getpid()
+        i = bisect.bisect_right(self.cumulative_lines, index)
+        line = index - (self.cumulative_lines[i-1] if i > 0 else 0)
+        f = self.open_files[i]
+        f.seek(int(self.line_indices[i][line]))
+        l = f.readline().decode('utf-8')
+        return parse_tsv_aligned_codes(l, os.path.dirname(self.paths[i])), self.types[i]
+
     def get_ctc_metadata(self, codes):
         grouped = groupby(codes.tolist())
         rcodes, repeats, seps = [], [], [0]
@@ -159,13 +216,20 @@ class FastPairedVoiceDataset(torch.utils.data.Dataset):
     def __getitem__(self, index):
         start = time.time()
         self.skipped_items += 1
-        apt, type = self.load_random_line()
+        try:
+            apt, type = self.load_line(index) if self.use_line_index else self.load_random_line()
+        except:
+            if self.skipped_items > 100:
+                raise  # Rethrow if we have nested too far.
+            if self.debug_failures:
+                print(f"error parsing line {index}: {sys.exc_info()}")
+            return self[(index+1) % len(self)]
         try:
             tseq, wav, text, path = self.get_wav_text_pair(apt)
             if text is None or len(text.strip()) == 0:
                 raise ValueError
             cond, cond_is_self = load_similar_clips(apt[0], self.conditioning_length, self.sample_rate,
-                                      n=self.conditioning_candidates) if self.load_conditioning else (None, False)
+                                      n=self.conditioning_candidates, similarity_index=self.similarity_index) if self.load_conditioning else (None, False)
         except:
             if self.skipped_items > 100:
                 raise  # Rethrow if we have nested too far.
@@ -223,6 +287,8 @@ class FastPairedVoiceDataset(torch.utils.data.Dataset):
         return res
 
     def __len__(self):
+        if self.use_line_index:
+            return self.cumulative_lines[-1]
         return self.total_size_bytes // 1000  # 1000 cuts down a TSV file to the actual length pretty well.
 
 
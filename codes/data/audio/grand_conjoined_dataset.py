@@ -8,7 +8,7 @@ from munch import munchify
 from tqdm import tqdm
 
 from data.audio.unsupervised_audio_dataset import UnsupervisedAudioDataset
-from data.text.hf_datasets_wrapper import HfDataset
+from data.text.hf_datasets_wrapper import HfDataset, StreamingHfDataset
 from utils.util import opt_get
 
 
@@ -70,11 +70,39 @@ class GrandConjoinedDataset(torch.utils.data.Dataset):
             if not self.collate:
                 unsupervised_audio_args['pad_to_samples'] = self.max_solo_audio_length
             self.speech = UnsupervisedAudioDataset(unsupervised_audio_args)
-            self.text = HfDataset(**text_corpus_args)
+            # With `streaming: true` in text_corpus_args, the text corpus is streamed rather than loaded and text items
+            # are drawn from it in order instead of by index.
+            self.text_streaming = text_corpus_args.pop('streaming', False)
+            if self.text_streaming:
+                self.text = StreamingHfDataset(**text_corpus_args)
+                self.text_iter = None
+                self.text_passes = 0
+            else:
+                self.text = HfDataset(**text_corpus_args)
+
+    def next_streamed_text(self):
+        # The iterator is created lazily, so that every dataloader worker gets its own slice of the stream.
+        if self.text_iter is None:
+            self.text.set_epoch(self.text_passes)
+            self.text_iter = iter(self.text)
+        try:
+            return next(self.text_iter)
+        except StopIteration:
+            self.text_passes += 1
+            self.text.set_epoch(self.text_passes)
+            self.text_iter = iter(self.text)
+            try:
+                return next(self.text_iter)
+            except StopIteration:
+                # A full pass yielded nothing, e.g. this worker was assigned none of the corpus' shards.
+                raise RuntimeError('The streamed text corpus yielded no items for this dataloader worker. It likely has '
+                                   'fewer shards than there are ranks x dataloader workers.')
 
     def fetch_text_at(self, i):
+        # Pulled outside the try, so that an empty stream fails rather than being retried forever below.
+        streamed = self.next_streamed_text() if self.text_streaming else None
         try:
-            txt = self.text[i % len(self.text)]['text']
+            txt = streamed['text'] if self.text_streaming else self.text[i % len(self.text)]['text']
             assert '*' not in txt  # This is a hack to get around the use of '*' to mask expletives in some text-only datasets. There really isn't a linguistic use for this character anyways.
             tok = self.speech_and_text.get_text(txt)
             padding_required = self.max_solo_text_length - tok.shape[0]
@@ -87,7 +115,7 @@ class GrandConjoinedDataset(torch.utils.data.Dataset):
         except:
             # This is fully expected: there are a lot of text strings we intentionally do not
             # handle (e.g. ones with emojis, or other languages). Just return another one.
-            return self.fetch_text_at((i+1) % len(self.text))
+            return self.fetch_text_at(i+1 if self.text_streaming else (i+1) % len(self.text))
 
     def fetch_snt_at(self, i):
         fetched = self.speech_and_text[i % len(self.speech_and_text)]
@@ -133,7 +161,7 @@ class GrandConjoinedDataset(torch.utils.data.Dataset):
                 'text_tokens': snt['padded_text'],
             }, snt)
         else:
-            txt, txt_tok = self.fetch_text_at(i % len(self.text))
+            txt, txt_tok = self.fetch_text_at(i if self.text_streaming else i % len(self.text))
             sp = self.speech[i % len(self.speech)]
             # Set upper bound on solo speech lengths. This is handled automatically when collation is turned off, but needs to be done otherwise.
             sp['clip'] = sp['clip'][:, :self.max_solo_audio_length]
@@ -155,6 +183,8 @@ class GrandConjoinedDataset(torch.utils.data.Dataset):
         if self.only_paired:
             return len(self.speech_and_text)
         else:
+            if self.text_streaming:
+                return max(len(self.speech), len(self.speech_and_text))
             return max(len(self.speech), len(self.speech_and_text), len(self.text))
 
 
@@ -0,0 +1,113 @@
+import os
+import sys
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+from tqdm import tqdm
+
+# One entry per manifest row, in the order the manifest's fetcher returns rows. A negative duration marks a clip that
+# could not be read; a negative text_len marks text that could not be tokenized.
+LENGTH_DTYPE = np.dtype([('duration', np.float32), ('text_len', np.int32)])
+
+
+def length_index_path(manifest):
+    return f'{manifest}.lengths.npy'
+
+
+def load_length_index(manifest, expected_rows):
+    """
+    Loads the length index of [manifest]. Raises if the index is missing or does not match the manifest.
+    """
+    path = length_index_path(manifest)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'{path} does not exist. Build it with scripts/audio/preparation/build_length_index.py')
+    if os.path.getmtime(path) < os.path.getmtime(manifest):
+        print(f'Warning: {manifest} is newer than its length index.')
+    index = np.load(path)
+    if index.shape[0] != expected_rows:
+        raise ValueError(f'{path} has {index.shape[0]} entries but {manifest} has {expected_rows} rows. Rebuild it.')
+    return index
+
+
+def get_duration(path):
+    """
+    Returns (duration in seconds, None), or (-1, error) if the file is unreadable. The duration is read from the header
+    where possible. Some containers (e.g. VBR mp3 or ogg) don't record their length, so those files are decoded instead.
+    """
+    from data.audio.unsupervised_audio_dataset import get_audio_info
+    try:
+        num_frames, sr = get_audio_info(path)
+        return num_frames / sr, None
+    except ValueError:
+        pass  # No length in the header.
+    except:
+        return -1, sys.exc_info()[1]
+    try:
+        import torchaudio
+        audio, sr = torchaudio.load(path)
+        return audio.shape[-1] / sr, None
+    except:
+        return -1, sys.exc_info()[1]
+
+
+def measure_durations(paths, num_workers=16, max_reported_errors=10):
+    """
+    Reads the duration (in seconds) of every file in [paths], in parallel. Header reads are IO bound, so threads are
+    used rather than processes. Unreadable files get a duration of -1; they are summarized once at the end rather than
+    reported one by one.
+    """
+    durations = np.zeros((len(paths),), dtype=np.float32)
+    errors = []
+    with ThreadPool(num_workers) as pool:
+        for i, (d, err) in enumerate(tqdm(pool.imap(get_duration, paths, chunksize=64), total=len(paths))):
+            durations[i] = d
+            if err is not None:
+                errors.append((paths[i], err))
+    if errors:
+        print(f'Unable to read {len(errors)} of {len(paths)} files. The first ones:')
+        for path, err in errors[:max_reported_errors]:
+            print(f'  {path}: {err}')
+    return durations
+
+
+def build_length_index(manifest, rows, tokenize_fn, num_workers=16):
+    """
+    Measures every row of [manifest] (as returned by its fetcher) and writes the result next to it. Durations are read
+    from the audio headers where they are recorded (see get_duration()); [tokenize_fn] converts text into the token
+    sequence the dataset will train on.
+    """
+    index = np.zeros((len(rows),), dtype=LENGTH_DTYPE)
+    index['duration'] = measure_durations([r[0] for r in rows], num_workers)
+    for i, r in enumerate(rows):
+        try:
+            index['text_len'][i] = len(tokenize_fn(r[1]))
+        except:
+            index['text_len'][i] = -1
+    np.save(length_index_path(manifest), index)
+    return index
+
+
+def build_path_length_index(cache_path, paths, num_workers=16):
+    """
+    Like build_length_index(), but for a list of clips without text, such as the path caches used by
+    unsupervised_audio datasets (see data.util.load_paths_from_cache). text_len is always 0.
+    """
+    index = np.zeros((len(paths),), dtype=LENGTH_DTYPE)
+    index['duration'] = measure_durations(paths, num_workers)
+    np.save(length_index_path(cache_path), index)
+    return index
+
+
+def length_filter(index, sample_rate, max_samples=None, min_samples=0, max_text_len=None):
+    """
+    Returns a boolean mask of the entries of [index] that a dataset could actually use: readable, no longer than
+    [max_samples] and no shorter than [min_samples] (both at [sample_rate]), and with a text no longer than
+    [max_text_len]. Durations come from headers, so items right at the limits may still be rejected after decoding.
+    """
+    samples = index['duration'] * sample_rate
+    keep = (index['duration'] >= 0) & (samples >= min_samples) & (index['text_len'] >= 0)
+    if max_samples is not None:
+        keep &= samples <= max_samples
+    if max_text_len is not None:
+        keep &= index['text_len'] <= max_text_len
+    return keep
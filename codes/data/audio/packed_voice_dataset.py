@@ -0,0 +1,262 @@
+import bisect
+import json
+import os
+import random
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torch.utils.data
+from tqdm import tqdm
+
+from utils.util import opt_get
+
+
+# Each row of a shard index describes one clip. All offsets and lengths are in elements of the respective data file.
+INDEX_DTYPE = np.dtype([
+    ('audio_off', np.int64), ('audio_len', np.int64),
+    ('text_off', np.int64), ('text_len', np.int64),
+    ('codes_off', np.int64), ('codes_len', np.int64),
+    ('str_off', np.int64), ('path_len', np.int64), ('real_text_len', np.int64),
+    ('cond_off', np.int64), ('cond_len', np.int64),
+    ('type', np.int32),
+])
+AUDIO_DTYPE = np.int16
+TEXT_DTYPE = np.int32
+CODES_DTYPE = np.int16
+COND_DTYPE = np.int64
+
+
+def _shard_files(prefix):
+    return {
+        'info': f'{prefix}.json',
+        'index': f'{prefix}.index.npy',
+        'audio': f'{prefix}.audio.bin',
+        'text': f'{prefix}.text.bin',
+        'codes': f'{prefix}.codes.bin',
+        'strings': f'{prefix}.strings.bin',
+        'cond': f'{prefix}.cond.bin',
+    }
+
+
+def _memmap(path, dtype):
+    # np.memmap refuses to map empty files.
+    if os.path.getsize(path) == 0:
+        return np.zeros((0,), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+class PackedVoiceShardWriter:
+    """
+    Writes a packed shard: int16 PCM audio at a fixed sample rate, BPE text tokens, aligned codes and the raw
+    text/filenames are each concatenated into one flat file and described by a single index of offsets. Conditioning
+    candidates (from similarities.pth) are resolved into row numbers when the shard is closed.
+    """
+    def __init__(self, prefix, sample_rate):
+        self.prefix = prefix
+        self.sample_rate = sample_rate
+        self.files = _shard_files(prefix)
+        os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+        self.audio = open(self.files['audio'], 'wb')
+        self.text = open(self.files['text'], 'wb')
+        self.codes = open(self.files['codes'], 'wb')
+        self.strings = open(self.files['strings'], 'wb')
+        self.offsets = {'audio': 0, 'text': 0, 'codes': 0, 'str': 0}
+        self.rows = []
+        self.paths = []
+        self.similar_paths = []
+
+    def add(self, path, text, tokens, wav, codes=None, type=0, similar_paths=None):
+        """
+        Appends a clip. [wav] is a float tensor in [-1,1] already at the shard sample rate; [tokens] and [codes] are
+        integer sequences.
+        """
+        audio = (wav.squeeze().clamp(-1, 1) * 32767).round().numpy().astype(AUDIO_DTYPE)
+        tokens = np.asarray(tokens, dtype=TEXT_DTYPE)
+        codes = np.zeros((0,), dtype=CODES_DTYPE) if codes is None else np.asarray(codes, dtype=CODES_DTYPE)
+        path_bytes = path.encode('utf-8')
+        text_bytes = text.encode('utf-8')
+
+        self.rows.append((self.offsets['audio'], audio.shape[0], self.offsets['text'], tokens.shape[0],
+                          self.offsets['codes'], codes.shape[0], self.offsets['str'], len(path_bytes), len(text_bytes),
+                          0, 0, type))
+        self.audio.write(audio.tobytes())
+        self.text.write(tokens.tobytes())
+        self.codes.write(codes.tobytes())
+        self.strings.write(path_bytes)
+        self.strings.write(text_bytes)
+        self.offsets['audio'] += audio.shape[0]
+        self.offsets['text'] += tokens.shape[0]
+        self.offsets['codes'] += codes.shape[0]
+        self.offsets['str'] += len(path_bytes) + len(text_bytes)
+        self.paths.append(path)
+        self.similar_paths.append(similar_paths)
+
+    def close(self):
+        for f in [self.audio, self.text, self.codes, self.strings]:
+            f.close()
+        index = np.array(self.rows, dtype=INDEX_DTYPE)
+
+        # Resolve conditioning candidates into row numbers within this shard. Clips without any resolvable candidates
+        # condition on themselves, which matches load_similar_clips(fallback_to_self=True).
+        rows_by_path = {p: i for i, p in enumerate(self.paths)}
+        cond_off = 0
+        with open(self.files['cond'], 'wb') as cond_file:
+            for i, similar in enumerate(self.similar_paths):
+                cands = [rows_by_path[p] for p in (similar or []) if p in rows_by_path.keys()]
+                if len(cands) == 0:
+                    cands = [i]
+                cond_file.write(np.asarray(cands, dtype=COND_DTYPE).tobytes())
+                index['cond_off'][i] = cond_off
+                index['cond_len'][i] = len(cands)
+                cond_off += len(cands)
+        np.save(self.files['index'], index)
+        with open(self.files['info'], 'w', encoding='utf-8') as f:
+            json.dump({'sample_rate': self.sample_rate, 'num_clips': len(self.rows),
+                       'total_samples': self.offsets['audio']}, f, indent=2)
+
+
+class PackedVoiceShard:
+    def __init__(self, prefix):
+        files = _shard_files(prefix)
+        with open(files['info'], 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        self.index = np.load(files['index'], mmap_mode='r')
+        self.audio = _memmap(files['audio'], AUDIO_DTYPE)
+        self.text = _memmap(files['text'], TEXT_DTYPE)
+        self.codes = _memmap(files['codes'], CODES_DTYPE)
+        self.strings = _memmap(files['strings'], np.uint8)
+        self.cond = _memmap(files['cond'], COND_DTYPE)
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def audio_window(self, row, start=0, length=None):
+        entry = self.index[row]
+        total = int(entry['audio_len'])
+        length = total - start if length is None else min(length, total - start)
+        off = int(entry['audio_off']) + start
+        # The slice is a view into the page cache; the conversion to float is the only copy made.
+        return torch.from_numpy(self.audio[off:off+length].astype(np.float32) / 32767).unsqueeze(0)
+
+
+class PackedVoiceDataset(torch.utils.data.Dataset):
+    """
+    Reads paired text/audio samples from shards written by PackedVoiceShardWriter (see
+    scripts/audio/preparation/pack_paired_voice_dataset.py). Produces the same outputs as the paired_voice_audio
+    dataset, but each sample is a couple of slices of memory mapped files rather than a file open and an audio decode,
+    so dataloader workers share pages through the OS page cache.
+    """
+    def __init__(self, hparams):
+        self.paths = hparams['path']
+        if not isinstance(self.paths, list):
+            self.paths = [self.paths]
+        self.sample_rate = opt_get(hparams, ['sample_rate'], 22050)
+        self.load_conditioning = opt_get(hparams, ['load_conditioning'], False)
+        self.conditioning_candidates = opt_get(hparams, ['num_conditioning_candidates'], 1)
+        self.conditioning_length = opt_get(hparams, ['conditioning_length'], 44100)
+        self.load_aligned_codes = opt_get(hparams, ['load_aligned_codes'], False)
+        self.aligned_codes_to_audio_ratio = opt_get(hparams, ['aligned_codes_ratio'], 443)
+        self.max_wav_len = opt_get(hparams, ['max_wav_length'], None)
+        self.max_text_len = opt_get(hparams, ['max_text_length'], None)
+        assert self.max_wav_len is not None and self.max_text_len is not None
+        self.max_aligned_codes = self.max_wav_len // self.aligned_codes_to_audio_ratio
+
+        # Only the shard lengths are read here. The memory maps themselves are opened lazily so that each dataloader
+        # worker creates its own after forking.
+        self.shards = None
+        self.cumulative_sizes = []
+        total = 0
+        for p in self.paths:
+            shard = PackedVoiceShard(p)
+            assert shard.info['sample_rate'] == self.sample_rate, f'{p} was packed at {shard.info["sample_rate"]}hz, not {self.sample_rate}hz.'
+            total += len(shard)
+            self.cumulative_sizes.append(total)
+
+    def get_shard(self, index):
+        if self.shards is None:
+            self.shards = [PackedVoiceShard(p) for p in self.paths]
+        s = bisect.bisect_right(self.cumulative_sizes, index)
+        row = index - (self.cumulative_sizes[s-1] if s > 0 else 0)
+        return self.shards[s], row
+
+    def get_conditioning(self, shard, row):
+        entry = shard.index[row]
+        cands = shard.cond[int(entry['cond_off']):int(entry['cond_off'])+int(entry['cond_len'])]
+        clips = []
+        contains_self = False
+        for k in range(self.conditioning_candidates):
+            cand = int(random.choice(cands))
+            contains_self = contains_self or cand == row
+            gap = int(shard.index[cand]['audio_len']) - self.conditioning_length
+            start = random.randint(0, gap) if gap > 0 else 0
+            clip = shard.audio_window(cand, start, self.conditioning_length)
+            if clip.shape[-1] < self.conditioning_length:
+                clip = F.pad(clip, (0, self.conditioning_length - clip.shape[-1]))
+            clips.append(clip)
+        if self.conditioning_candidates > 1:
+            return torch.stack(clips, dim=0), contains_self
+        return clips[0], contains_self
+
+    def __getitem__(self, index):
+        shard, row = self.get_shard(index)
+        entry = shard.index[row]
+        str_off, path_len, text_len = int(entry['str_off']), int(entry['path_len']), int(entry['real_text_len'])
+        path = bytes(shard.strings[str_off:str_off+path_len]).decode('utf-8')
+        text = bytes(shard.strings[str_off+path_len:str_off+path_len+text_len]).decode('utf-8')
+        tseq = torch.from_numpy(np.array(shard.text[int(entry['text_off']):int(entry['text_off'])+int(entry['text_len'])]))
+        wav = shard.audio_window(row)
+
+        if wav.shape[-1] > self.max_wav_len or tseq.shape[0] > self.max_text_len:
+            # Shards can be packed with looser limits than a given training run uses. Skew the dataset slightly rather
+            # than failing, as the other paired voice datasets do.
+            return self[random.randint(0, len(self)-1)]
+
+        orig_output = wav.shape[-1]
+        orig_text_len = tseq.shape[0]
+        wav = F.pad(wav, (0, self.max_wav_len - wav.shape[-1]))
+        tseq = F.pad(tseq, (0, self.max_text_len - tseq.shape[0]))
+        res = {
+            'real_text': text,
+            'padded_text': tseq,
+            'text_lengths': torch.tensor(orig_text_len, dtype=torch.long),
+            'wav': wav,
+            'wav_lengths': torch.tensor(orig_output, dtype=torch.long),
+            'filenames': path,
+            'skipped_items': 1,
+            'type': int(entry['type']),
+        }
+        if self.load_conditioning:
+            res['conditioning'], res['conditioning_contains_self'] = self.get_conditioning(shard, row)
+        if self.load_aligned_codes:
+            codes_off, codes_len = int(entry['codes_off']), int(entry['codes_len'])
+            aligned_codes = torch.from_numpy(shard.codes[codes_off:codes_off+codes_len].astype(np.int64))
+            res['aligned_codes'] = F.pad(aligned_codes, (0, self.max_aligned_codes - aligned_codes.shape[0]))
+            res['aligned_codes_lengths'] = codes_len
+        return res
+
+    def __len__(self):
+        return self.cumulative_sizes[-1]
+
+
+if __name__ == '__main__':
+    params = {
+        'mode': 'packed_paired_voice_audio',
+        'path': ['Y:\\packed\\libritts_train_clean_100'],
+        'phase': 'train',
+        'n_workers': 0,
+        'batch_size': 16,
+        'max_wav_length': 255995,
+        'max_text_length': 200,
+        'sample_rate': 22050,
+        'load_conditioning': True,
+        'num_conditioning_candidates': 2,
+        'conditioning_length': 44000,
+    }
+    from data import create_dataset, create_dataloader
+
+    ds = create_dataset(params)
+    dl = create_dataloader(ds, params)
+    for i, b in tqdm(enumerate(dl)):
+        if i > 100:
+            break
@@ -1,16 +1,25 @@
+import math
 import os
 import random
 import sys
+from array import array
 
+import numpy as np
 import torch
 import torch.nn.functional as F
 import torch.utils.data
 import torchaudio
 from tqdm import tqdm
 
+from data.audio.dvae_code_cache import DvaeCodeCache
+from data.audio.length_index import load_length_index, length_filter
+from data.audio.similarity_index import SimilarityIndex
+from data.audio.token_index import load_token_index
 from data.audio.unsupervised_audio_dataset import load_audio, load_similar_clips
+from data.data_sampler import compute_length_buckets
 from models.audio.tts.tacotron2 import load_filepaths_and_text, load_filepaths_and_text_type
 from models.audio.tts.tacotron2 import text_to_sequence, sequence_to_text
+from utils.audio_cache import get_audio_cache
 from utils.util import opt_get
 
 
@@ -113,6 +122,90 @@ def load_voxpopuli(filename, type):
     return filepaths_and_text
 
 
+class CompactManifest:
+    """
+    Stores the rows produced by the fetchers above (path, text, [aligned codes,] type) in a handful of flat numpy
+    buffers instead of a list of lists. Forked dataloader workers only ever read these buffers, so unlike a list of
+    python objects (whose refcounts are touched on every access) the pages are never copied-on-write.
+
+    Rows are materialized on access in the same layout the fetchers return them in. When has_tokens is set, the token
+    ids of every row's text (from data.audio.token_index) are stored alongside and returned by tokens().
+    """
+    def __init__(self, has_codes, has_tokens=False):
+        self.has_codes = has_codes
+        self.has_tokens = has_tokens
+        self._token_chunks = []
+        self._strings = bytearray()
+        self._string_offsets = array('q', [0])
+        self._codes = []
+        self._codes_offsets = array('q', [0])
+        self._types = array('q')
+        self.order = None
+
+    def extend(self, rows, tokens=None):
+        """
+        Appends [rows]. [tokens] is required when has_tokens is set: the (tokens, offsets, valid) arrays of these rows,
+        as returned by data.audio.token_index.load_token_index().
+        """
+        assert (tokens is not None) == self.has_tokens
+        if tokens is not None:
+            self._token_chunks.append(tokens)
+        for row in rows:
+            for s in (row[0], row[1]):
+                self._strings.extend(s.encode('utf-8'))
+                self._string_offsets.append(len(self._strings))
+            if self.has_codes:
+                codes = np.asarray(row[2], dtype=np.int16)
+                self._codes.append(codes)
+                self._codes_offsets.append(self._codes_offsets[-1] + codes.shape[0])
+            self._types.append(int(row[-1]))
+
+    def finalize(self, seed):
+        """
+        Converts the buffers built by extend() into numpy arrays and shuffles the row order deterministically.
+        """
+        self.strings = np.frombuffer(bytes(self._strings), dtype=np.uint8)
+        self.string_offsets = np.frombuffer(self._string_offsets, dtype=np.int64).copy()
+        self.types = np.frombuffer(self._types, dtype=np.int64).astype(np.int32)
+        self.codes = np.concatenate(self._codes) if self._codes else np.zeros((0,), dtype=np.int16)
+        self.codes_offsets = np.frombuffer(self._codes_offsets, dtype=np.int64).copy()
+        if self.has_tokens:
+            self.tokens_flat = np.concatenate([c[0] for c in self._token_chunks])
+            base = np.cumsum([0] + [c[0].shape[0] for c in self._token_chunks[:-1]])
+            self.token_offsets = np.concatenate([np.zeros((1,), dtype=np.int64)] +
+                                                [c[1][1:] + b for c, b in zip(self._token_chunks, base)])
+            self.tokens_valid = np.concatenate([c[2] for c in self._token_chunks])
+        del self._strings, self._string_offsets, self._codes, self._codes_offsets, self._types, self._token_chunks
+        self.order = np.random.RandomState(seed).permutation(self.types.shape[0])
+
+    def _string(self, i):
+        return bytes(self.strings[self.string_offsets[i]:self.string_offsets[i+1]]).decode('utf-8')
+
+    def __getitem__(self, index):
+        j = int(self.order[index])
+        row = [self._string(2*j), self._string(2*j+1)]
+        if self.has_codes:
+            row.append(torch.from_numpy(self.codes[self.codes_offsets[j]:self.codes_offsets[j+1]].astype(np.int64)))
+        row.append(int(self.types[j]))
+        return row
+
+    def tokens(self, index):
+        """
+        Returns the pretokenized text of row [index], or None if it could not be tokenized.
+        """
+        j = int(self.order[index])
+        if not self.tokens_valid[j]:
+            return None
+        return self.tokens_flat[self.token_offsets[j]:self.token_offsets[j+1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return self.order.shape[0]
+
+
 class CharacterTokenizer:
     def encode(self, txt):
         return text_to_sequence(txt, ['english_cleaners'])
@@ -136,51 +229,134 @@ class TextWavLoader(torch.utils.data.Dataset):
         self.load_conditioning = opt_get(hparams, ['load_conditioning'], False)
         self.conditioning_candidates = opt_get(hparams, ['num_conditioning_candidates'], 1)
         self.conditioning_length = opt_get(hparams, ['conditioning_length'], 44100)
+        self.similarity_index = opt_get(hparams, ['similarity_index'], None)  # Built by scripts/audio/preparation/build_similarity_index.py
+        if self.similarity_index is not None:
+            self.similarity_index = SimilarityIndex(self.similarity_index)
         self.debug_failures = opt_get(hparams, ['debug_loading_failures'], False)
         self.load_aligned_codes = opt_get(hparams, ['load_aligned_codes'], False)
+        # With zero_pad_collate, items are returned unpadded and data.zero_pad_dict_collate pads each batch to its
+        # longest item instead of the maximum (or bucket) length.
+        self.pad_in_collate = opt_get(hparams, ['zero_pad_collate'], False)
         self.aligned_codes_to_audio_ratio = opt_get(hparams, ['aligned_codes_ratio'], 443)
-        self.audiopaths_and_text = []
+        # Length indices are built by scripts/audio/preparation/build_length_index.py and are required for bucketing.
+        self.use_length_index = opt_get(hparams, ['length_index'], False)
+        self.filter_by_length_index = opt_get(hparams, ['length_index_filter'], True)
+        self.num_length_buckets = opt_get(hparams, ['num_length_buckets'], None)
+        assert self.num_length_buckets is None or self.use_length_index
+        # Dynamic batching: rather than a fixed batch_size, each (global) batch is filled up to a budget of padded audio
+        # samples, or of MEL frames. Requires bucketing, since the budget is spent against each bucket's pad length.
+        # batch_size is still required and is used for validation. LR schedules stay in units of optimizer steps.
+        self.max_batch_samples = opt_get(hparams, ['max_batch_samples'], None)
+        max_batch_mel_frames = opt_get(hparams, ['max_batch_mel_frames'], None)
+        if max_batch_mel_frames is not None:
+            assert self.max_batch_samples is None
+            self.max_batch_samples = max_batch_mel_frames * opt_get(hparams, ['mel_hop_length'], 256)
+        assert self.max_batch_samples is None or self.num_length_buckets is not None
+        self.use_bpe_tokenizer = opt_get(hparams, ['use_bpe_tokenizer'], True)
+        if self.use_bpe_tokenizer:
+            from data.audio.voice_tokenizer import VoiceBpeTokenizer
+            self.tokenizer = VoiceBpeTokenizer(opt_get(hparams, ['tokenizer_vocab'], '../experiments/bpe_lowercase_asr_256.json'))
+        else:
+            self.tokenizer = CharacterTokenizer()
+        # Token indices are built by scripts/audio/preparation/pretokenize.py. With them, text is never cleaned or
+        # tokenized during training.
+        self.pretokenized = opt_get(hparams, ['pretokenized'], False)
+        self.audiopaths_and_text = CompactManifest(self.load_aligned_codes, has_tokens=self.pretokenized)
+        length_indices = []
         for p, fm, type in zip(self.path, fetcher_mode, self.types):
-            if fm == 'lj' or fm == 'libritts':
-                fetcher_fn = load_filepaths_and_text_type
-            elif fm == 'tsv':
-                fetcher_fn = load_tsv_aligned_codes_type if self.load_aligned_codes else load_tsv_type
-            elif fm == 'mozilla_cv':
-                assert not self.load_conditioning  # Conditioning inputs are incompatible with mozilla_cv
-                fetcher_fn = load_mozilla_cv
-            elif fm == 'voxpopuli':
-                assert not self.load_conditioning  # Conditioning inputs are incompatible with voxpopuli
-                fetcher_fn = load_voxpopuli
-            else:
-                raise NotImplementedError()
-            self.audiopaths_and_text.extend(fetcher_fn(p, type))
+            rows = self.get_fetcher(fm)(p, type)
+            if self.use_length_index:
+                length_indices.append(load_length_index(p, len(rows)))
+            tokens = load_token_index(p, len(rows), self.tokenizer) if self.pretokenized else None
+            self.audiopaths_and_text.extend(rows, tokens)
+        del rows, tokens
         self.text_cleaners = hparams.text_cleaners
         self.sample_rate = hparams.sample_rate
         random.seed(hparams.seed)
-        random.shuffle(self.audiopaths_and_text)
+        self.audiopaths_and_text.finalize(hparams.seed)
         self.max_wav_len = opt_get(hparams, ['max_wav_length'], None)
         if self.max_wav_len is not None:
             self.max_aligned_codes = self.max_wav_len // self.aligned_codes_to_audio_ratio
         self.max_text_len = opt_get(hparams, ['max_text_length'], None)
         assert self.max_wav_len is not None and self.max_text_len is not None
-        self.use_bpe_tokenizer = opt_get(hparams, ['use_bpe_tokenizer'], True)
-        if self.use_bpe_tokenizer:
-            from data.audio.voice_tokenizer import VoiceBpeTokenizer
-            self.tokenizer = VoiceBpeTokenizer(opt_get(hparams, ['tokenizer_vocab'], '../experiments/bpe_lowercase_asr_256.json'))
-        else:
-            self.tokenizer = CharacterTokenizer()
+        # Opt-in on-disk cache of decoded & resampled audio: `decoded_audio_cache: {path, max_size_gb, dtype}`.
+        self.audio_cache = get_audio_cache(opt_get(hparams, ['decoded_audio_cache'], None))
+        # When specified, DVAE codes (and optionally MELs) are loaded from a cache built by
+        # scripts/audio/preparation/cache_dvae_codes.py rather than computed in the training step. Clips missing from
+        # the cache are treated as loading failures.
+        self.dvae_code_cache = opt_get(hparams, ['dvae_code_cache'], None)
+        self.load_cached_mels = opt_get(hparams, ['dvae_code_cache_load_mels'], False)
+        if self.dvae_code_cache is not None:
+            self.dvae_code_cache = DvaeCodeCache(self.dvae_code_cache)
+            self.dvae_code_cache.check_compatible(sample_rate=self.sample_rate, max_wav_length=self.max_wav_len)
+
+        self.buckets = None
+        if self.use_length_index:
+            lengths = np.concatenate(length_indices)[self.audiopaths_and_text.order]
+            if self.filter_by_length_index:
+                # Drop clips that __getitem__ would reject anyway, so that they are never decoded.
+                keep = length_filter(lengths, self.sample_rate, self.max_wav_len, .6 * self.sample_rate, self.max_text_len)
+                print(f'Length index: dropping {(~keep).sum()} of {keep.shape[0]} clips that are unreadable or out of range.')
+                self.audiopaths_and_text.order = self.audiopaths_and_text.order[keep]
+                lengths = lengths[keep]
+            self.item_wav_lengths = np.where(lengths['duration'] < 0, -1,
+                                             np.round(lengths['duration'] * self.sample_rate)).astype(np.int64)
+            self.item_text_lengths = lengths['text_len'].astype(np.int64)
+            if self.num_length_buckets is not None:
+                self.setup_length_buckets()
         self.skipped_items = 0  # records how many items are skipped when accessing an index.
 
-    def get_wav_text_pair(self, audiopath_and_text):
+    def get_fetcher(self, fm):
+        if fm == 'lj' or fm == 'libritts':
+            return load_filepaths_and_text_type
+        elif fm == 'tsv':
+            return load_tsv_aligned_codes_type if self.load_aligned_codes else load_tsv_type
+        elif fm == 'mozilla_cv':
+            assert not self.load_conditioning  # Conditioning inputs are incompatible with mozilla_cv
+            return load_mozilla_cv
+        elif fm == 'voxpopuli':
+            assert not self.load_conditioning  # Conditioning inputs are incompatible with voxpopuli
+            return load_voxpopuli
+        raise NotImplementedError()
+
+    def setup_length_buckets(self):
+        """
+        Groups items into buckets of similar audio length (for data.data_sampler.BucketBatchSampler). Every item is
+        then padded to the audio length bound of its bucket and the longest text in its bucket, rather than to
+        max_wav_length and max_text_length.
+        """
+        wav_lengths = self.item_wav_lengths.copy()
+        wav_lengths[(self.item_text_lengths < 0) | (self.item_text_lengths > self.max_text_len)] = -1
+        boundaries, self.item_bucket = compute_length_buckets(wav_lengths, self.num_length_buckets, self.max_wav_len)
+        self.buckets = [np.flatnonzero(self.item_bucket == b) for b in range(len(boundaries))]
+        self.bucket_wav_len = boundaries.tolist()
+        self.bucket_text_len = [int(self.item_text_lengths[b].max()) if len(b) > 0 else self.max_text_len
+                                for b in self.buckets]
+
+    def get_pad_lengths(self, index):
+        if self.buckets is None:
+            return self.max_wav_len, self.max_text_len
+        b = self.item_bucket[index]
+        return self.bucket_wav_len[b], self.bucket_text_len[b]
+
+    def get_replacement_index(self, index, sequential):
+        # Items in a bucketed batch must share pad lengths, so replacements are drawn from the same bucket.
+        if self.buckets is not None:
+            return int(random.choice(self.buckets[self.item_bucket[index]]))
+        return (index+1) % len(self) if sequential else random.randint(0, len(self)-1)
+
+    def get_wav_text_pair(self, audiopath_and_text, tokens=None):
         # separate filename and text
-        audiopath, text, type = audiopath_and_text[0], audiopath_and_text[1], audiopath_and_text[2]
-        text_seq = self.get_text(text)
-        wav = load_audio(audiopath, self.sample_rate)
+        audiopath, text, type = audiopath_and_text[0], audiopath_and_text[1], audiopath_and_text[-1]
+        text_seq = self.get_text(text) if tokens is None else self.check_tokens(torch.from_numpy(tokens.astype(np.int32)))
+        wav = load_audio(audiopath, self.sample_rate, self.audio_cache)
         return (text_seq, wav, text, audiopath_and_text[0], type)
 
     def get_text(self, text):
         tokens = self.tokenizer.encode(text)
-        tokens = torch.IntTensor(tokens)
+        return self.check_tokens(torch.IntTensor(tokens))
+
+    def check_tokens(self, tokens):
         if self.use_bpe_tokenizer:
             # Assert if any UNK,start tokens encountered.
             assert not torch.any(tokens == 1)
@@ -190,45 +366,58 @@ class TextWavLoader(torch.utils.data.Dataset):
 
     def __getitem__(self, index):
         self.skipped_items += 1
+        apt = self.audiopaths_and_text[index]
         try:
-            tseq, wav, text, path, type = self.get_wav_text_pair(self.audiopaths_and_text[index])
+            tokens = None
+            if self.pretokenized:
+                tokens = self.audiopaths_and_text.tokens(index)
+                if tokens is None:
+                    raise ValueError(f'{apt[0]} has untokenizable text.')
+            tseq, wav, text, path, type = self.get_wav_text_pair(apt, tokens)
             if text is None or len(text.strip()) == 0:
                 raise ValueError
             if wav is None or wav.shape[-1] < (.6 * self.sample_rate):
                 # Ultra short clips are also useless (and can cause problems within some models).
                 raise ValueError
-            cond, cond_is_self = load_similar_clips(self.audiopaths_and_text[index][0], self.conditioning_length, self.sample_rate,
-                                      n=self.conditioning_candidates) if self.load_conditioning else (None, False)
+            cond, cond_is_self = load_similar_clips(apt[0], self.conditioning_length, self.sample_rate,
+                                      n=self.conditioning_candidates, similarity_index=self.similarity_index,
+                                      audio_cache=self.audio_cache) if self.load_conditioning else (None, False)
+            if self.dvae_code_cache is not None:
+                cached = self.dvae_code_cache.get_for_file(path, load_mel=self.load_cached_mels)
+                if cached is None:
+                    raise ValueError(f'{path} is not in the DVAE code cache.')
+                mel_codes, cached_mel = cached
         except:
             if self.skipped_items > 100:
                 raise  # Rethrow if we have nested too far.
             if self.debug_failures:
-                print(f"error loading {self.audiopaths_and_text[index][0]} {sys.exc_info()}")
-            return self[(index+1) % len(self)]
+                print(f"error loading {apt[0]} {sys.exc_info()}")
+            return self[self.get_replacement_index(index, sequential=True)]
 
         if self.load_aligned_codes:
-            aligned_codes = self.audiopaths_and_text[index][3]
+            aligned_codes = apt[2]
 
         actually_skipped_items = self.skipped_items
         self.skipped_items = 0
+        pad_wav_len, pad_text_len = self.get_pad_lengths(index)
         if wav is None or \
-            (self.max_wav_len is not None and wav.shape[-1] > self.max_wav_len) or \
-            (self.max_text_len is not None and tseq.shape[0] > self.max_text_len):
+            (pad_wav_len is not None and wav.shape[-1] > pad_wav_len) or \
+            (pad_text_len is not None and tseq.shape[0] > pad_text_len):
             # Basically, this audio file is nonexistent or too long to be supported by the dataset.
             # It's hard to handle this situation properly. Best bet is to return the a random valid token and skew the dataset somewhat as a result.
             if self.debug_failures:
                 print(f"error loading {path}: ranges are out of bounds; {wav.shape[-1]}, {tseq.shape[0]}")
-            rv = random.randint(0,len(self)-1)
+            rv = self.get_replacement_index(index, sequential=False)
             return self[rv]
         orig_output = wav.shape[-1]
         orig_text_len = tseq.shape[0]
-        if wav.shape[-1] != self.max_wav_len:
-            wav = F.pad(wav, (0, self.max_wav_len - wav.shape[-1]))
+        if wav.shape[-1] != pad_wav_len and not self.pad_in_collate:
+            wav = F.pad(wav, (0, pad_wav_len - wav.shape[-1]))
             if self.load_aligned_codes:
                 # These codes are aligned to audio inputs, so make sure to pad them as well.
-                aligned_codes = F.pad(aligned_codes, (0, self.max_aligned_codes-aligned_codes.shape[0]))
-        if tseq.shape[0] != self.max_text_len:
-            tseq = F.pad(tseq, (0, self.max_text_len - tseq.shape[0]))
+                aligned_codes = F.pad(aligned_codes, (0, pad_wav_len // self.aligned_codes_to_audio_ratio - aligned_codes.shape[0]))
+        if tseq.shape[0] != pad_text_len and not self.pad_in_collate:
+            tseq = F.pad(tseq, (0, pad_text_len - tseq.shape[0]))
         res = {
             'real_text': text,
             'padded_text': tseq,
@@ -244,6 +433,16 @@ class TextWavLoader(torch.utils.data.Dataset):
             res['conditioning_contains_self'] = cond_is_self
         if self.load_aligned_codes:
             res['aligned_codes'] = aligned_codes
+        if self.dvae_code_cache is not None:
+            # Cached codes (and MELs) were computed from the clip zero-padded to max_wav_len. Cut them to the length the
+            # wav is padded to here (which can be shorter, e.g. with length buckets or zero_pad_collate) and report how
+            # much of them covers the clip itself, so that auto_collate trims them along with the wav.
+            for key, cached in [('mel_codes', mel_codes), ('mel', cached_mel)]:
+                if cached is None:
+                    continue
+                per_sample = cached.shape[-1] / self.max_wav_len
+                res[key] = cached[..., :math.ceil(wav.shape[-1] * per_sample)]
+                res[f'{key}_lengths'] = torch.tensor(math.ceil(orig_output * per_sample), dtype=torch.long)
         return res
 
     def __len__(self):
@@ -1,4 +1,7 @@
+import bisect
+import json
 import os
+import random
 from pathlib import Path
 
 import numpy as np
@@ -52,6 +55,146 @@ class PreprocessedMelDataset(torch.utils.data.Dataset):
         return len(self.paths)
 
 
+MEL_DTYPE = np.float16
+MEL_INDEX_DTYPE = np.dtype([('mel_off', np.int64), ('mel_len', np.int64), ('str_off', np.int64), ('str_len', np.int64)])
+
+
+def _mel_store_files(prefix):
+    return {
+        'info': f'{prefix}.json',
+        'index': f'{prefix}.index.npy',
+        'mels': f'{prefix}.mels.bin',
+        'strings': f'{prefix}.paths.bin',
+    }
+
+
+class PackedMelWriter:
+    """
+    Appends MELs to a single float16 file, stored time-major ((frames, channels) per MEL) so that any window of frames
+    is one contiguous slice. Each MEL is described by a row of an offsets/lengths index; the source paths are kept in a
+    separate string blob. Every MEL must have the same shape apart from its last (time) dimension.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.files = _mel_store_files(prefix)
+        os.makedirs(os.path.dirname(os.path.abspath(prefix)), exist_ok=True)
+        self.mels = open(self.files['mels'], 'wb')
+        self.strings = open(self.files['strings'], 'wb')
+        self.mel_shape = None
+        self.rows = []
+        self.mel_off = 0
+        self.str_off = 0
+
+    def add(self, mel, path):
+        mel = np.asarray(mel)
+        if self.mel_shape is None:
+            self.mel_shape = list(mel.shape[:-1])
+        assert list(mel.shape[:-1]) == self.mel_shape, f'{path} has shape {mel.shape}, expected {self.mel_shape}+[frames]'
+        frames = mel.reshape(-1, mel.shape[-1]).T.astype(MEL_DTYPE)
+        path_bytes = path.encode('utf-8')
+        self.rows.append((self.mel_off, frames.shape[0], self.str_off, len(path_bytes)))
+        self.mels.write(np.ascontiguousarray(frames).tobytes())
+        self.strings.write(path_bytes)
+        self.mel_off += frames.shape[0]
+        self.str_off += len(path_bytes)
+
+    def close(self):
+        self.mels.close()
+        self.strings.close()
+        np.save(self.files['index'], np.array(self.rows, dtype=MEL_INDEX_DTYPE))
+        with open(self.files['info'], 'w', encoding='utf-8') as f:
+            json.dump({'mel_shape': self.mel_shape, 'num_mels': len(self.rows), 'total_frames': self.mel_off}, f, indent=2)
+
+
+class PackedMelStore:
+    def __init__(self, prefix):
+        files = _mel_store_files(prefix)
+        with open(files['info'], 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        self.index = np.load(files['index'], mmap_mode='r')
+        self.channels = int(np.prod(self.info['mel_shape']))
+        # Copy-on-write rather than read-only, so slices can be wrapped with torch.from_numpy() without a copy.
+        self.mels = np.memmap(files['mels'], dtype=MEL_DTYPE, mode='c').reshape(-1, self.channels) \
+            if self.info['total_frames'] > 0 else np.zeros((0, self.channels), dtype=MEL_DTYPE)
+        self.strings = np.memmap(files['strings'], dtype=np.uint8, mode='r') if os.path.getsize(files['strings']) > 0 \
+            else np.zeros((0,), dtype=np.uint8)
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def path(self, row):
+        entry = self.index[row]
+        return bytes(self.strings[int(entry['str_off']):int(entry['str_off'])+int(entry['str_len'])]).decode('utf-8')
+
+
+class PackedMelDataset(torch.utils.data.Dataset):
+    """
+    Reads MELs from stores written by PackedMelWriter (see scripts/audio/preparation/pack_mels.py). Produces the same
+    outputs as PreprocessedMelDataset, but each item is a slice of a memory mapped file rather than a file open and a
+    zlib decompression. MELs longer than pad_to_samples are randomly cropped when random_crop is set; only the cropped
+    frames are read.
+    """
+    def __init__(self, opt):
+        self.paths = opt['path']
+        if not isinstance(self.paths, list):
+            self.paths = [self.paths]
+        self.pad_to = opt_get(opt, ['pad_to_samples'], 10336)
+        self.squeeze = opt_get(opt, ['should_squeeze'], False)
+        self.random_crop = opt_get(opt, ['random_crop'], False)
+
+        # Stores are opened lazily so that every dataloader worker maps them itself.
+        self.stores = None
+        self.cumulative_sizes = []
+        total = 0
+        self.mel_shape = None
+        for p in self.paths:
+            store = PackedMelStore(p)
+            assert self.mel_shape is None or self.mel_shape == store.info['mel_shape']
+            self.mel_shape = store.info['mel_shape']
+            total += len(store)
+            self.cumulative_sizes.append(total)
+
+        # The mask of an item with n frames is a window of this tensor: n zeros followed by ones up to pad_to.
+        mask_shape = [d for d in self.mel_shape if not self.squeeze or d != 1]
+        self.mask_template = torch.cat([torch.zeros(mask_shape + [self.pad_to]), torch.ones(mask_shape + [self.pad_to])], dim=-1)
+
+    def get_store(self, index):
+        if self.stores is None:
+            self.stores = [PackedMelStore(p) for p in self.paths]
+        s = bisect.bisect_right(self.cumulative_sizes, index)
+        return self.stores[s], index - (self.cumulative_sizes[s-1] if s > 0 else 0)
+
+    def __getitem__(self, index):
+        store, row = self.get_store(index)
+        entry = store.index[row]
+        off, frames = int(entry['mel_off']), int(entry['mel_len'])
+        if frames > self.pad_to:
+            assert self.random_crop, f'{store.path(row)} has {frames} frames; more than pad_to_samples={self.pad_to}'
+            off += random.randint(0, frames - self.pad_to)
+            frames = self.pad_to
+
+        # Copy the frames straight from the mapped store into the padded (channels, time) output, transposing them and
+        # converting them to float32 in that single copy.
+        mel = torch.zeros((store.channels, self.pad_to))
+        mel[:, :frames].copy_(torch.from_numpy(store.mels[off:off+frames]).T)
+        mel = mel.view(self.mel_shape + [self.pad_to])
+        if self.squeeze:
+            mel = mel.squeeze()
+        mask = self.mask_template[..., self.pad_to-frames:2*self.pad_to-frames]
+
+        output = {
+            'mel': mel,
+            'mel_lengths': torch.tensor(mel.shape[-1]),
+            'mask': mask,
+            'mask_lengths': torch.tensor(mask.shape[-1]),
+            'path': store.path(row),
+        }
+        return output
+
+    def __len__(self):
+        return self.cumulative_sizes[-1]
+
+
 if __name__ == '__main__':
     params = {
         'mode': 'preprocessed_mel',
@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+import torch
+
+
+def _index_files(prefix):
+    return {
+        'paths': f'{prefix}.paths.bin',
+        'path_offsets': f'{prefix}.path_offsets.npy',
+        'neighbors': f'{prefix}.neighbors.npy',
+        'neighbor_offsets': f'{prefix}.neighbor_offsets.npy',
+    }
+
+
+def build_similarity_index(roots, output_prefix):
+    """
+    Merges every similarities.pth found under [roots] into one index readable by SimilarityIndex. Clip ids are the
+    positions of the (normalized, absolute) clip paths in sorted order.
+    """
+    if not isinstance(roots, list):
+        roots = [roots]
+    neighbors_by_path = {}
+    for root in roots:
+        for dirpath, _, fnames in os.walk(root):
+            if 'similarities.pth' not in fnames:
+                continue
+            sims = torch.load(os.path.join(dirpath, 'similarities.pth'))
+            for fname, similar in sims.items():
+                path = os.path.normpath(os.path.abspath(os.path.join(dirpath, fname)))
+                neighbors_by_path[path] = [os.path.normpath(os.path.abspath(os.path.join(dirpath, s))) for s in similar]
+
+    all_paths = set(neighbors_by_path.keys())
+    for similar in neighbors_by_path.values():
+        all_paths.update(similar)
+    all_paths = sorted(all_paths)
+    ids = {p: i for i, p in enumerate(all_paths)}
+
+    files = _index_files(output_prefix)
+    path_offsets = np.zeros((len(all_paths)+1,), dtype=np.int64)
+    with open(files['paths'], 'wb') as f:
+        for i, p in enumerate(all_paths):
+            b = p.encode('utf-8')
+            f.write(b)
+            path_offsets[i+1] = path_offsets[i] + len(b)
+    np.save(files['path_offsets'], path_offsets)
+
+    neighbor_offsets = np.zeros((len(all_paths)+1,), dtype=np.int64)
+    neighbors = []
+    for i, p in enumerate(all_paths):
+        n = [ids[s] for s in neighbors_by_path.get(p, [])]
+        neighbors.extend(n)
+        neighbor_offsets[i+1] = neighbor_offsets[i] + len(n)
+    np.save(files['neighbors'], np.asarray(neighbors, dtype=np.int64))
+    np.save(files['neighbor_offsets'], neighbor_offsets)
+    return len(all_paths)
+
+
+class SimilarityIndex:
+    """
+    Read-only, memory mapped view of an index built by build_similarity_index(). Paths are located by binary search
+    over the sorted path blob, so no per-clip python objects are held in memory.
+    """
+    def __init__(self, prefix):
+        files = _index_files(prefix)
+        self.paths = np.memmap(files['paths'], dtype=np.uint8, mode='r') if os.path.getsize(files['paths']) > 0 \
+            else np.zeros((0,), dtype=np.uint8)
+        self.path_offsets = np.load(files['path_offsets'], mmap_mode='r')
+        self.neighbors = np.load(files['neighbors'], mmap_mode='r')
+        self.neighbor_offsets = np.load(files['neighbor_offsets'], mmap_mode='r')
+
+    def __len__(self):
+        return self.path_offsets.shape[0] - 1
+
+    def path_of(self, id):
+        return bytes(self.paths[self.path_offsets[id]:self.path_offsets[id+1]]).decode('utf-8')
+
+    def id_of(self, path):
+        """
+        Returns the id of [path], or None if it is not in the index.
+        """
+        path = os.path.normpath(os.path.abspath(path))
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.path_of(mid) < path:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self) and self.path_of(lo) == path:
+            return lo
+        return None
+
+    def neighbor_ids(self, id):
+        return self.neighbors[self.neighbor_offsets[id]:self.neighbor_offsets[id+1]]
+
+    def similar_paths(self, path):
+        """
+        Returns the paths recorded as similar to [path]; empty if [path] is not in the index.
+        """
+        id = self.id_of(path)
+        if id is None:
+            return []
+        return [self.path_of(int(n)) for n in self.neighbor_ids(id)]
@@ -0,0 +1,82 @@
+import hashlib
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+TOKEN_INDEX_VERSION = 1
+
+
+def token_index_path(manifest):
+    return f'{manifest}.tokens.npz'
+
+
+def tokenizer_key(tokenizer):
+    """
+    Identifies the tokenizer a token index was built with: the contents of its vocab file if it has one, otherwise its
+    class. An index built with a different tokenizer must not be used.
+    """
+    vocab_file = getattr(tokenizer, 'vocab_file', None)
+    if vocab_file is None:
+        return type(tokenizer).__name__
+    with open(vocab_file, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def build_token_index(manifest, rows, tokenizer, batch_size=1024):
+    """
+    Tokenizes the text of every row of [manifest] (as returned by its fetcher) and writes the token ids next to it, as
+    one flat int16 array plus row offsets. Rows whose text could not be tokenized get no tokens and are marked invalid.
+    Returns the number of invalid rows.
+    """
+    texts = [r[1] for r in rows]
+    encode_batch = getattr(tokenizer, 'encode_batch', None)
+    tokens = []
+    offsets = np.zeros((len(texts)+1,), dtype=np.int64)
+    valid = np.ones((len(texts),), dtype=bool)
+    for start in tqdm(range(0, len(texts), batch_size)):
+        batch = texts[start:start+batch_size]
+        try:
+            encoded = encode_batch(batch) if encode_batch is not None else [tokenizer.encode(t) for t in batch]
+        except:
+            # Fall back to one text at a time to find the offending rows.
+            encoded = []
+            for i, t in enumerate(batch):
+                try:
+                    encoded.append(tokenizer.encode(t))
+                except:
+                    encoded.append([])
+                    valid[start+i] = False
+        for i, e in enumerate(encoded):
+            tokens.extend(e)
+            offsets[start+i+1] = len(tokens)
+    tokens = np.asarray(tokens, dtype=np.int64)
+    assert tokens.shape[0] == 0 or tokens.max() < np.iinfo(np.int16).max, 'Vocabulary too large for an int16 token index.'
+    path = token_index_path(manifest)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, version=np.array(TOKEN_INDEX_VERSION), tokenizer=np.array(tokenizer_key(tokenizer)),
+                 tokens=tokens.astype(np.int16), offsets=offsets, valid=valid)
+    os.replace(tmp, path)
+    return int((~valid).sum())
+
+
+def load_token_index(manifest, expected_rows, tokenizer):
+    """
+    Loads the token index of [manifest] as (tokens, offsets, valid). Raises if the index is missing, does not match the
+    manifest or was built with a different tokenizer.
+    """
+    path = token_index_path(manifest)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'{path} does not exist. Build it with scripts/audio/preparation/pretokenize.py')
+    if os.path.getmtime(path) < os.path.getmtime(manifest):
+        print(f'Warning: {manifest} is newer than its token index.')
+    with np.load(path, allow_pickle=False) as data:
+        if int(data['version']) != TOKEN_INDEX_VERSION:
+            raise ValueError(f'{path} is an unsupported token index version. Rebuild it.')
+        if str(data['tokenizer']) != tokenizer_key(tokenizer):
+            raise ValueError(f'{path} was built with a different tokenizer. Rebuild it.')
+        tokens, offsets, valid = data['tokens'], data['offsets'], data['valid']
+    if valid.shape[0] != expected_rows:
+        raise ValueError(f'{path} has {valid.shape[0]} entries but {manifest} has {expected_rows} rows. Rebuild it.')
+    return tokens, offsets, valid
@@ -1,7 +1,10 @@
+import functools
+import math
 import os
 import random
 import sys
 
+import numpy as np
 import torch
 import torch.utils.data
 import torch.nn.functional as F
@@ -9,12 +12,25 @@ import torchaudio
 from audio2numpy import open_audio
 from tqdm import tqdm
 
+from data.audio.length_index import load_length_index, length_filter
+from data.audio.similarity_index import SimilarityIndex
 from data.util import find_files_of_type, is_audio_file, load_paths_from_cache
 from models.audio.tts.tacotron2.taco_utils import load_wav_to_torch
+from utils.audio_cache import get_audio_cache
+from utils.audio_resampler import resample
 from utils.util import opt_get
 
 
-def load_audio(audiopath, sampling_rate):
+def load_audio(audiopath, sampling_rate, cache=None):
+    """
+    Decodes a clip to mono at [sampling_rate]. [cache] is an optional utils.audio_cache.DecodedAudioCache (see the
+    decoded_audio_cache dataset option).
+    """
+    if cache is not None:
+        audio = cache.get(audiopath, sampling_rate)
+        if audio is not None:
+            return audio.unsqueeze(0)
+
     if audiopath[-4:] == '.wav':
         audio, lsr = load_wav_to_torch(audiopath)
     elif audiopath[-4:] == '.mp3':
@@ -35,7 +51,7 @@ def load_audio(audiopath, sampling_rate):
             audio = audio[:, 0]
 
     if lsr != sampling_rate:
-        audio = torchaudio.functional.resample(audio, lsr, sampling_rate)
+        audio = resample(audio, lsr, sampling_rate)
 
     # Check some assumptions about audio range. This should be automatically fixed in load_wav_to_torch, but might not be in some edge cases, where we should squawk.
     # '10' is arbitrarily chosen since it seems like audio will often "overdrive" the [-1,1] bounds.
@@ -43,25 +59,113 @@ def load_audio(audiopath, sampling_rate):
         print(f"Error with {audiopath}. Max={audio.max()} min={audio.min()}")
     audio.clip_(-1, 1)
 
+    if cache is not None:
+        cache.put(audiopath, sampling_rate, audio)
     return audio.unsqueeze(0)
 
 
-def load_similar_clips(path, sample_length, sample_rate, n=3, fallback_to_self=True):
-    sim_path = os.path.join(os.path.dirname(path), 'similarities.pth')
-    candidates = []
+def get_audio_info(audiopath):
+    """
+    Returns (num_frames, sample_rate) of an audio file, read from its container header without decoding any audio.
+    """
+    if audiopath[-4:] == '.wav' or audiopath[-5:] == '.flac':
+        import soundfile as sf
+        info = sf.info(audiopath)
+        return info.frames, info.samplerate
+    info = torchaudio.info(audiopath)
+    if info.num_frames <= 0:
+        raise ValueError(f'Unable to determine the length of {audiopath} from its header.')
+    return info.num_frames, info.sample_rate
+
+
+def load_audio_window(audiopath, sampling_rate, offset, length, audio_info=None):
+    """
+    Decodes only [length] samples starting at [offset] (both expressed at [sampling_rate]) from an audio file. wav and
+    flac files are seeked frame-accurately; other formats (e.g. mp3) are seeked to the nearest frame by the decoder.
+    The result may be shorter than [length] if the file ends first.
+
+    [audio_info] is the file's (num_frames, sample_rate) as returned by get_audio_info(), if the caller already has it.
+    """
+    num_frames, lsr = audio_info if audio_info is not None else get_audio_info(audiopath)
+    src_offset = int(offset * lsr / sampling_rate)
+    src_length = min(int(math.ceil(length * lsr / sampling_rate)), num_frames - src_offset)
+    if audiopath[-4:] == '.wav' or audiopath[-5:] == '.flac':
+        import soundfile as sf
+        audio, lsr = sf.read(audiopath, start=src_offset, frames=src_length, dtype='float32', always_2d=True)
+        audio = torch.from_numpy(audio[:, 0])
+    else:
+        audio, lsr = torchaudio.load(audiopath, frame_offset=src_offset, num_frames=src_length)
+        audio = audio[0]
+    if lsr != sampling_rate:
+        audio = resample(audio, lsr, sampling_rate)
+    audio = audio[:length]
+    audio.clip_(-1, 1)
+    return audio.unsqueeze(0)
+
+
+def load_random_audio_window(audiopath, sampling_rate, length, cache=None):
+    """
+    Returns a random [length] sample window of the given clip, padded if the clip is shorter. Only the window is
+    decoded unless the decoded audio cache is enabled (in which case the cached full clip is cheaper) or the file's
+    header cannot be read.
+    """
+    if cache is None:
+        try:
+            num_frames, lsr = get_audio_info(audiopath)
+            gap = int(num_frames * sampling_rate / lsr) - length
+            if gap > 0:
+                clip = load_audio_window(audiopath, sampling_rate, random.randint(0, gap), length, (num_frames, lsr))
+                return F.pad(clip, (0, length - clip.shape[-1]))
+        except:
+            pass  # Fall back to a full decode.
+    clip = load_audio(audiopath, sampling_rate, cache)
+    gap = clip.shape[-1] - length
+    if gap < 0:
+        clip = F.pad(clip, pad=(0, abs(gap)))
+    elif gap > 0:
+        rand_start = random.randint(0, gap)
+        clip = clip[:, rand_start:rand_start+length]
+    return clip
+
+
+# Similarity maps and directory listings are requested repeatedly for clips in the same directory. These caches live
+# in each dataloader worker.
+@functools.lru_cache(maxsize=256)
+def load_similarities(dir):
+    sim_path = os.path.join(dir, 'similarities.pth')
     if os.path.exists(sim_path):
-        similarities = torch.load(sim_path)
-        fname = os.path.basename(path)
-        if fname in similarities.keys():
-            candidates = [os.path.join(os.path.dirname(path), s) for s in similarities[fname]]
-        else:
-            print(f'Similarities list found for {path} but {fname} was not in that list.')
+        return torch.load(sim_path)
+    return None
+
+
+@functools.lru_cache(maxsize=64)
+def list_audio_files(dir):
+    return find_files_of_type('img', dir, qualifier=is_audio_file)[0]
+
+
+def load_similar_clips(path, sample_length, sample_rate, n=3, fallback_to_self=True, similarity_index=None,
+                       audio_cache=None):
+    """
+    Loads [n] clips similar to [path]. Similar clips come from [similarity_index] (a data.audio.similarity_index
+    .SimilarityIndex) when given, otherwise from the similarities.pth file in the directory of [path].
+    """
+    candidates = []
+    if similarity_index is not None:
+        candidates = similarity_index.similar_paths(path)
+    else:
+        similarities = load_similarities(os.path.dirname(path))
+        if similarities is not None:
+            fname = os.path.basename(path)
+            if fname in similarities.keys():
+                candidates = [os.path.join(os.path.dirname(path), s) for s in similarities[fname]]
+            else:
+                print(f'Similarities list found for {path} but {fname} was not in that list.')
         #candidates.append(path)  # Always include self as a possible similar clip.
     if len(candidates) == 0:
         if fallback_to_self:
             candidates = [path]
         else:
-            candidates = find_files_of_type('img', os.path.dirname(path), qualifier=is_audio_file)[0]
+            candidates = list_audio_files(os.path.dirname(path))
 
     assert len(candidates) < 50000  # Sanity check to ensure we aren't loading "related files" that aren't actually related.
     if len(candidates) == 0:
@@ -74,20 +178,48 @@ def load_similar_clips(path, sample_length, sample_rate, n=3, fallback_to_self=T
     for k in range(n):
         rel_path = random.choice(candidates)
         contains_self = contains_self or (rel_path == path)
-        rel_clip = load_audio(rel_path, sample_rate)
-        gap = rel_clip.shape[-1] - sample_length
-        if gap < 0:
-            rel_clip = F.pad(rel_clip, pad=(0, abs(gap)))
-        elif gap > 0:
-            rand_start = random.randint(0, gap)
-            rel_clip = rel_clip[:, rand_start:rand_start+sample_length]
-        related_clips.append(rel_clip)
+        related_clips.append(load_random_audio_window(rel_path, sample_rate, sample_length, audio_cache))
     if n > 1:
         return torch.stack(related_clips, dim=0), contains_self
     else:
         return related_clips[0], contains_self
 
 
+def make_clip_output(audio_norm, filename, pad_to, should_resample_clip, pad_short_clips=True):
+    """
+    Pads or randomly crops a loaded clip to [pad_to] and builds the outputs shared by the unsupervised audio datasets.
+    With pad_short_clips=False, clips shorter than [pad_to] are returned as they are (for a padding collate).
+    """
+    # When generating resampled clips, skew is a bias that tries to spread them out from each other, reducing their
+    # influence on one another.
+    skew = [-1, 1] if should_resample_clip else [0]
+    # To increase variability, which skew is applied to the clip and resampled_clip is randomized.
+    random.shuffle(skew)
+    clips = []
+    prepad_length = min(audio_norm.shape[-1], pad_to)
+    for sk in skew:
+        if pad_to is not None:
+            if audio_norm.shape[-1] <= pad_to:
+                clips.append(torch.nn.functional.pad(audio_norm, (0, pad_to - audio_norm.shape[-1])) if pad_short_clips
+                             else audio_norm)
+            else:
+                gap = audio_norm.shape[-1] - pad_to
+                start = min(max(random.randint(0, gap-1) + sk * gap // 2, 0), gap-1)
+                clips.append(audio_norm[:, start:start+pad_to])
+        else:
+            clips.append(audio_norm)
+
+    output = {
+        'prepad_length': prepad_length,
+        'clip': clips[0],
+        'clip_lengths': torch.tensor(clips[0].shape[-1]),
+        'path': filename,
+    }
+    if should_resample_clip:
+        output['resampled_clip'] = clips[1]
+    return output
+
+
 class UnsupervisedAudioDataset(torch.utils.data.Dataset):
 
     def __init__(self, opt):
@@ -112,6 +244,10 @@ class UnsupervisedAudioDataset(torch.utils.data.Dataset):
         self.pad_to = opt_get(opt, ['pad_to_samples'], self.pad_to)
         self.min_length = opt_get(opt, ['min_length'], 0)
         self.dont_clip = opt_get(opt, ['dont_clip'], False)
+        # With zero_pad_collate, short clips are not padded here; data.zero_pad_dict_collate pads each batch instead.
+        self.pad_in_collate = opt_get(opt, ['zero_pad_collate'], False)
+        # Opt-in on-disk cache of decoded & resampled audio: `decoded_audio_cache: {path, max_size_gb, dtype}`.
+        self.audio_cache = get_audio_cache(opt_get(opt, ['decoded_audio_cache'], None))
 
         # "Resampled clip" is audio data pulled from the basis of "clip" but with randomly different bounds. There are no
         # guarantees that "clip_resampled" is different from "clip": in fact, if "clip" is less than pad_to_seconds/samples,
@@ -120,12 +256,24 @@ class UnsupervisedAudioDataset(torch.utils.data.Dataset):
         # "Extra samples" are other audio clips pulled from wav files in the same directory as the 'clip' wav file.
         self.extra_samples = opt_get(opt, ['extra_samples'], 0)
         self.extra_sample_len = opt_get(opt, ['extra_sample_length'], 44000)
+        self.similarity_index = opt_get(opt, ['similarity_index'], None)  # Built by scripts/audio/preparation/build_similarity_index.py
+        if self.similarity_index is not None:
+            self.similarity_index = SimilarityIndex(self.similarity_index)
 
         self.debug_loading_failures = opt_get(opt, ['debug_loading_failures'], True)
 
+        # A length index of the path cache (built by scripts/audio/preparation/build_length_index.py) lets clips that
+        # would be rejected for their length be dropped here rather than after they are decoded.
+        if opt_get(opt, ['length_index'], False):
+            lengths = load_length_index(cache_path, len(self.audiopaths))
+            keep = length_filter(lengths, self.sampling_rate, self.pad_to if self.dont_clip else None, self.min_length+1)
+            print(f'Length index: dropping {(~keep).sum()} of {keep.shape[0]} clips that are unreadable or out of range.')
+            self.audiopaths = [p for p, k in zip(self.audiopaths, keep) if k]
+            self.item_wav_lengths = np.round(lengths['duration'][keep] * self.sampling_rate).astype(np.int64)
+
     def get_audio_for_index(self, index):
         audiopath = self.audiopaths[index]
-        audio = load_audio(audiopath, self.sampling_rate)
+        audio = load_audio(audiopath, self.sampling_rate, self.audio_cache)
         assert audio.shape[1] > self.min_length
         if self.dont_clip:
             assert audio.shape[1] <= self.pad_to
@@ -135,7 +283,8 @@ class UnsupervisedAudioDataset(torch.utils.data.Dataset):
         if self.extra_samples <= 0:
             return None, 0
         audiopath = self.audiopaths[index]
-        return load_similar_clips(audiopath, self.extra_sample_len, self.sampling_rate, n=self.extra_samples)
+        return load_similar_clips(audiopath, self.extra_sample_len, self.sampling_rate, n=self.extra_samples,
+                                  similarity_index=self.similarity_index, audio_cache=self.audio_cache)
 
     def __getitem__(self, index):
         try:
@@ -147,32 +296,7 @@ class UnsupervisedAudioDataset(torch.utils.data.Dataset):
                 print(f"Error loading audio for file {self.audiopaths[index]} {sys.exc_info()}")
             return self[random.randint(0,len(self))]
 
-        # When generating resampled clips, skew is a bias that tries to spread them out from each other, reducing their
-        # influence on one another.
-        skew = [-1, 1] if self.should_resample_clip else [0]
-        # To increase variability, which skew is applied to the clip and resampled_clip is randomized.
-        random.shuffle(skew)
-        clips = []
-        prepad_length = min(audio_norm.shape[-1], self.pad_to)
-        for sk in skew:
-            if self.pad_to is not None:
-                if audio_norm.shape[-1] <= self.pad_to:
-                    clips.append(torch.nn.functional.pad(audio_norm, (0, self.pad_to - audio_norm.shape[-1])))
-                else:
-                    gap = audio_norm.shape[-1] - self.pad_to
-                    start = min(max(random.randint(0, gap-1) + sk * gap // 2, 0), gap-1)
-                    clips.append(audio_norm[:, start:start+self.pad_to])
-            else:
-                clips.append(audio_norm)
-
-        output = {
-            'prepad_length': prepad_length,
-            'clip': clips[0],
-            'clip_lengths': torch.tensor(clips[0].shape[-1]),
-            'path': filename,
-        }
-        if self.should_resample_clip:
-            output['resampled_clip'] = clips[1]
+        output = make_clip_output(audio_norm, filename, self.pad_to, self.should_resample_clip, not self.pad_in_collate)
         if self.extra_samples > 0:
             output['alt_clips'] = alt_files
             output['alt_contains_self'] = alt_is_self
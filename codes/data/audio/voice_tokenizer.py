@@ -1,4 +1,5 @@
 import re
+from functools import lru_cache
 
 import torch
 from tokenizers import Tokenizer
@@ -11,38 +12,56 @@ from models.audio.tts.tacotron2 import load_filepaths_and_text
 from models.audio.tts.tacotron2.text.cleaners import english_cleaners
 
 
+_REPLACEMENT_PUNCTUATION = {
+    '{': '(', '}': ')',
+    '[': '(', ']': ')',
+    '`': '\'', '—': '-',
+    'ʼ': '\''
+}
+_replacement_punctuation_re = re.compile("|".join([re.escape(k) for k in sorted(_REPLACEMENT_PUNCTUATION, key=len, reverse=True)]), flags=re.DOTALL)
+# TODO: some of these are spoken ('@', '%', '+', etc). Integrate them into the cleaners.
+_extraneous_re = re.compile(r'^[@#%_=\$\^&\*\+\\]$')
+
+
 def remove_extraneous_punctuation(word):
-    replacement_punctuation = {
-        '{': '(', '}': ')',
-        '[': '(', ']': ')',
-        '`': '\'', '—': '-',
-        '—': '-', '`': '\'',
-        'ʼ': '\''
-    }
-    replace = re.compile("|".join([re.escape(k) for k in sorted(replacement_punctuation, key=len, reverse=True)]), flags=re.DOTALL)
-    word = replace.sub(lambda x: replacement_punctuation[x.group(0)], word)
-
-    # TODO: some of these are spoken ('@', '%', '+', etc). Integrate them into the cleaners.
-    extraneous = re.compile(r'^[@#%_=\$\^&\*\+\\]$')
-    word = extraneous.sub('', word)
+    word = _replacement_punctuation_re.sub(lambda x: _REPLACEMENT_PUNCTUATION[x.group(0)], word)
+    word = _extraneous_re.sub('', word)
     return word
 
 
+@lru_cache(maxsize=65536)
+def clean_text(txt):
+    """
+    english_cleaners() followed by remove_extraneous_punctuation(). Memoized, since datasets clean the same texts
+    every epoch.
+    """
+    txt = english_cleaners(txt)
+    txt = remove_extraneous_punctuation(txt)
+    return txt
+
+
 class VoiceBpeTokenizer:
     def __init__(self, vocab_file):
+        self.vocab_file = vocab_file
         if vocab_file is not None:
             self.tokenizer = Tokenizer.from_file(vocab_file)
 
     def preprocess_text(self, txt):
-        txt = english_cleaners(txt)
-        txt = remove_extraneous_punctuation(txt)
-        return txt
+        return clean_text(txt)
 
     def encode(self, txt):
         txt = self.preprocess_text(txt)
         txt = txt.replace(' ', '[SPACE]')
         return self.tokenizer.encode(txt).ids
 
+    def encode_batch(self, txts):
+        """
+        Equivalent to [self.encode(t) for t in txts], but encodes the whole batch in one (multithreaded) call into
+        the tokenizers library.
+        """
+        txts = [self.preprocess_text(t).replace(' ', '[SPACE]') for t in txts]
+        return [e.ids for e in self.tokenizer.encode_batch(txts)]
+
     def decode(self, seq):
         if isinstance(seq, torch.Tensor):
             seq = seq.cpu().numpy()
@@ -4,6 +4,8 @@ Support enlarging the dataset for *iteration-oriented* training, for saving time
 dataloader after each epoch
 """
 import math
+
+import numpy as np
 import torch
 from torch.utils.data.sampler import Sampler
 import torch.distributed as dist
@@ -63,3 +65,77 @@ class DistIterSampler(Sampler):
 
     def set_epoch(self, epoch):
         self.epoch = epoch
+
+
+def compute_length_buckets(lengths, num_buckets, max_length, multiple=1024):
+    """
+    Splits items into [num_buckets] buckets of similar length using quantiles of [lengths]. Bucket boundaries are
+    rounded up to [multiple] and the last boundary is [max_length]. Items longer than [max_length] or with a negative
+    length (unreadable) are not placed in any bucket. Raises ValueError if that leaves no items at all.
+
+    Returns (boundaries, item_bucket) where item_bucket[i] is the bucket of item i, or -1.
+    """
+    lengths = np.asarray(lengths)
+    valid = (lengths >= 0) & (lengths <= max_length)
+    if not valid.any():
+        raise ValueError(f'None of the {lengths.shape[0]} items has a known length of at most {max_length}, so they '
+                         f'cannot be bucketed. Check the length index and the maximum lengths.')
+    quantiles = np.quantile(lengths[valid], np.linspace(0, 1, num_buckets+1)[1:])
+    boundaries = np.unique(np.minimum(np.ceil(quantiles / multiple) * multiple, max_length).astype(np.int64))
+    boundaries[-1] = max_length
+    item_bucket = np.searchsorted(boundaries, lengths, side='left')
+    item_bucket[~valid] = -1
+    return boundaries, item_bucket
+
+
+def budget_batch_sizes(boundaries, max_batch_elements, multiple=1):
+    """
+    Computes a global batch size for every bucket such that (batch size * bucket bound) does not exceed
+    [max_batch_elements]. Batch sizes are rounded down to [multiple] (the number of replicas times the number of
+    micro-batches) and are never smaller than [multiple].
+    """
+    return [max(multiple, (int(max_batch_elements) // int(b)) // multiple * multiple) for b in boundaries]
+
+
+class BucketBatchSampler(Sampler):
+    """
+    Batch sampler that only forms batches out of items in the same length bucket, so that datasets can pad to the
+    bucket maximum rather than to the longest supported item.
+
+    Each step draws one global batch of [batch_size] items from a single bucket; under DDP each rank takes its
+    1/num_replicas slice of it, so all ranks process similarly sized batches in lockstep. Items are shuffled within
+    buckets and the order of batches is shuffled across buckets every epoch.
+
+    Arguments:
+        buckets: list of arrays of dataset indices, one per bucket.
+        batch_size: global batch size, across all replicas.
+        batch_sizes: optional list of global batch sizes, one per bucket, which overrides batch_size. Used for dynamic
+                     batching, where short buckets get larger batches (see budget_batch_sizes()).
+    """
+
+    def __init__(self, buckets, batch_size, num_replicas=1, rank=0, seed=0, batch_sizes=None):
+        self.buckets = [np.asarray(b, dtype=np.int64) for b in buckets]
+        self.batch_size = batch_size
+        self.batch_sizes = [batch_size] * len(self.buckets) if batch_sizes is None else list(batch_sizes)
+        assert len(self.batch_sizes) == len(self.buckets)
+        assert all(bs % num_replicas == 0 for bs in self.batch_sizes)
+        self.num_replicas = num_replicas
+        self.rank = max(rank, 0)
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        batches = []
+        for bucket, bs in zip(self.buckets, self.batch_sizes):
+            bucket = bucket[rng.permutation(len(bucket))]
+            for i in range(len(bucket) // bs):
+                batches.append(bucket[i*bs:(i+1)*bs])
+        for b in rng.permutation(len(batches)):
+            yield batches[b][self.rank::self.num_replicas].tolist()
+
+    def __len__(self):
+        return sum(len(b) // bs for b, bs in zip(self.buckets, self.batch_sizes))
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
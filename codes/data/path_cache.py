@@ -0,0 +1,163 @@
+import hashlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+import torch
+
+PATH_CACHE_VERSION = 1
+
+
+def _pack_strings(strings):
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros((len(encoded)+1,), dtype=np.int64)
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def _unpack_strings(blob, offsets):
+    blob = blob.tobytes()
+    return [blob[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(offsets.shape[0]-1)]
+
+
+def filter_key(qualifier_name, exclusion_list, endswith, not_endswith):
+    """
+    Identifies the filters a cache was built with; a cache built with different filters has to be rebuilt.
+    """
+    h = hashlib.sha1()
+    for part in [qualifier_name, sorted(exclusion_list or []), list(endswith or []), list(not_endswith or [])]:
+        h.update(repr(part).encode('utf-8'))
+    return h.hexdigest()
+
+
+class DirectoryScanCache:
+    """
+    The contents of a set of directory trees, stored as one record per directory: its mtime and the (already filtered)
+    names of the files it contains. A directory's mtime changes whenever entries are added to, removed from or renamed
+    within it, so a rescan only has to list directories whose mtime differs from the recorded one.
+
+    Stored with np.savez as flat utf-8 blobs plus offset arrays rather than as a pickled list of paths.
+    """
+    def __init__(self, dirs=None, key=None):
+        self.dirs = dirs or {}  # path -> (mtime_ns, [file names])
+        self.key = key
+
+    @staticmethod
+    def load(cache_path):
+        """
+        Returns the DirectoryScanCache stored at [cache_path], or None if there is none (or it is a legacy cache).
+        """
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            data = np.load(cache_path, allow_pickle=False)
+        except:
+            return None
+        if not hasattr(data, 'files'):
+            return None  # A plain .npy, not an archive.
+        with data:
+            if 'version' not in data.files or int(data['version']) != PATH_CACHE_VERSION:
+                return None
+            dir_names = _unpack_strings(data['dirs'], data['dir_offsets'])
+            file_names = _unpack_strings(data['files'], data['file_offsets'])
+            dir_file_offsets = data['dir_file_offsets']
+            dir_mtimes = data['dir_mtimes']
+            dirs = {d: (int(dir_mtimes[i]), file_names[dir_file_offsets[i]:dir_file_offsets[i+1]])
+                    for i, d in enumerate(dir_names)}
+            return DirectoryScanCache(dirs, str(data['filter_key']))
+
+    def save(self, cache_path):
+        dir_names = sorted(self.dirs.keys())
+        file_names = []
+        dir_file_offsets = np.zeros((len(dir_names)+1,), dtype=np.int64)
+        for i, d in enumerate(dir_names):
+            file_names.extend(self.dirs[d][1])
+            dir_file_offsets[i+1] = len(file_names)
+        dirs_blob, dir_offsets = _pack_strings(dir_names)
+        files_blob, file_offsets = _pack_strings(file_names)
+        tmp = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, version=np.array(PATH_CACHE_VERSION), filter_key=np.array(self.key),
+                     dirs=dirs_blob, dir_offsets=dir_offsets,
+                     dir_mtimes=np.array([self.dirs[d][0] for d in dir_names], dtype=np.int64),
+                     files=files_blob, file_offsets=file_offsets, dir_file_offsets=dir_file_offsets)
+        os.replace(tmp, cache_path)
+
+    def paths_under(self, root):
+        """
+        Returns the full paths of all files recorded under [root], sorted.
+        """
+        root = os.path.normpath(root)
+        prefix = os.path.join(root, '')
+        paths = []
+        for d, (_, files) in self.dirs.items():
+            if d == root or d.startswith(prefix):
+                paths.extend(os.path.join(d, f) for f in files)
+        return sorted(paths)
+
+
+def scan_directories(roots, file_filter, previous=None, num_threads=32):
+    """
+    Crawls [roots] with a pool of threads calling os.scandir(). Only files for which file_filter(path) is true are
+    recorded. Directories whose mtime matches their record in [previous] (a DirectoryScanCache built with the same
+    filter) are not listed again; their recorded files and subdirectories are reused. Raises OSError if a root cannot be
+    listed.
+
+    Returns (DirectoryScanCache, number of directories listed, number of directories reused).
+    """
+    old = previous.dirs if previous is not None else {}
+    old_children = {}
+    for d in old.keys():
+        old_children.setdefault(os.path.dirname(d), []).append(d)
+
+    def visit(path):
+        mtime = os.stat(path).st_mtime_ns
+        if path in old.keys() and old[path][0] == mtime:
+            return path, old[path], old_children.get(path, []), False
+        files, subdirs = [], []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):  # Like os.walk()
+                        subdirs.append(entry.path)
+                    elif file_filter(entry.path):
+                        files.append(entry.name)
+                except OSError:
+                    print(f'Error scanning {entry.path}: {sys.exc_info()}')
+        return path, (mtime, sorted(files)), subdirs, True
+
+    result = {}
+    listed, reused = 0, 0
+    with ThreadPoolExecutor(num_threads) as pool:
+        root_futures = {pool.submit(visit, os.path.normpath(r)): r for r in roots}
+        pending = set(root_futures.keys())
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    path, record, subdirs, was_listed = fut.result()
+                except OSError:
+                    if fut in root_futures.keys():
+                        # A missing root (e.g. an unmounted drive) must not look like an empty directory.
+                        raise OSError(f'Unable to scan {root_futures[fut]}: {sys.exc_info()[1]}')
+                    print(f'Error scanning directory: {sys.exc_info()}')
+                    continue
+                result[path] = record
+                if was_listed:
+                    listed += 1
+                else:
+                    reused += 1
+                for s in subdirs:
+                    pending.add(pool.submit(visit, s))
+    return DirectoryScanCache(result), listed, reused
+
+
+def load_legacy_path_cache(cache_path):
+    """
+    Path caches written before the incremental scanner are pickled lists of paths.
+    """
+    try:
+        return torch.load(cache_path)
+    except:
+        return None
@@ -1,34 +1,97 @@
-from torch.utils.data import Dataset
+from bisect import bisect_right
+from itertools import accumulate
+
+import torch
+from torch.utils.data import Dataset, IterableDataset
 import datasets
 
 
+def load_corpus(corpus, cache_path, dataset_spec_key, streaming=False):
+    """
+    Loads one [dataset_name, config] corpus spec. A dataset_name of 'arrow' loads local Arrow shards, with config being
+    the shard path or glob.
+    """
+    dataset_name, config = corpus
+    if config == '' or config == 'None':
+        config = None
+    if dataset_name == 'arrow':
+        return datasets.load_dataset('arrow', data_files=config, cache_dir=cache_path, streaming=streaming)[dataset_spec_key]
+    return datasets.load_dataset(dataset_name, config, cache_dir=cache_path, streaming=streaming)[dataset_spec_key]
+
+
 class HfDataset(Dataset):
     """
     Simple wrapper for a HuggingFace dataset that can re-map keys if desired.
     """
     def __init__(self, corpi, cache_path=None, key_maps=None, dataset_spec_key='train'):
+        self.hfd = [load_corpus(corpus, cache_path, dataset_spec_key) for corpus in corpi]
+        self.key_maps = key_maps
+        self.cumulative_sizes = list(accumulate(len(h) for h in self.hfd))
+
+    def __getitem__(self, item):
+        if item < 0 or item >= len(self):
+            raise IndexError()
+        d = bisect_right(self.cumulative_sizes, item)
+        val = self.hfd[d][item - (self.cumulative_sizes[d-1] if d > 0 else 0)]
+        if self.key_maps is None:
+            return val
+        else:
+            return {k: val[v] for k, v in self.key_maps.items()}
+
+    def __len__(self):
+        return self.cumulative_sizes[-1] if self.cumulative_sizes else 0
+
+
+class StreamingHfDataset(IterableDataset):
+    """
+    Streaming counterpart of HfDataset, for corpora too large to materialize (e.g. Wikipedia or BookCorpus). Corpora are
+    streamed from the hub (or read from local Arrow shards) one after another, split across DDP ranks and dataloader
+    workers, and shuffled through a buffer of [shuffle_buffer] items with a seed that changes with set_epoch().
+
+    Each iteration is one pass over all corpora. There is no random access and no length.
+
+    A stream is split between consumers (DDP ranks times dataloader workers) by shard, so a corpus with fewer shards
+    than consumers leaves some of them with nothing to read. Local Arrow corpora are therefore memory-mapped and
+    re-split into [arrow_num_shards] shards; a warning is printed for any other corpus with too few shards.
+    """
+    def __init__(self, corpi, cache_path=None, key_maps=None, dataset_spec_key='train', shuffle_buffer=10000, seed=0,
+                 arrow_num_shards=1024):
         self.hfd = []
         for corpus in corpi:
-            dataset_name, config = corpus
-            if config == '' or config == 'None':
-                config = None
-            self.hfd.append(datasets.load_dataset(dataset_name, config, cache_dir=cache_path)[dataset_spec_key])
+            if corpus[0] == 'arrow':
+                d = load_corpus(corpus, cache_path, dataset_spec_key)
+                self.hfd.append(d.to_iterable_dataset(num_shards=max(1, min(arrow_num_shards, len(d)))))
+            else:
+                self.hfd.append(load_corpus(corpus, cache_path, dataset_spec_key, streaming=True))
         self.key_maps = key_maps
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.epoch = 0
 
-    def __getitem__(self, item):
-        for dataset in self.hfd:
-            if item < len(dataset):
-                val = dataset[item]
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        num_workers = 1 if worker_info is None else worker_info.num_workers
+        distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+        world_size = torch.distributed.get_world_size() if distributed else 1
+        for c, dataset in enumerate(self.hfd):
+            if dataset.n_shards < num_workers * world_size:
+                print(f'WARNING: streamed corpus {c} has {dataset.n_shards} shards, fewer than '
+                      f'the {world_size} ranks x {num_workers} dataloader workers reading it. Some workers will get no '
+                      f'data from it; reduce num_workers or re-shard the corpus.')
+            if distributed:
+                from datasets.distributed import split_dataset_by_node
+                dataset = split_dataset_by_node(dataset, rank=torch.distributed.get_rank(), world_size=world_size)
+            # Splitting across dataloader workers is done by datasets itself.
+            if self.shuffle_buffer > 0:
+                dataset = dataset.shuffle(seed=self.seed + self.epoch, buffer_size=self.shuffle_buffer)
+            for val in dataset:
                 if self.key_maps is None:
-                    return val
+                    yield val
                 else:
-                    return {k: val[v] for k, v in self.key_maps.items()}
-            else:
-                item -= len(dataset)
-        raise IndexError()
-
-    def __len__(self):
-        return sum([len(h) for h in self.hfd])
+                    yield {k: val[v] for k, v in self.key_maps.items()}
 
 
 if __name__ == '__main__':
@@ -578,37 +578,53 @@ def imresize_np(img, scale, antialiasing=True):
     return out_2.numpy()
 
 
-def load_paths_from_cache(paths, cache_path, exclusion_list=[], endswith=[], not_endswith=[]):
+def load_paths_from_cache(paths, cache_path, exclusion_list=[], endswith=[], not_endswith=[], num_threads=32):
+    """
+    Returns the audio files under [paths], filtered by [exclusion_list], [endswith] and [not_endswith]. The directory
+    trees are crawled in parallel and their contents recorded in [cache_path]; later calls only re-list directories that
+    changed since (see data.path_cache).
+    """
+    from data.path_cache import DirectoryScanCache, scan_directories, filter_key, load_legacy_path_cache
     if not isinstance(paths, list):
         paths = [paths]
-    if os.path.exists(cache_path):
-        output = torch.load(cache_path)
-    else:
-        print(f"Building cache for contents of {paths}..")
-        output = []
-        for p in paths:
-            output.extend(find_files_of_type('img', p, qualifier=is_audio_file)[0])
-        if exclusion_list is not None and len(exclusion_list) > 0:
-            print(f"Removing exclusion lists..")
-            before = len(output)
-            master_set = set(output)
-            exclusion_set = set(exclusion_list)
-            output = list(master_set - exclusion_set)
-            print(f"Excluded {before-len(output)} files.")
-        if endswith is not None:
-            before = len(output)
-            def filter_fn(p):
-                for e in endswith:
-                    if not p.endswith(e):
-                        return False
-                for e in not_endswith:
-                    if p.endswith(e):
-                        return False
-                return True
-            output = list(filter(filter_fn, output))
-            print(f"!!Excluded {before-len(output)} files with endswith mask. For total of {len(output)} files")
-        print("Done.")
-        torch.save(output, cache_path)
+    # Scanned paths are normalized, so exclusions have to be too.
+    exclusion_list = [os.path.normpath(e) for e in (exclusion_list or [])]
+    key = filter_key('is_audio_file', exclusion_list, endswith, not_endswith)
+    previous = DirectoryScanCache.load(cache_path)
+    if previous is None and os.path.exists(cache_path):
+        legacy = load_legacy_path_cache(cache_path)
+        if legacy is not None:
+            print(f'{cache_path} is a legacy path cache and will not be updated. Delete it to enable incremental scans.')
+            return legacy
+    if previous is not None and previous.key != key:
+        print(f'{cache_path} was built with different filters. Rescanning everything.')
+        previous = None
+
+    exclusion_set = set(exclusion_list)
+    endswith = endswith or []
+    not_endswith = not_endswith or []
+    def filter_fn(p):
+        if not is_audio_file(p) or p in exclusion_set:
+            return False
+        for e in endswith:
+            if not p.endswith(e):
+                return False
+        for e in not_endswith:
+            if p.endswith(e):
+                return False
+        return True
+
+    print(f"Scanning {paths}..")
+    cache, listed, reused = scan_directories(paths, filter_fn, previous, num_threads)
+    cache.key = key
+    output = []
+    for p in paths:
+        output.extend(cache.paths_under(p))
+    if not output and previous is not None and any(files for _, files in previous.dirs.values()):
+        print(f'Scanning {paths} found no files, but {cache_path} lists some. Not overwriting it.')
+    elif previous is None or listed > 0 or cache.dirs.keys() != previous.dirs.keys():
+        cache.save(cache_path)
+    print(f"Done. Listed {listed} directories, reused {reused} unchanged ones. Found {len(output)} files.")
     return output
 
 
@@ -1,29 +1,46 @@
+import math
+
 import torch
-import torch.nn.functional as F
+
+
+def _new_output(elem, shape):
+    """
+    Allocates a zeroed tensor like [elem] with [shape]. Inside a dataloader worker it is allocated directly in shared
+    memory (as default_collate does), so it is not copied again when it is sent to the main process.
+    """
+    if torch.utils.data.get_worker_info() is not None and elem.device.type == 'cpu':
+        storage = getattr(elem, '_typed_storage', elem.storage)()._new_shared(math.prod(shape))
+        return elem.new(storage).resize_(shape).zero_()
+    return elem.new_zeros(shape)
 
 
 class ZeroPadDictCollate():
     """
     Given a list of dictionary outputs with torch.Tensors from a Dataset, iterates through each one, finds the longest
-    tensor, and zero pads all the other tensors together.
-    """
-    def collate_tensors(self, batch, key):
-        result = []
-        largest_dims = [0 for _ in range(len(batch[0][key].shape))]
-        for elem in batch:
-            result.append(elem[key])
-            largest_dims = [max(current_largest, new_consideration) for current_largest, new_consideration in zip(largest_dims, elem[key].shape)]
-        # Now pad each tensor by the largest dimension.
-        for i in range(len(result)):
-            padding_tuple = ()
-            for d in range(len(largest_dims)):
-                padding_needed = largest_dims[d] - result[i].shape[d]
-                assert padding_needed >= 0
-                padding_tuple = (0, padding_needed) + padding_tuple
-            result[i] = F.pad(result[i], padding_tuple)
+    tensor, and zero pads all the other tensors together. Used by grand_conjoined_voice (needs_collate) and, with the
+    zero_pad_collate option, by paired_voice_audio and unsupervised_audio, which then leave their items unpadded.
 
-        return torch.stack(result, dim=0)
+    With emit_lengths, the unpadded size of the last dimension of every padded key is also output as '<key>_lengths'
+    (when the dataset does not already provide it), which is what the trainer's auto_collate option trims batches by.
+    With tensorize_numbers, python bools, ints and floats are collated into tensors as default_collate does; otherwise
+    they are collated into lists like any other non-tensor value.
+    """
+    def __init__(self, emit_lengths=False, tensorize_numbers=False):
+        self.emit_lengths = emit_lengths
+        self.tensorize_numbers = tensorize_numbers
 
+    def collate_tensors(self, batch, key):
+        elems = [elem[key] for elem in batch]
+        shapes = torch.tensor([e.shape for e in elems], dtype=torch.long)
+        largest_dims = shapes.max(dim=0).values.tolist()
+        result = _new_output(elems[0], [len(elems)] + largest_dims)
+        if (shapes == shapes[0]).all():
+            torch.stack(elems, dim=0, out=result)
+        else:
+            # Copy each tensor into its corner of the output; the rest stays zero.
+            for i, e in enumerate(elems):
+                result[(i,) + tuple(slice(0, s) for s in e.shape)] = e
+        return result, shapes[:, -1]
 
     def collate_into_list(self, batch, key):
         result = []
@@ -34,12 +51,19 @@ class ZeroPadDictCollate():
     def __call__(self, batch):
         first_dict = batch[0]
         collated = {}
+        lengths = {}
         for key in first_dict.keys():
             if isinstance(first_dict[key], torch.Tensor):
                 if len(first_dict[key].shape) > 0:
-                    collated[key] = self.collate_tensors(batch, key)
+                    collated[key], lengths[f'{key}_lengths'] = self.collate_tensors(batch, key)
                 else:
                     collated[key] = torch.stack([b[key] for b in batch])
+            elif self.tensorize_numbers and isinstance(first_dict[key], (bool, int, float)):
+                collated[key] = torch.tensor([b[key] for b in batch])  # As default_collate does.
             else:
                 collated[key] = self.collate_into_list(batch, key)
-        return collated
\ No newline at end of file
+        if self.emit_lengths:
+            for k, v in lengths.items():
+                if k not in collated.keys():
+                    collated[k] = v
+        return collated
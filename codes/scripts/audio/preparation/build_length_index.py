@@ -0,0 +1,53 @@
+import argparse
+
+import yaml
+
+from data import create_dataset
+from data.audio.length_index import build_length_index, build_path_length_index
+from data.util import load_paths_from_cache
+from utils.options import Loader
+
+if __name__ == '__main__':
+    """
+    Builds length indices from audio headers only; no audio is decoded. Three sources are supported:
+
+    - A paired_voice_audio dataset (-o/--dataset): writes a <manifest>.lengths.npy next to every manifest, holding the
+      duration and tokenized text length of every row. Datasets load these with `length_index: true`, which is required
+      for `num_length_buckets`.
+    - An unsupervised_audio dataset (-o/--dataset): writes <cache_path>.lengths.npy for its path cache.
+    - A directory tree (--dirs/--cache_path): builds the path cache (if missing) in the format unsupervised_audio
+      datasets read, then indexes it.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', type=str, help='Path to the training options YAML file', default='../experiments/EXAMPLE_gpt.yml')
+    parser.add_argument('--dataset', type=str, help='Which dataset under datasets: in the options file to index', default='train')
+    parser.add_argument('--dirs', type=str, nargs='+', help='Index every audio file under these directories instead of a dataset', default=None)
+    parser.add_argument('--cache_path', type=str, help='Path cache to create (or reuse) for --dirs', default=None)
+    parser.add_argument('--num_workers', type=int, default=16)
+    args = parser.parse_args()
+
+    if args.dirs is not None:
+        assert args.cache_path is not None, '--cache_path is required with --dirs'
+        paths = load_paths_from_cache(args.dirs, args.cache_path)
+        index = build_path_length_index(args.cache_path, paths, args.num_workers)
+        print(f'{args.cache_path}: {len(paths)} clips, {(index["duration"] < 0).sum()} unreadable.')
+    else:
+        with open(args.o, mode='r') as f:
+            opt = yaml.load(f, Loader=Loader)
+        dataset_opt = opt['datasets'][args.dataset]
+        assert dataset_opt['mode'] in ['paired_voice_audio', 'unsupervised_audio']
+        for k in ['length_index', 'num_length_buckets', 'max_batch_samples', 'max_batch_mel_frames', 'dvae_code_cache', 'pretokenized']:
+            dataset_opt.pop(k, None)
+        ds = create_dataset(dataset_opt)
+
+        if dataset_opt['mode'] == 'unsupervised_audio':
+            cache_path = dataset_opt['cache_path']
+            index = build_path_length_index(cache_path, ds.audiopaths, args.num_workers)
+            print(f'{cache_path}: {len(ds.audiopaths)} clips, {(index["duration"] < 0).sum()} unreadable.')
+        else:
+            fetcher_modes = dataset_opt['fetcher_mode'] if isinstance(dataset_opt['fetcher_mode'], list) else [dataset_opt['fetcher_mode']]
+            for p, fm, type in zip(ds.path, fetcher_modes, ds.types):
+                print(f'Indexing {p}..')
+                rows = ds.get_fetcher(fm)(p, type)
+                index = build_length_index(p, rows, ds.get_text, args.num_workers)
+                print(f'{p}: {(index["duration"] < 0).sum()} unreadable clips, {(index["text_len"] < 0).sum()} untokenizable texts.')
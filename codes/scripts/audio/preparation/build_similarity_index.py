@@ -0,0 +1,17 @@
+import argparse
+
+from data.audio.similarity_index import build_similarity_index
+
+if __name__ == '__main__':
+    """
+    Merges the similarities.pth files produced by phase_3_generate_similarities.py into one memory mapped index. Pass
+    the output prefix to a dataset as `similarity_index` to look up conditioning clips without unpickling a
+    similarities.pth per sample.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', type=str, nargs='+', help='Root path(s) to search for similarities.pth files from', required=True)
+    parser.add_argument('--output', type=str, help='Path prefix of the index files to write', required=True)
+    args = parser.parse_args()
+
+    n = build_similarity_index(args.path, args.output)
+    print(f'Indexed {n} clips into {args.output}.')
@@ -0,0 +1,102 @@
+import argparse
+import os
+import sys
+
+import torch
+import torch.nn.functional as F
+import yaml
+from tqdm import tqdm
+
+from data import create_dataset
+from data.audio.dvae_code_cache import DvaeCodeCache, hash_file_contents
+from data.audio.unsupervised_audio_dataset import load_audio
+from trainer.injectors.audio_injectors import TorchMelSpectrogramInjector
+from utils.options import Loader
+from utils.util import load_model_from_config
+
+
+class ClipsToEncode(torch.utils.data.Dataset):
+    """
+    Loads every clip referenced by a paired_voice_audio dataset exactly once, padded the same way that dataset pads
+    them, so the codes computed from them match the ones the DiscreteTokenInjector would produce during training.
+    """
+    def __init__(self, paths, sample_rate, max_wav_len, cache):
+        self.paths = paths
+        self.sample_rate = sample_rate
+        self.max_wav_len = max_wav_len
+        self.cache = cache
+
+    def __getitem__(self, index):
+        path = self.paths[index]
+        empty = {'wav': torch.zeros((1, self.max_wav_len)), 'path': path, 'key': '', 'size': 0, 'mtime': 0, 'valid': False}
+        try:
+            st = os.stat(path)
+            # Recorded in the cache's path index, so that datasets don't have to hash the file again.
+            empty.update({'key': hash_file_contents(path), 'size': st.st_size, 'mtime': st.st_mtime_ns})
+            if self.cache.contains(empty['key']):
+                return empty
+            wav = load_audio(path, self.sample_rate)
+        except:
+            print(f'Error loading {path}: {sys.exc_info()}')
+            return empty
+        if wav.shape[-1] > self.max_wav_len:
+            return empty  # The dataset will never return this clip.
+        return dict(empty, wav=F.pad(wav, (0, self.max_wav_len - wav.shape[-1])), valid=True)
+
+    def __len__(self):
+        return len(self.paths)
+
+
+if __name__ == '__main__':
+    """
+    Precomputes the DVAE codes (and optionally normalized MELs) for every clip in a paired_voice_audio dataset and
+    stores them in a content-addressed cache. Point the dataset at the cache with `dvae_code_cache: <cache_dir>` and
+    set `cached_codes_key: mel_codes` on the discrete_token injector to skip running the DVAE during training.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', type=str, help='Path to the training options YAML file', default='../experiments/EXAMPLE_gpt.yml')
+    parser.add_argument('--dataset', type=str, help='Which dataset under datasets: in the options file to encode', default='train')
+    parser.add_argument('--cache_dir', type=str, help='Where to write the cache', required=True)
+    parser.add_argument('--dvae_config', type=str, default='../experiments/train_diffusion_vocoder_22k_level.yml')
+    parser.add_argument('--dvae_name', type=str, default='dvae')
+    parser.add_argument('--mel_norm_file', type=str, default='../experiments/clips_mel_norms.pth')
+    parser.add_argument('--save_mels', action='store_true', help='Also store the normalized MELs the codes were computed from')
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument('--num_workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with open(args.o, mode='r') as f:
+        opt = yaml.load(f, Loader=Loader)
+    dataset_opt = opt['datasets'][args.dataset]
+    assert dataset_opt['mode'] == 'paired_voice_audio'
+    dataset_opt['load_conditioning'] = False
+    dataset_opt.pop('dvae_code_cache', None)
+    ds = create_dataset(dataset_opt)
+
+    cache = DvaeCodeCache(args.cache_dir, create=True)
+    cache.check_compatible(sample_rate=ds.sample_rate, max_wav_length=ds.max_wav_len, dvae_config=args.dvae_config,
+                           mel_norm_file=args.mel_norm_file)
+    cache.write_info(sample_rate=ds.sample_rate, max_wav_length=ds.max_wav_len, dvae_config=args.dvae_config,
+                     mel_norm_file=args.mel_norm_file)
+
+    paths = sorted(set(apt[0] for apt in ds.audiopaths_and_text))
+    clips = ClipsToEncode(paths, ds.sample_rate, ds.max_wav_len, cache)
+    dl = torch.utils.data.DataLoader(clips, batch_size=args.batch_size, num_workers=args.num_workers, shuffle=False)
+
+    mel_inj = TorchMelSpectrogramInjector({'in': 'wav', 'out': 'mel', 'mel_norm_file': args.mel_norm_file}, {})
+    dvae = load_model_from_config(args.dvae_config, args.dvae_name).cuda().eval()
+    with torch.no_grad():
+        for batch in tqdm(dl):
+            for path, key, size, mtime in zip(batch['path'], batch['key'], batch['size'].tolist(), batch['mtime'].tolist()):
+                if key != '':
+                    cache.record_path(path, key, size, mtime)
+            valid = batch['valid']
+            if not torch.any(valid):
+                continue
+            wav = batch['wav'][valid].cuda()
+            keys = [k for k, v in zip(batch['key'], valid) if v]
+            mels = mel_inj({'wav': wav})['mel']
+            codes = dvae.get_codebook_indices(mels)
+            for i, key in enumerate(keys):
+                cache.put(key, codes[i], mels[i] if args.save_mels else None)
+    cache.save_path_index()
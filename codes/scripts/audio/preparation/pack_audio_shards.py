@@ -0,0 +1,23 @@
+import argparse
+
+from data.audio.audio_shard_dataset import write_audio_shards, shard_index_path
+from data.util import load_paths_from_cache
+
+if __name__ == '__main__':
+    """
+    Converts the path cache of an unsupervised_audio dataset (building it from --paths first if it does not exist) into
+    tar shards readable by the unsupervised_audio_shards dataset. Audio is copied as-is; decoding and resampling still
+    happen in the dataloader.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--paths', type=str, nargs='+', help='Directories the path cache was (or will be) built from', required=True)
+    parser.add_argument('--cache_path', type=str, help='Path cache to convert', required=True)
+    parser.add_argument('--endswith', type=str, nargs='*', default=[])
+    parser.add_argument('--output', type=str, help='Directory to write the shards to', required=True)
+    parser.add_argument('--clips_per_shard', type=int, default=2000)
+    args = parser.parse_args()
+
+    paths = load_paths_from_cache(args.paths, args.cache_path, endswith=args.endswith)
+    shards = write_audio_shards(paths, args.output, args.clips_per_shard)
+    print(f'Wrote {sum(s["num_clips"] for s in shards)} clips into {len(shards)} shards. Point the dataset at '
+          f'{shard_index_path(args.output)}.')
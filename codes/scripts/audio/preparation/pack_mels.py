@@ -0,0 +1,56 @@
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from data.audio.preprocessed_mel_dataset import PackedMelWriter
+
+
+class NpzMels(torch.utils.data.Dataset):
+    def __init__(self, paths):
+        self.paths = paths
+
+    def __getitem__(self, index):
+        try:
+            with np.load(self.paths[index]) as npz_file:
+                return {'mel': npz_file['arr_0'], 'path': self.paths[index]}
+        except:
+            print(f'Error loading {self.paths[index]}: {sys.exc_info()}')
+            return None
+
+    def __len__(self):
+        return len(self.paths)
+
+
+if __name__ == '__main__':
+    """
+    Packs the .npz MELs written by save_mels_to_disk.py (as read by the preprocessed_mel dataset) into a single store
+    readable by the packed_mel dataset. MELs are stored as float16.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--path', type=str, help='Directory to search for .npz MELs', default=None)
+    parser.add_argument('--cache_path', type=str, help='cache_path of an existing preprocessed_mel dataset, used instead of --path if it exists', default=None)
+    parser.add_argument('--output', type=str, help='Path prefix of the store to write', required=True)
+    parser.add_argument('--max_frames', type=int, help='Skip MELs longer than this', default=None)
+    parser.add_argument('--num_workers', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.cache_path is not None and os.path.exists(args.cache_path):
+        paths = torch.load(args.cache_path)
+    else:
+        paths = [str(p) for p in Path(args.path).rglob("*.npz")]
+
+    writer = PackedMelWriter(args.output)
+    dl = torch.utils.data.DataLoader(NpzMels(paths), batch_size=None, num_workers=args.num_workers)
+    skipped = 0
+    for item in tqdm(dl):
+        if item is None or (args.max_frames is not None and item['mel'].shape[-1] > args.max_frames):
+            skipped += 1
+            continue
+        writer.add(item['mel'], item['path'])
+    writer.close()
+    print(f'Packed {len(paths) - skipped} MELs into {args.output}. Skipped {skipped}.')
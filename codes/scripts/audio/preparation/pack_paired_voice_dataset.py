@@ -0,0 +1,89 @@
+import argparse
+import os
+import sys
+
+import torch
+import yaml
+from tqdm import tqdm
+
+from data import create_dataset
+from data.audio.packed_voice_dataset import PackedVoiceShardWriter
+from data.audio.unsupervised_audio_dataset import load_audio
+from utils.options import Loader
+
+
+class ClipsToPack(torch.utils.data.Dataset):
+    """
+    Decodes and tokenizes the entries of a paired_voice_audio dataset in dataloader workers so the (single threaded)
+    shard writer only has to append bytes.
+    """
+    def __init__(self, ds):
+        self.ds = ds
+        self.similarities = {}
+
+    def get_similar_paths(self, path):
+        dir = os.path.dirname(path)
+        if dir not in self.similarities.keys():
+            sim_path = os.path.join(dir, 'similarities.pth')
+            self.similarities[dir] = torch.load(sim_path) if os.path.exists(sim_path) else {}
+        sims = self.similarities[dir]
+        fname = os.path.basename(path)
+        if fname not in sims.keys():
+            return None
+        return [os.path.join(dir, s) for s in sims[fname]]
+
+    def __getitem__(self, index):
+        apt = self.ds.audiopaths_and_text[index]
+        path, text = apt[0], apt[1]
+        if self.ds.load_aligned_codes:
+            codes, type = apt[2], apt[3]
+        else:
+            codes, type = None, apt[2]
+        try:
+            tokens = self.ds.get_text(text)
+            wav = load_audio(path, self.ds.sample_rate)
+        except:
+            print(f'Error loading {path}: {sys.exc_info()}')
+            return None
+        if len(text.strip()) == 0 or wav.shape[-1] < .6 * self.ds.sample_rate or \
+                wav.shape[-1] > self.ds.max_wav_len or tokens.shape[0] > self.ds.max_text_len:
+            return None  # The paired_voice_audio dataset would never return this clip.
+        return {'path': path, 'text': text, 'tokens': tokens, 'wav': wav, 'codes': codes, 'type': type,
+                'similar_paths': self.get_similar_paths(path)}
+
+    def __len__(self):
+        return len(self.ds.audiopaths_and_text)
+
+
+if __name__ == '__main__':
+    """
+    Packs every clip referenced by a paired_voice_audio dataset into a single shard readable by the
+    packed_paired_voice_audio dataset. The clips are resampled to the dataset sample rate and filtered by its
+    max_wav_length and max_text_length while packing.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', type=str, help='Path to the training options YAML file', default='../experiments/EXAMPLE_gpt.yml')
+    parser.add_argument('--dataset', type=str, help='Which dataset under datasets: in the options file to pack', default='train')
+    parser.add_argument('--output', type=str, help='Path prefix of the shard files to write', required=True)
+    parser.add_argument('--num_workers', type=int, default=8)
+    args = parser.parse_args()
+
+    with open(args.o, mode='r') as f:
+        opt = yaml.load(f, Loader=Loader)
+    dataset_opt = opt['datasets'][args.dataset]
+    assert dataset_opt['mode'] == 'paired_voice_audio'
+    dataset_opt['load_conditioning'] = False
+    dataset_opt.pop('dvae_code_cache', None)
+    ds = create_dataset(dataset_opt)
+
+    writer = PackedVoiceShardWriter(args.output, ds.sample_rate)
+    dl = torch.utils.data.DataLoader(ClipsToPack(ds), batch_size=None, num_workers=args.num_workers)
+    skipped = 0
+    for clip in tqdm(dl):
+        if clip is None:
+            skipped += 1
+            continue
+        writer.add(clip['path'], clip['text'], clip['tokens'], clip['wav'], clip['codes'], clip['type'],
+                   clip['similar_paths'])
+    writer.close()
+    print(f'Packed {len(ds.audiopaths_and_text) - skipped} clips into {args.output}. Skipped {skipped}.')
@@ -0,0 +1,35 @@
+import argparse
+
+import yaml
+
+from data import create_dataset
+from data.audio.token_index import build_token_index
+from utils.options import Loader
+
+if __name__ == '__main__':
+    """
+    Cleans and tokenizes the text of every row of a paired_voice_audio dataset with the dataset's own tokenizer, and
+    writes the token ids to a <manifest>.tokens.npz next to every manifest. Datasets load these with
+    `pretokenized: true`, after which no text normalization happens in dataloader workers. Rebuild the indices whenever
+    a manifest or the tokenizer vocab changes.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', type=str, help='Path to the training options YAML file', default='../experiments/EXAMPLE_gpt.yml')
+    parser.add_argument('--dataset', type=str, help='Which dataset under datasets: in the options file to tokenize', default='train')
+    parser.add_argument('--batch_size', type=int, help='Number of texts passed to the tokenizer at once', default=1024)
+    args = parser.parse_args()
+
+    with open(args.o, mode='r') as f:
+        opt = yaml.load(f, Loader=Loader)
+    dataset_opt = opt['datasets'][args.dataset]
+    assert dataset_opt['mode'] == 'paired_voice_audio'
+    for k in ['length_index', 'num_length_buckets', 'max_batch_samples', 'max_batch_mel_frames', 'dvae_code_cache', 'pretokenized']:
+        dataset_opt.pop(k, None)
+    ds = create_dataset(dataset_opt)
+
+    fetcher_modes = dataset_opt['fetcher_mode'] if isinstance(dataset_opt['fetcher_mode'], list) else [dataset_opt['fetcher_mode']]
+    for p, fm, type in zip(ds.path, fetcher_modes, ds.types):
+        print(f'Tokenizing {p}..')
+        rows = ds.get_fetcher(fm)(p, type)
+        invalid = build_token_index(p, rows, ds.tokenizer, args.batch_size)
+        print(f'{p}: {len(rows)} rows, {invalid} untokenizable texts.')
@@ -0,0 +1,26 @@
+import argparse
+
+import torch
+
+from utils.mmap_checkpoint import save_mmap_checkpoint
+
+if __name__ == '__main__':
+    """
+    Converts network checkpoints written with torch.save() into the memory-mapped format of utils.mmap_checkpoint,
+    which BaseModel.load_network() loads without reading the whole file into memory. Converted files can no longer be
+    read with torch.load().
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', type=str, nargs='+', help='Checkpoints to convert')
+    parser.add_argument('--output_suffix', type=str, default='.mmap', help='Appended to the converted file names.')
+    parser.add_argument('--in_place', action='store_true', help='Overwrite the input checkpoints instead of writing new files.')
+    args = parser.parse_args()
+    suffix = '' if args.in_place else args.output_suffix
+    assert suffix != '' or args.in_place, 'An empty --output_suffix would overwrite the inputs; pass --in_place for that.'
+
+    for path in args.input:
+        state_dict = torch.load(path, map_location='cpu')
+        if 'state_dict' in state_dict:
+            state_dict = state_dict['state_dict']
+        save_mmap_checkpoint(state_dict, path + suffix)
+        print(f'Converted {path} to {path + suffix}')
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from trainer.injectors.audio_augmentation_injectors import AudioNoiseAugmentationInjector, _place, _smooth_envelope
+
+
+def write_clips(dir, count, length, sr=22050):
+    os.makedirs(dir)
+    rng = np.random.RandomState(0)
+    for i in range(count):
+        sf.write(os.path.join(dir, f'{i}.wav'), (rng.rand(length).astype(np.float32) - .5) * .5, sr)
+    return str(dir)
+
+
+def test_place():
+    source = torch.arange(1, 11).float().repeat(2, 1)
+    out = _place(source, torch.tensor([10, 4]), start=torch.tensor([2, 1]), place=torch.tensor([1, 0]),
+                 count=torch.tensor([3, 5]), length=6)
+    assert out.tolist() == [[0, 3, 4, 5, 0, 0], [2, 3, 4, 0, 0, 0]]  # Row 2 runs past its source length.
+
+
+def test_smooth_envelope_is_bounded():
+    torch.manual_seed(0)
+    place, count = torch.tensor([0, 100, 50]), torch.tensor([400, 200, 4])
+    env = _smooth_envelope(place, count, 500)
+    assert env.shape == (3, 500) and env.min() >= 0 and env.max() <= 1
+    assert env[0].max() == 1
+
+
+def test_injector(tmp_path):
+    opt = {'in': 'clip', 'out': 'aug', 'lengths_key': 'clip_lengths', 'lengths_out_key': 'aug_lengths',
+           'sampling_rate': 22050, 'bank_size': 4, 'bank_clip_length': 3000,
+           'env_noise_paths': write_clips(tmp_path / 'env', 3, 5000), 'env_noise_cache': str(tmp_path / 'env.pth'),
+           'music_paths': write_clips(tmp_path / 'music', 3, 1000), 'music_cache': str(tmp_path / 'music.pth'),
+           'openair_path': write_clips(tmp_path / 'openair', 2, 300)}
+    inj = AudioNoiseAugmentationInjector(opt, {'step': 0})
+    torch.manual_seed(0)
+    b, L = 64, 30000
+    lengths = torch.randint(2000, L, (b,))
+    clips = (torch.rand(b, 1, L) - .5) * (torch.arange(L) < lengths.unsqueeze(1)).unsqueeze(1)
+    res = inj({'clip': clips, 'clip_lengths': lengths})
+
+    out, label, augvol, new_lengths = res['aug'], res['label'], res['augvol'], res['aug_lengths']
+    assert out.shape == clips.shape and out.abs().max() <= 1
+    assert set(label.tolist()) == {0, 1, 2, 3, 4}
+    assert (augvol[(label == 0) | (label == 4)] == 0).all() and (augvol[(label > 0) & (label < 4)] > 0).all()
+    assert ((res['clipvol'] >= .5) & (res['clipvol'] <= .8)).all()
+    assert (new_lengths[label != 3] == lengths[label != 3]).all() and (new_lengths >= lengths).all()
+    assert (out.squeeze(1) * (torch.arange(L) >= new_lengths.unsqueeze(1)) == 0).all()
+    plain = label == 0
+    assert torch.allclose(out[plain], clips[plain] * res['clipvol'][plain].view(-1, 1, 1))
@@ -0,0 +1,53 @@
+import os
+
+import torch
+
+from utils.audio_cache import DecodedAudioCache, get_audio_cache
+
+
+def make_source(tmp_path, name='clip.wav'):
+    src = tmp_path / name
+    src.write_bytes(b'not really audio')
+    return str(src)
+
+
+def test_round_trip(tmp_path):
+    src = make_source(tmp_path)
+    audio = torch.rand(1, 1000) * 2 - 1
+    for dtype, atol in [('int16', 1 / 32767), ('float16', 1e-3)]:
+        cache = DecodedAudioCache(str(tmp_path / dtype), dtype=dtype, report_every=0)
+        assert cache.get(src, 22050) is None
+        cache.put(src, 22050, audio)
+        assert torch.allclose(cache.get(src, 22050), audio, atol=atol)
+        assert cache.get(src, 24000) is None
+        assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+        assert cache.read_size() == cache.scan()[1]
+
+
+def test_modified_source_misses(tmp_path):
+    src = make_source(tmp_path)
+    cache = DecodedAudioCache(str(tmp_path / 'cache'), report_every=0)
+    cache.put(src, 22050, torch.zeros(1, 10))
+    st = os.stat(src)
+    os.utime(src, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert cache.get(src, 22050) is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DecodedAudioCache(str(tmp_path / 'cache'), max_size_gb=0, report_every=0)
+    cache.max_size_bytes = 3 * 1000 * 2 + 3 * 128  # Room for three entries (with their .npy headers).
+    sources = [make_source(tmp_path, f'{i}.wav') for i in range(5)]
+    for i, src in enumerate(sources):
+        cache.put(src, 22050, torch.zeros(1, 1000))
+        entry = cache.entry_path(src, 22050)
+        os.utime(entry, (i, i))  # Deterministic recency, oldest first.
+    entries, total = cache.scan()
+    assert total <= cache.max_size_bytes and total == cache.read_size()
+    assert cache.get(sources[-1], 22050) is not None
+    assert cache.get(sources[0], 22050) is None
+
+
+def test_get_audio_cache_is_shared(tmp_path):
+    assert get_audio_cache(None) is None
+    opt = {'path': str(tmp_path / 'cache')}
+    assert get_audio_cache(opt) is get_audio_cache(dict(opt))
@@ -0,0 +1,31 @@
+import torch
+import torchaudio
+
+from utils import audio_resampler
+from utils.audio_resampler import get_resampler, resample
+
+
+def test_resample_matches_torchaudio():
+    audio = torch.randn(2, 4410)
+    expected = torchaudio.functional.resample(audio, 44100, 22050)
+    assert torch.allclose(resample(audio, 44100, 22050), expected, atol=1e-5)
+    assert torch.allclose(resample(audio, 44100, 22050, cache=False), expected, atol=1e-5)
+    assert resample(audio, 22050, 22050) is audio
+
+
+def test_resamplers_are_cached():
+    assert get_resampler(44100, 22050) is get_resampler(44100, 22050)
+    assert get_resampler(44100, 22050) is not get_resampler(44100, 16000)
+
+
+def test_cache_is_bounded_by_kernel_bytes(monkeypatch):
+    sizes = [audio_resampler._kernel_bytes(get_resampler(sr, 16000)) for sr in (48000, 32000)]
+    monkeypatch.setattr(audio_resampler, '_resamplers', type(audio_resampler._resamplers)())
+    monkeypatch.setattr(audio_resampler, '_cached_kernel_bytes', 0)
+    monkeypatch.setattr(audio_resampler, 'MAX_CACHED_KERNEL_BYTES', sum(sizes) - 1)
+    first = get_resampler(48000, 16000)
+    second = get_resampler(32000, 16000)
+    # Caching the second kernel evicts the least recently used one.
+    assert audio_resampler._cached_kernel_bytes == sizes[1]
+    assert get_resampler(32000, 16000) is second
+    assert get_resampler(48000, 16000) is not first
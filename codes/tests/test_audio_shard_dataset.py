@@ -0,0 +1,65 @@
+import json
+
+import numpy as np
+import soundfile as sf
+import torch
+
+from data.audio.audio_shard_dataset import ShardedAudioDataset, shard_index_path, write_audio_shards
+
+
+def write_clips(tmp_path, n=10, sr=22050):
+    paths = []
+    for i in range(n):
+        p = str(tmp_path / f'clip_{i}.wav')
+        # Every clip has a distinct length, so clips can be identified from the dataset's output.
+        sf.write(p, np.random.RandomState(i).uniform(-.5, .5, size=sr // 10 + i * 100).astype(np.float32), sr)
+        paths.append(p)
+    return paths
+
+
+def make_dataset(tmp_path, paths, clips_per_shard=3, **opts):
+    out = str(tmp_path / 'shards')
+    write_audio_shards(paths, out, clips_per_shard)
+    return ShardedAudioDataset(dict({'path': shard_index_path(out), 'sampling_rate': 22050, 'pad_to_samples': 4000,
+                                     'shuffle_buffer': 4}, **opts))
+
+
+def test_write_audio_shards_index(tmp_path):
+    paths = write_clips(tmp_path)
+    out = str(tmp_path / 'shards')
+    shards = write_audio_shards(paths, out, clips_per_shard=3)
+    with open(shard_index_path(out), 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    assert index['num_clips'] == 10
+    assert [s['num_clips'] for s in shards] == [3, 3, 3, 1]
+
+
+def test_sharded_dataset_yields_every_clip_once(tmp_path):
+    paths = write_clips(tmp_path)
+    ds = make_dataset(tmp_path, paths)
+    assert len(ds) == 10
+    items = list(ds)
+    assert len(items) == 10
+    assert sorted(item['path'] for item in items) == sorted(paths)
+    for item in items:
+        assert item['clip'].shape == (1, 4000)
+        assert item['clip_lengths'] == 4000
+        i = paths.index(item['path'])
+        assert item['prepad_length'] == min(2205 + i * 100, 4000)
+
+
+def test_sharded_dataset_epochs_reshuffle(tmp_path):
+    paths = write_clips(tmp_path)
+    ds = make_dataset(tmp_path, paths, clips_per_shard=2)
+    first = [item['path'] for item in ds]
+    ds.set_epoch(1)
+    second = [item['path'] for item in ds]
+    assert sorted(first) == sorted(second) and first != second
+
+
+def test_sharded_dataset_len_is_per_rank(tmp_path, monkeypatch):
+    paths = write_clips(tmp_path)
+    ds = make_dataset(tmp_path, paths)
+    monkeypatch.setattr(ds, 'get_rank', lambda: (1, 4))
+    assert len(ds) == 2
+    assert len(list(ds)) == 2
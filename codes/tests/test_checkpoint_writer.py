@@ -0,0 +1,71 @@
+import os
+
+import pytest
+import torch
+
+from utils.checkpoint_writer import AsyncCheckpointWriter, PinnedBufferPool, atomic_save, snapshot_to_cpu
+
+
+def make_state():
+    model = torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.BatchNorm1d(4))
+    return {'model': model.state_dict(), 'step': 7, 'groups': [{'lr': .1, 'buf': torch.ones(3)}], 'pair': (1, 'a')}
+
+
+def test_snapshot_copies_and_keeps_structure():
+    state = make_state()
+    snap = snapshot_to_cpu(state)
+    assert snap['step'] == 7 and snap['pair'] == (1, 'a') and snap['groups'][0]['lr'] == .1
+    assert snap['model']._metadata == state['model']._metadata
+    for k, v in state['model'].items():
+        assert torch.equal(snap['model'][k], v) and snap['model'][k].data_ptr() != v.data_ptr()
+    state['groups'][0]['buf'].add_(1)
+    assert torch.equal(snap['groups'][0]['buf'], torch.ones(3))
+
+
+def test_pool_reuses_released_buffers():
+    pool = PinnedBufferPool()
+    state = make_state()
+    lease = []
+    first = snapshot_to_cpu(state, pool, lease)
+    ptrs = {t.data_ptr() for _, t in lease}
+    # Buffers still leased out are not handed out again.
+    second = snapshot_to_cpu(state, pool, [])
+    assert not ptrs & {t.data_ptr() for t in second['model'].values()}
+    pool.release(lease)
+    third_lease = []
+    snapshot_to_cpu(state, pool, third_lease)
+    assert {t.data_ptr() for _, t in third_lease} == ptrs
+
+
+def test_writer_round_trip(tmp_path):
+    writer = AsyncCheckpointWriter()
+    state = make_state()
+    snap, lease = writer.snapshot(state)
+    writer.submit(atomic_save, snap, str(tmp_path / 'ckpt.pth'))
+    writer.release(lease)
+    writer.flush()
+    loaded = torch.load(str(tmp_path / 'ckpt.pth'))
+    for k, v in state['model'].items():
+        assert torch.equal(loaded['model'][k], v)
+    assert not os.path.exists(str(tmp_path / 'ckpt.pth.tmp'))
+    writer.close()
+
+
+def test_writer_runs_jobs_in_order_and_reraises_errors():
+    writer = AsyncCheckpointWriter(max_pending=1)
+    done = []
+    for i in range(5):
+        writer.submit(done.append, i)
+
+    def fail():
+        raise ValueError('disk full')
+    writer.submit(fail)
+    writer.submit(done.append, 5)
+    with pytest.raises(RuntimeError):
+        writer.flush()
+    assert done == list(range(6))
+    writer.flush()  # The error is only raised once.
+    writer.close()
+    # Once closed, jobs run synchronously.
+    writer.submit(done.append, 6)
+    assert done[-1] == 6
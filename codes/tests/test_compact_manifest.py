@@ -0,0 +1,32 @@
+from data.audio.paired_voice_audio_dataset import CompactManifest, load_tsv_type
+
+
+def make_rows(n=20):
+    return [[f'/data/clip_{i}.wav', f'text number {i} ü', [i, i+1, i+2][:i % 4], i % 3] for i in range(n)]
+
+
+def test_round_trip_with_codes():
+    rows = make_rows()
+    manifest = CompactManifest(has_codes=True)
+    manifest.extend(rows[:7])
+    manifest.extend(rows[7:])
+    manifest.finalize(seed=1)
+    assert len(manifest) == len(rows)
+    seen = {}
+    for row in manifest:
+        seen[row[0]] = [row[0], row[1], row[2].tolist(), row[3]]
+    assert sorted(seen.values()) == sorted(rows)
+
+
+def test_round_trip_without_codes_and_shuffle_is_seeded(tmp_path):
+    tsv = tmp_path / 'manifest.tsv'
+    tsv.write_text('hello\ta.wav\nworld\tb.wav\nbad line\nagain\tc.wav\n', encoding='utf-8')
+    rows = load_tsv_type(str(tsv), 2)
+    orders = []
+    for _ in range(2):
+        manifest = CompactManifest(has_codes=False)
+        manifest.extend(rows)
+        manifest.finalize(seed=5)
+        orders.append(list(manifest))
+    assert orders[0] == orders[1]
+    assert sorted(orders[0]) == sorted(rows)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from data.data_sampler import BucketBatchSampler, budget_batch_sizes, compute_length_buckets
+
+
+def make_buckets(num_items=1000, max_length=48000, seed=0):
+    lengths = np.random.RandomState(seed).randint(1000, max_length, size=num_items)
+    boundaries, item_bucket = compute_length_buckets(lengths, 8, max_length, multiple=1024)
+    buckets = [np.nonzero(item_bucket == b)[0] for b in range(len(boundaries))]
+    return lengths, boundaries, buckets
+
+
+def test_compute_length_buckets_excludes_invalid():
+    lengths = np.array([-1, 100, 2000, 5000, 9000])
+    boundaries, item_bucket = compute_length_buckets(lengths, 2, 4096, multiple=1024)
+    assert boundaries[-1] == 4096
+    assert item_bucket[0] == -1 and item_bucket[-2] == -1 and item_bucket[-1] == -1
+    for length, b in zip(lengths, item_bucket):
+        if b >= 0:
+            assert length <= boundaries[b]
+
+
+def test_compute_length_buckets_no_valid_items():
+    with pytest.raises(ValueError):
+        compute_length_buckets(np.array([-1, -1, 10000]), 4, 4096)
+
+
+def test_budget_batch_sizes_respects_budget():
+    _, boundaries, _ = make_buckets()
+    max_elements = 48000 * 8
+    batch_sizes = budget_batch_sizes(boundaries, max_elements, multiple=4)
+    for b, bs in zip(boundaries, batch_sizes):
+        assert bs % 4 == 0
+        assert bs * b <= max_elements
+    assert batch_sizes == sorted(batch_sizes, reverse=True)
+
+
+def test_bucket_batch_sampler_emits_each_index_once():
+    lengths, boundaries, buckets = make_buckets()
+    batch_sizes = budget_batch_sizes(boundaries, 48000 * 8)
+    sampler = BucketBatchSampler(buckets, None, batch_sizes=batch_sizes)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    emitted = np.concatenate(batches)
+    assert len(np.unique(emitted)) == len(emitted)
+    # Only the remainder of each bucket (less than one batch) is left out.
+    dropped = sum(len(b) % bs for b, bs in zip(buckets, batch_sizes))
+    assert len(emitted) + dropped == sum(len(b) for b in buckets)
+    for batch in batches:
+        assert len(set(np.searchsorted(boundaries, lengths[batch], side='left'))) == 1
+        assert len(batch) * lengths[batch].max() <= 48000 * 8
+
+
+def test_bucket_batch_sampler_ddp_split():
+    _, boundaries, buckets = make_buckets()
+    num_replicas = 4
+    batch_sizes = budget_batch_sizes(boundaries, 48000 * 8, multiple=num_replicas)
+    samplers = [BucketBatchSampler(buckets, None, num_replicas=num_replicas, rank=r, seed=3, batch_sizes=batch_sizes)
+                for r in range(num_replicas)]
+    for s in samplers:
+        s.set_epoch(2)
+    per_rank = [list(s) for s in samplers]
+    assert len(set(len(batches) for batches in per_rank)) == 1
+    single = BucketBatchSampler(buckets, None, seed=3, batch_sizes=batch_sizes)
+    single.set_epoch(2)
+    for step, global_batch in enumerate(single):
+        # Every rank takes an equal, disjoint slice of the same global batch.
+        slices = [batches[step] for batches in per_rank]
+        assert len(set(len(s) for s in slices)) == 1
+        assert sorted(np.concatenate(slices).tolist()) == sorted(global_batch)
@@ -0,0 +1,49 @@
+import os
+
+import torch
+
+from data.audio.dvae_code_cache import DvaeCodeCache, hash_file_contents
+
+
+def test_put_get_round_trip(tmp_path):
+    cache = DvaeCodeCache(str(tmp_path / 'cache'), create=True)
+    codes = torch.randint(0, 8192, (100,))
+    mel = torch.randn(80, 400)
+    cache.put('ab' * 20, codes, mel)
+    assert cache.contains('ab' * 20)
+    got_codes, got_mel = cache.get('ab' * 20, load_mel=True)
+    assert torch.equal(got_codes, codes)
+    assert torch.allclose(got_mel, mel.half().float())
+    assert cache.get('cd' * 20) is None
+
+
+def test_info_compatibility(tmp_path):
+    cache = DvaeCodeCache(str(tmp_path), create=True)
+    cache.write_info(sample_rate=22050, max_wav_length=100)
+    reopened = DvaeCodeCache(str(tmp_path))
+    reopened.check_compatible(sample_rate=22050)
+    try:
+        reopened.check_compatible(sample_rate=24000)
+        assert False, 'check_compatible() should have raised'
+    except ValueError:
+        pass
+
+
+def test_path_index(tmp_path):
+    clip = tmp_path / 'clip.wav'
+    clip.write_bytes(b'abc' * 1000)
+    cache = DvaeCodeCache(str(tmp_path / 'cache'), create=True)
+    key = hash_file_contents(str(clip))
+    st = os.stat(clip)
+    cache.record_path(str(clip), key, st.st_size, st.st_mtime_ns)
+    cache.put(key, torch.arange(10))
+    cache.save_path_index()
+
+    reopened = DvaeCodeCache(str(tmp_path / 'cache'))
+    assert reopened.key_for_file(str(clip)) == key
+    assert torch.equal(reopened.get_for_file(str(clip))[0], torch.arange(10))
+
+    # A modified file is hashed again rather than served from the index.
+    clip.write_bytes(b'abcd' * 1000)
+    assert reopened.key_for_file(str(clip)) == hash_file_contents(str(clip)) != key
+    assert reopened.get_for_file(str(clip)) is None
@@ -0,0 +1,79 @@
+import copy
+
+import torch
+
+from trainer.ema import BackgroundCpuEma, FusedEma, infrequent_ema_rate
+
+
+def make_model():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Linear(8, 16), torch.nn.ReLU(), torch.nn.Linear(16, 4))
+
+
+def moved_model_and_ema():
+    model = make_model()
+    ema = copy.deepcopy(model)
+    with torch.no_grad():
+        for p in model.parameters():
+            p.add_(1)
+    return model, ema
+
+
+def expected_ema(ema, model, rate):
+    return [e.detach().clone() * rate + p.detach() * (1 - rate) for e, p in zip(ema.parameters(), model.parameters())]
+
+
+def test_fused_ema_updates_parameters():
+    model, ema = moved_model_and_ema()
+    expected = expected_ema(ema, model, .9)
+    FusedEma(ema, model).update(.9)
+    for e, x in zip(ema.parameters(), expected):
+        assert torch.allclose(e, x)
+
+
+def test_background_cpu_ema_updates_parameters():
+    model, ema = moved_model_and_ema()
+    expected = expected_ema(ema, model, .9)
+    updater = BackgroundCpuEma(ema, model)
+    updater.update(.9)
+    updater.wait()
+    for e, x in zip(ema.parameters(), expected):
+        assert torch.allclose(e, x)
+    # The module itself (not just the updater's buffers) must see the new weights.
+    inp = torch.randn(2, 8)
+    reference = make_model()
+    with torch.no_grad():
+        for r, x in zip(reference.parameters(), expected):
+            r.copy_(x)
+    assert torch.allclose(ema(inp), reference(inp), atol=1e-6)
+
+
+def test_background_cpu_ema_repeated_updates():
+    model, ema = moved_model_and_ema()
+    expected = [e.detach().clone() for e in ema.parameters()]
+    updater = BackgroundCpuEma(ema, model, bucket_numel=64)  # Several buckets per dtype.
+    for _ in range(3):
+        expected = [x * .5 + p.detach() * .5 for x, p in zip(expected, model.parameters())]
+        updater.update(.5)
+    updater.wait()
+    for e, x in zip(ema.parameters(), expected):
+        assert torch.allclose(e, x)
+    assert torch.allclose(ema.state_dict()['0.weight'], expected[0])
+
+
+def test_background_cpu_ema_reraises_errors():
+    model, ema = moved_model_and_ema()
+    updater = BackgroundCpuEma(ema, model)
+    updater.update('not a rate')
+    try:
+        updater.wait()
+        assert False, 'wait() should have raised'
+    except RuntimeError:
+        pass
+    updater.update(.9)
+    updater.wait()
+
+
+def test_infrequent_ema_rate():
+    assert abs(infrequent_ema_rate(.999, 1) - .999) < 1e-9
+    assert .999 ** 10 < infrequent_ema_rate(.999, 10) < .999
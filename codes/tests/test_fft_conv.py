@@ -0,0 +1,43 @@
+import torch
+import torch.nn.functional as F
+
+from utils.fft_conv import FftConvolver
+
+
+def conv1d_reference(signal, kernel):
+    # Causal convolution, truncated to the signal length. conv1d computes a cross-correlation, so flip the kernel.
+    return F.conv1d(F.pad(signal.view(1, 1, -1), (kernel.shape[-1]-1, 0)), kernel.flip(0).view(1, 1, -1)).view(-1)
+
+
+def make_kernels():
+    torch.manual_seed(0)
+    kernels = torch.randn(3, 100)
+    kernels[1, 60:] = 0  # A shorter, zero-padded kernel.
+    return kernels
+
+
+def test_single_fft_matches_conv1d():
+    kernels = make_kernels()
+    convolver = FftConvolver(kernels)
+    signal = torch.randn(90)
+    for k in range(len(convolver)):
+        assert torch.allclose(convolver(signal, k), conv1d_reference(signal, kernels[k]), atol=1e-4)
+
+
+def test_overlap_add_matches_conv1d():
+    kernels = make_kernels()
+    convolver = FftConvolver(kernels, block_size=64)
+    signals = torch.randn(3, 1000)
+    out = convolver(signals, torch.tensor([2, 0, 1]))
+    assert out.shape == signals.shape
+    for row, k in enumerate([2, 0, 1]):
+        assert torch.allclose(out[row], conv1d_reference(signals[row], kernels[k]), atol=1e-4)
+
+
+def test_int_kernel_index_applies_to_all_rows():
+    kernels = make_kernels()
+    convolver = FftConvolver(kernels)
+    signals = torch.randn(2, 300)
+    out = convolver(signals, 1)
+    for row in range(2):
+        assert torch.allclose(out[row], conv1d_reference(signals[row], kernels[1]), atol=1e-4)
@@ -0,0 +1,56 @@
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from utils.util import group_grad_norms
+
+
+def make_groups(scale=1.):
+    torch.manual_seed(0)
+    model = torch.nn.Sequential(torch.nn.Linear(4, 8), torch.nn.Linear(8, 2), torch.nn.Linear(2, 2))
+    (model(torch.randn(5, 4)).sum() * scale).backward()
+    model[2].weight.grad = None
+    model[2].bias.grad = None
+    return {'first': list(model[0].parameters()), 'second': list(model[1].parameters()),
+            'no_grads': list(model[2].parameters())}
+
+
+def expected_norm(params):
+    return torch.cat([p.grad.reshape(-1) for p in params]).norm(2)
+
+
+def test_group_grad_norms():
+    groups = make_groups()
+    norms = group_grad_norms(groups)
+    assert sorted(norms.keys()) == ['first', 'second']
+    for name in ['first', 'second']:
+        assert norms[name].device.type == 'cpu'
+        assert torch.allclose(norms[name], expected_norm(groups[name]))
+    assert group_grad_norms({'empty': []}) == {}
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _worker(rank, port, results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=2)
+    results[rank] = {k: v.item() for k, v in group_grad_norms(make_groups(scale=rank + 1)).items()}
+    dist.destroy_process_group()
+
+
+def test_group_grad_norms_distributed():
+    results = mp.Manager().dict()
+    mp.spawn(_worker, args=(_free_port(), results), nprocs=2)
+    groups = make_groups()
+    for name in ['first', 'second']:
+        # Gradients on rank 1 are twice those on rank 0, so the mean norm is 1.5x the norm on rank 0.
+        expected = expected_norm(groups[name]).item() * 1.5
+        assert abs(results[0][name] - expected) < 1e-4 and results[0][name] == results[1][name]
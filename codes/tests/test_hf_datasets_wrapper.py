@@ -0,0 +1,35 @@
+import pytest
+import torch
+
+datasets = pytest.importorskip('datasets')
+
+from data.text.hf_datasets_wrapper import HfDataset, StreamingHfDataset
+
+
+def make_corpora(tmp_path):
+    corpi = []
+    for name, count in [('a', 7), ('b', 5)]:
+        datasets.Dataset.from_dict({'text': [f'{name}{i}' for i in range(count)]}).save_to_disk(str(tmp_path / name))
+        corpi.append(['arrow', str(tmp_path / name / '*.arrow')])
+    return corpi
+
+
+def test_indexing_across_corpora(tmp_path):
+    ds = HfDataset(make_corpora(tmp_path), cache_path=str(tmp_path / 'cache'), key_maps={'t': 'text'})
+    assert len(ds) == 12
+    assert [ds[i]['t'] for i in range(len(ds))] == [f'a{i}' for i in range(7)] + [f'b{i}' for i in range(5)]
+    with pytest.raises(IndexError):
+        ds[12]
+
+
+def test_streaming_covers_every_item(tmp_path):
+    ds = StreamingHfDataset(make_corpora(tmp_path), cache_path=str(tmp_path / 'cache'), shuffle_buffer=4)
+    expected = sorted([f'a{i}' for i in range(7)] + [f'b{i}' for i in range(5)])
+    first = [v['text'] for v in ds]
+    assert sorted(first) == expected
+    ds.set_epoch(1)
+    second = [v['text'] for v in ds]
+    assert sorted(second) == expected and second != first
+    # Dataloader workers each read a disjoint part of every corpus.
+    dl = torch.utils.data.DataLoader(ds, batch_size=None, num_workers=2)
+    assert sorted(v['text'] for v in dl) == expected
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+from data.audio.length_index import LENGTH_DTYPE, build_length_index, build_path_length_index, get_duration, \
+    length_filter, load_length_index
+
+
+def write_wav(path, seconds, sr=16000):
+    sf.write(str(path), np.zeros((int(seconds * sr),), dtype=np.float32), sr)
+    return str(path)
+
+
+def test_get_duration(tmp_path):
+    assert get_duration(write_wav(tmp_path / 'a.wav', 1.5)) == (1.5, None)
+    bad = tmp_path / 'bad.wav'
+    bad.write_bytes(b'garbage')
+    duration, err = get_duration(str(bad))
+    assert duration == -1 and err is not None
+
+
+def test_round_trip(tmp_path):
+    manifest = tmp_path / 'manifest.tsv'
+    manifest.write_text('unused', encoding='utf-8')
+    rows = [[write_wav(tmp_path / 'a.wav', 1), 'hello'], [str(tmp_path / 'missing.wav'), 'hi'],
+            [write_wav(tmp_path / 'b.wav', 2), None]]
+    built = build_length_index(str(manifest), rows, lambda t: t.split(' '), num_workers=2)
+    index = load_length_index(str(manifest), len(rows))
+    assert index.dtype == LENGTH_DTYPE and np.array_equal(index, built)
+    assert index['duration'].tolist() == [1, -1, 2]
+    assert index['text_len'].tolist() == [1, 1, -1]
+    with pytest.raises(ValueError):
+        load_length_index(str(manifest), len(rows) + 1)
+    with pytest.raises(FileNotFoundError):
+        load_length_index(str(tmp_path / 'other.tsv'), 1)
+
+
+def test_path_length_index(tmp_path):
+    cache = str(tmp_path / 'paths.pth')
+    index = build_path_length_index(cache, [write_wav(tmp_path / 'a.wav', .5)], num_workers=1)
+    assert index['duration'].tolist() == [.5] and index['text_len'].tolist() == [0]
+
+
+def test_length_filter():
+    index = np.array([(1, 10), (-1, 10), (3, 10), (.1, 10), (1, -1), (1, 50)], dtype=LENGTH_DTYPE)
+    keep = length_filter(index, 16000, max_samples=32000, min_samples=8000, max_text_len=20)
+    assert keep.tolist() == [True, False, False, False, False, False]
+    assert length_filter(index, 16000).tolist() == [True, False, True, True, False, True]
@@ -0,0 +1,29 @@
+import torch
+
+from utils.loss_accumulator import LossAccumulator
+
+
+def test_means_over_ring_buffer():
+    acc = LossAccumulator(buffer_sz=4)
+    w = torch.ones(1, requires_grad=True)
+    for v in [1., 2., 3.]:
+        acc.add_loss('l', (w * v).sum())
+        acc.add_loss('n', v)  # Plain python numbers are accepted too.
+    acc.increment_metric('steps')
+    acc.increment_metric('steps')
+    d = acc.as_dict()
+    assert d['loss_l'].item() == 2. and d['loss_n'].item() == 2. and d['steps'] == 2
+    assert not d['loss_l'].requires_grad
+    for v in [10., 10.]:
+        acc.add_loss('l', torch.tensor(v))
+    # The buffer wrapped around: it now holds 10, 2, 3, 10.
+    assert acc.as_dict()['loss_l'].item() == 6.25
+
+
+def test_buffers_stay_on_the_input_device():
+    devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+    for device in devices:
+        acc = LossAccumulator()
+        acc.add_loss('l', torch.tensor(1., device=device))
+        assert acc.buffers['l'][1].device.type == device
+        assert acc.as_dict()['loss_l'].device.type == device
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+
+import torch
+
+from utils.mmap_checkpoint import is_mmap_checkpoint, load_checkpoint, load_mmap_checkpoint, save_mmap_checkpoint
+
+
+def make_model():
+    torch.manual_seed(0)
+    return torch.nn.Sequential(torch.nn.Conv1d(2, 4, 3), torch.nn.BatchNorm1d(4))
+
+
+def test_round_trip_all_dtypes(tmp_path):
+    sd = OrderedDict()
+    for dtype in [torch.float64, torch.float32, torch.float16, torch.bfloat16, torch.int64, torch.int32, torch.int16,
+                  torch.int8, torch.uint8]:
+        sd[str(dtype)] = (torch.randn(3, 5) * 10).to(dtype)
+    sd['bool'] = torch.randn(7) > 0
+    sd['empty'] = torch.zeros(0, 4)
+    sd['scalar'] = torch.tensor(3.)
+    sd['strided'] = torch.randn(4, 6).t()
+    path = str(tmp_path / 'ckpt.pth')
+    save_mmap_checkpoint(sd, path)
+    assert is_mmap_checkpoint(path)
+    loaded = load_mmap_checkpoint(path)
+    assert list(loaded.keys()) == list(sd.keys())
+    for k, v in sd.items():
+        assert loaded[k].dtype == v.dtype and torch.equal(loaded[k], v), k
+    # Loaded tensors are copy-on-write: writing to them leaves the file alone.
+    loaded['torch.float32'].zero_()
+    assert torch.equal(load_mmap_checkpoint(path)['torch.float32'], sd['torch.float32'])
+
+
+def test_load_state_dict_with_prefix(tmp_path):
+    model = make_model()
+    sd = OrderedDict((f'module.{k}', v) for k, v in model.state_dict().items())
+    sd['other.weight'] = torch.ones(2)
+    path = str(tmp_path / 'ckpt.pth')
+    save_mmap_checkpoint(sd, path)
+    loaded = load_checkpoint(path, prefix='module.')
+    assert 'other.weight' not in loaded.keys()
+    target = torch.nn.Sequential(torch.nn.Conv1d(2, 4, 3), torch.nn.BatchNorm1d(4))
+    target.load_state_dict(loaded)
+    for k, v in model.state_dict().items():
+        assert torch.equal(target.state_dict()[k], v)
+
+
+def test_metadata_survives(tmp_path):
+    model = make_model()
+    path = str(tmp_path / 'ckpt.pth')
+    save_mmap_checkpoint(model.state_dict(), path)
+    assert load_checkpoint(path)._metadata == model.state_dict()._metadata
+
+
+def test_loads_torch_checkpoints(tmp_path):
+    model = make_model()
+    path = str(tmp_path / 'ckpt.pth')
+    torch.save({'state_dict': OrderedDict((f'module.{k}', v) for k, v in model.state_dict().items())}, path)
+    assert not is_mmap_checkpoint(path)
+    loaded = load_checkpoint(path)
+    assert loaded.keys() == model.state_dict().keys()
+    for k, v in model.state_dict().items():
+        assert torch.equal(loaded[k], v)
@@ -0,0 +1,73 @@
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from data.audio.preprocessed_mel_dataset import PackedMelDataset, PackedMelStore, PackedMelWriter, \
+    PreprocessedMelDataset
+
+
+def make_mels(count=5, shape=(1, 8), seed=0):
+    rng = np.random.RandomState(seed)
+    # Values representable in float16, so the packed copy is exact.
+    return [rng.randn(*shape, rng.randint(3, 20)).astype(np.float16).astype(np.float32) for _ in range(count)]
+
+
+def write_store(prefix, mels, names):
+    writer = PackedMelWriter(prefix)
+    for mel, name in zip(mels, names):
+        writer.add(mel, name)
+    writer.close()
+
+
+def test_store_round_trip(tmp_path):
+    mels = make_mels()
+    write_store(str(tmp_path / 'store'), mels, [f'ü{i}.npz' for i in range(len(mels))])
+    store = PackedMelStore(str(tmp_path / 'store'))
+    assert len(store) == len(mels) and store.info['mel_shape'] == [1, 8]
+    for i, mel in enumerate(mels):
+        entry = store.index[i]
+        frames = store.mels[entry['mel_off']:entry['mel_off']+entry['mel_len']]
+        assert np.array_equal(frames.T.reshape(mel.shape), mel)
+        assert store.path(i) == f'ü{i}.npz'
+    writer = PackedMelWriter(str(tmp_path / 'bad'))
+    writer.add(np.zeros((1, 8, 3)), 'a')
+    with pytest.raises(AssertionError):
+        writer.add(np.zeros((1, 4, 3)), 'b')
+
+
+def test_matches_preprocessed_mel_dataset(tmp_path):
+    mels = make_mels()
+    paths = []
+    for i, mel in enumerate(mels):
+        paths.append(str(tmp_path / f'{i}.npz'))
+        np.savez(paths[-1], mel)
+    opt = {'path': str(tmp_path), 'cache_path': str(tmp_path / 'cache.pth'), 'pad_to_samples': 24, 'should_squeeze': True}
+    reference = PreprocessedMelDataset(opt)
+    write_store(str(tmp_path / 'store'), [np.load(p)['arr_0'] for p in reference.paths], reference.paths)
+    packed = PackedMelDataset({'path': [str(tmp_path / 'store')], 'pad_to_samples': 24, 'should_squeeze': True})
+    assert len(packed) == len(reference)
+    for i in range(len(reference)):
+        expected, actual = reference[i], packed[i]
+        assert expected.keys() == actual.keys()
+        for k in expected.keys():
+            if isinstance(expected[k], torch.Tensor):
+                assert torch.equal(expected[k], actual[k]), k
+            else:
+                assert expected[k] == actual[k]
+
+
+def test_random_crop(tmp_path):
+    mels = make_mels(count=1)
+    mels[0] = np.arange(8 * 30, dtype=np.float32).reshape(1, 8, 30)
+    write_store(str(tmp_path / 'store'), mels, ['a'])
+    ds = PackedMelDataset({'path': str(tmp_path / 'store'), 'pad_to_samples': 10, 'random_crop': True})
+    random.seed(0)
+    for _ in range(5):
+        item = ds[0]
+        start = int(item['mel'][0, 0, 0].item())
+        assert torch.equal(item['mel'], torch.from_numpy(mels[0][..., start:start+10]))
+        assert (item['mask'] == 0).all()
+    with pytest.raises(AssertionError):
+        PackedMelDataset({'path': str(tmp_path / 'store'), 'pad_to_samples': 10})[0]
@@ -0,0 +1,62 @@
+import random
+
+import torch
+
+from data.audio.packed_voice_dataset import PackedVoiceDataset, PackedVoiceShard, PackedVoiceShardWriter
+
+
+def write_shard(prefix, clips):
+    writer = PackedVoiceShardWriter(str(prefix), 22050)
+    for path, text, tokens, wav, codes, similar in clips:
+        writer.add(path, text, tokens, wav, codes=codes, type=1, similar_paths=similar)
+    writer.close()
+
+
+def make_clips():
+    torch.manual_seed(0)
+    return [
+        ('a.wav', 'hello', [1, 2, 3], torch.rand(1, 1000) * 2 - 1, [5, 6], ['b.wav', 'missing.wav']),
+        ('b.wav', 'wörld', [4], torch.rand(1, 700) * 2 - 1, None, None),
+    ]
+
+
+def test_shard_round_trip(tmp_path):
+    clips = make_clips()
+    write_shard(tmp_path / 'shard', clips)
+    shard = PackedVoiceShard(str(tmp_path / 'shard'))
+    assert len(shard) == 2 and shard.info['total_samples'] == 1700
+    for row, (_, _, _, wav, _, _) in enumerate(clips):
+        assert torch.allclose(shard.audio_window(row), wav, atol=1 / 32767)
+    assert torch.allclose(shard.audio_window(0, 100, 50), clips[0][3][:, 100:150], atol=1 / 32767)
+    # Missing conditioning candidates are dropped; clips without any condition on themselves.
+    assert shard.cond[shard.index[0]['cond_off']:][:shard.index[0]['cond_len']].tolist() == [1]
+    assert shard.cond[shard.index[1]['cond_off']:][:shard.index[1]['cond_len']].tolist() == [1]
+
+
+def test_dataset_items(tmp_path):
+    clips = make_clips()
+    write_shard(tmp_path / 'one', clips[:1])
+    write_shard(tmp_path / 'two', clips[1:])
+    ds = PackedVoiceDataset({'path': [str(tmp_path / 'one'), str(tmp_path / 'two')], 'max_wav_length': 1200,
+                             'max_text_length': 8, 'load_aligned_codes': True, 'aligned_codes_ratio': 100,
+                             'load_conditioning': True, 'conditioning_length': 800})
+    assert len(ds) == 2
+    for i, (path, text, tokens, wav, codes, _) in enumerate(clips):
+        item = ds[i]
+        assert item['filenames'] == path and item['real_text'] == text and item['type'] == 1
+        assert item['padded_text'].shape == (8,) and item['padded_text'][:len(tokens)].tolist() == tokens
+        assert item['text_lengths'] == len(tokens) and item['wav_lengths'] == wav.shape[-1]
+        assert item['wav'].shape == (1, 1200)
+        assert torch.allclose(item['wav'][:, :wav.shape[-1]], wav, atol=1 / 32767)
+        assert item['aligned_codes'].shape == (12,)
+        assert item['aligned_codes'][:item['aligned_codes_lengths']].tolist() == (codes or [])
+        assert item['conditioning'].shape == (1, 800)
+
+
+def test_dataset_skips_items_over_limits(tmp_path):
+    clips = make_clips()
+    write_shard(tmp_path / 'shard', clips)
+    ds = PackedVoiceDataset({'path': str(tmp_path / 'shard'), 'max_wav_length': 800, 'max_text_length': 8})
+    random.seed(0)
+    for _ in range(5):
+        assert ds[0]['filenames'] == 'b.wav'
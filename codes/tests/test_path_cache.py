@@ -0,0 +1,56 @@
+import os
+
+import pytest
+import torch
+
+from data.path_cache import DirectoryScanCache, filter_key, scan_directories
+from data.util import load_paths_from_cache
+
+
+def make_tree(root):
+    for d in ['a', 'a/b', 'c']:
+        os.makedirs(root / d, exist_ok=True)
+    for f in ['a/1.wav', 'a/b/2.flac', 'a/b/notes.txt', 'c/3.mp3']:
+        (root / f).write_bytes(b'')
+    return str(root)
+
+
+def test_cache_round_trip(tmp_path):
+    cache = DirectoryScanCache({'/x': (1, ['a.wav', 'ü.wav']), '/x/y': (2, []), '/z': (3, ['b.wav'])},
+                               filter_key('f', [], [], []))
+    cache.save(str(tmp_path / 'cache'))
+    loaded = DirectoryScanCache.load(str(tmp_path / 'cache'))
+    assert loaded.dirs == cache.dirs and loaded.key == cache.key
+    assert loaded.paths_under('/x') == [os.path.join('/x', 'a.wav'), os.path.join('/x', 'ü.wav')]
+    assert DirectoryScanCache.load(str(tmp_path / 'missing')) is None
+
+
+def test_rescan_only_lists_changed_directories(tmp_path):
+    root = make_tree(tmp_path / 'data')
+    cache, listed, reused = scan_directories([root], lambda p: p.endswith('.wav'), num_threads=4)
+    assert (listed, reused) == (4, 0)
+    (tmp_path / 'data' / 'c' / '4.wav').write_bytes(b'')
+    cache, listed, reused = scan_directories([root], lambda p: p.endswith('.wav'), cache, num_threads=4)
+    assert (listed, reused) == (1, 3)
+    assert cache.paths_under(root) == [os.path.join(root, 'a', '1.wav'), os.path.join(root, 'c', '4.wav')]
+    with pytest.raises(OSError):
+        scan_directories([str(tmp_path / 'missing')], lambda p: True)
+
+
+def test_load_paths_from_cache(tmp_path):
+    root = make_tree(tmp_path / 'data')
+    cache_path = str(tmp_path / 'cache.pth')
+    expected = [os.path.join(root, f) for f in ['a/1.wav', 'a/b/2.flac', 'c/3.mp3']]
+    assert load_paths_from_cache(root, cache_path) == expected
+    assert DirectoryScanCache.load(cache_path) is not None
+    (tmp_path / 'data' / 'a' / 'b' / '5.wav').write_bytes(b'')
+    assert load_paths_from_cache(root, cache_path) == sorted(expected + [os.path.join(root, 'a/b/5.wav')])
+    # Different filters invalidate the cache rather than reusing its filtered listings.
+    assert load_paths_from_cache(root, cache_path, not_endswith=['.mp3']) == \
+        sorted(expected[:2] + [os.path.join(root, 'a/b/5.wav')])
+
+
+def test_legacy_cache_is_returned_as_is(tmp_path):
+    cache_path = str(tmp_path / 'cache.pth')
+    torch.save(['/old/a.wav'], cache_path)
+    assert load_paths_from_cache(str(tmp_path), cache_path) == ['/old/a.wav']
@@ -0,0 +1,54 @@
+import os
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from utils.util import reduce_log_metrics
+
+
+def test_reduce_log_metrics_single_process():
+    log = {'loss': torch.tensor(2.), 'hist': torch.ones(3), 'count': 4, 'lr': 1e-4}
+    assert reduce_log_metrics(log, 'cpu') is None
+    assert log['loss'].item() == 2 and log['hist'].tolist() == [1, 1, 1] and log['count'] == 4
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _worker(rank, port, results):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=2)
+    logs = [
+        {'a': torch.tensor(1. + rank), 'h': torch.ones(3) * rank},
+        # 'b' only exists on rank 1: it is new, so it is logged unreduced and the keys are agreed on again.
+        {'a': torch.tensor(2.), 'b': torch.tensor(4.)} if rank == 1 else {'a': torch.tensor(2.)},
+        # Now 'b' is averaged over the ranks that have it, and reported on every rank.
+        {'a': torch.tensor(3.), 'b': torch.tensor(4. * rank)} if rank == 1 else {'a': torch.tensor(3.)},
+        {'a': torch.tensor(3.), 'b': torch.tensor(4. * rank)},
+    ]
+    agreed = None
+    out = []
+    for log in logs:
+        agreed = reduce_log_metrics(log, 'cpu', agreed)
+        out.append({k: v.tolist() for k, v in log.items()})
+    results[rank] = out
+    dist.destroy_process_group()
+
+
+def test_reduce_log_metrics_distributed():
+    results = mp.Manager().dict()
+    mp.spawn(_worker, args=(_free_port(), results), nprocs=2)
+    for rank in range(2):
+        out = results[rank]
+        assert out[0] == {'a': 1.5, 'h': [.5, .5, .5]}
+        assert out[1]['a'] == 2.
+        assert out[2]['a'] == 3.
+        assert out[3] == {'a': 3., 'b': 2.}
+    assert 'b' not in results[0][1] and results[1][1]['b'] == 4.
+    assert results[0][2]['b'] == 4. and results[1][2]['b'] == 4.
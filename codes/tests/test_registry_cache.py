@@ -0,0 +1,67 @@
+import importlib
+import json
+import os
+import sys
+
+from utils import registry_cache
+from utils.registry_cache import load_registry, registry_manifest_path, resolve_registered
+
+
+def make_package(tmp_path, monkeypatch, name):
+    base = tmp_path / name
+    os.makedirs(base)
+    (base / '__init__.py').write_text('')
+    (base / 'first.py').write_text('class Foo:\n    pass\n')
+    (base / 'second.py').write_text('class Bar:\n    pass\n')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(registry_cache, '_loaded', {})
+    calls = []
+
+    def scan_fn():
+        calls.append(1)
+        found = {}
+        for mod in ['first', 'second', 'third']:
+            if os.path.exists(base / f'{mod}.py'):
+                m = importlib.import_module(f'{name}.{mod}')
+                found.update({k.lower(): v for k, v in vars(m).items() if isinstance(v, type)})
+        return found
+    return str(base), scan_fn, calls
+
+
+def test_manifest_round_trip(tmp_path, monkeypatch):
+    base, scan_fn, calls = make_package(tmp_path, monkeypatch, 'registry_pkg_a')
+    entries = load_registry(base, 'thing', scan_fn)
+    assert entries == {'foo': ['registry_pkg_a.first', 'Foo'], 'bar': ['registry_pkg_a.second', 'Bar']}
+    with open(registry_manifest_path(base, 'thing'), 'r', encoding='utf-8') as f:
+        assert json.load(f)['entries'] == entries
+    # A fresh process reads the manifest instead of scanning, and only imports the module it needs.
+    monkeypatch.setattr(registry_cache, '_loaded', {})
+    for mod in ['registry_pkg_a.first', 'registry_pkg_a.second']:
+        monkeypatch.delitem(sys.modules, mod)
+    obj, names = resolve_registered(base, 'thing', scan_fn, 'bar')
+    assert obj.__name__ == 'Bar' and sorted(names) == ['bar', 'foo']
+    assert 'registry_pkg_a.first' not in sys.modules.keys()
+    assert resolve_registered(base, 'thing', scan_fn, 'missing')[0] is None
+    assert len(calls) == 1
+
+
+def test_source_changes_trigger_rescan(tmp_path, monkeypatch):
+    base, scan_fn, calls = make_package(tmp_path, monkeypatch, 'registry_pkg_b')
+    load_registry(base, 'thing', scan_fn)
+    (tmp_path / 'registry_pkg_b' / 'third.py').write_text('class Baz:\n    pass\n')
+    obj, _ = resolve_registered(base, 'thing', scan_fn, 'baz')
+    assert obj.__name__ == 'Baz' and len(calls) == 2
+
+
+def test_stale_entry_triggers_rescan(tmp_path, monkeypatch):
+    base, scan_fn, calls = make_package(tmp_path, monkeypatch, 'registry_pkg_c')
+    load_registry(base, 'thing', scan_fn)
+    path = registry_manifest_path(base, 'thing')
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['entries']['foo'] = ['registry_pkg_c.moved_away', 'Foo']
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    monkeypatch.setattr(registry_cache, '_loaded', {})
+    obj, _ = resolve_registered(base, 'thing', scan_fn, 'foo')
+    assert obj.__name__ == 'Foo' and len(calls) == 2
@@ -0,0 +1,30 @@
+import os
+
+import torch
+
+from data.audio.similarity_index import SimilarityIndex, build_similarity_index
+
+
+def test_round_trip(tmp_path):
+    for speaker, sims in [('a', {'1.wav': ['2.wav', '3.wav'], '2.wav': ['1.wav']}), ('b', {'x.wav': ['../a/1.wav']})]:
+        os.makedirs(tmp_path / speaker)
+        torch.save(sims, tmp_path / speaker / 'similarities.pth')
+    prefix = str(tmp_path / 'index')
+    # 3.wav is only ever a neighbor but still gets an id.
+    assert build_similarity_index([str(tmp_path / 'a'), str(tmp_path / 'b')], prefix) == 4
+
+    index = SimilarityIndex(prefix)
+    a = tmp_path / 'a'
+    assert index.similar_paths(str(a / '1.wav')) == [os.path.abspath(a / '2.wav'), os.path.abspath(a / '3.wav')]
+    assert index.similar_paths(str(a / '2.wav')) == [os.path.abspath(a / '1.wav')]
+    assert index.similar_paths(str(a / '3.wav')) == []
+    assert index.similar_paths(str(tmp_path / 'b' / '..' / 'b' / 'x.wav')) == [os.path.abspath(a / '1.wav')]
+    assert index.similar_paths(str(tmp_path / 'missing.wav')) == []
+    assert index.id_of(str(tmp_path / 'zzz.wav')) is None
+
+
+def test_empty_index(tmp_path):
+    prefix = str(tmp_path / 'index')
+    assert build_similarity_index(str(tmp_path), prefix) == 0
+    index = SimilarityIndex(prefix)
+    assert len(index) == 0 and index.similar_paths(str(tmp_path / 'a.wav')) == []
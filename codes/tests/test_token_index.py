@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+from data.audio.paired_voice_audio_dataset import CompactManifest
+from data.audio.token_index import build_token_index, load_token_index
+from data.audio.voice_tokenizer import VoiceBpeTokenizer
+
+VOCAB = os.path.join(os.path.dirname(__file__), '..', '..', 'experiments', 'bpe_lowercase_asr_256.json')
+TEXTS = ['Hello there.', 'It is 5 o\'clock [sharp].', None, 'The quick brown fox — jumped.']
+
+
+class CharTokenizer:
+    def encode(self, txt):
+        if txt == 'unspeakable':
+            raise ValueError
+        return [ord(c) for c in txt]
+
+
+def make_manifest(tmp_path, name='manifest.tsv', texts=TEXTS):
+    manifest = tmp_path / name
+    manifest.write_text('unused', encoding='utf-8')
+    return str(manifest), [[f'{i}.wav', t, 0] for i, t in enumerate(texts)]
+
+
+def test_encode_batch_matches_encode():
+    tokenizer = VoiceBpeTokenizer(VOCAB)
+    texts = [t for t in TEXTS if t is not None]
+    assert tokenizer.encode_batch(texts) == [tokenizer.encode(t) for t in texts]
+
+
+def test_round_trip(tmp_path):
+    tokenizer = VoiceBpeTokenizer(VOCAB)
+    manifest, rows = make_manifest(tmp_path)
+    assert build_token_index(manifest, rows, tokenizer, batch_size=2) == 1
+    tokens, offsets, valid = load_token_index(manifest, len(rows), tokenizer)
+    assert valid.tolist() == [True, True, False, True]
+    for i, t in enumerate(TEXTS):
+        if t is not None:
+            assert tokens[offsets[i]:offsets[i+1]].tolist() == tokenizer.encode(t)
+    with pytest.raises(ValueError):
+        load_token_index(manifest, len(rows) + 1, tokenizer)
+
+
+def test_rejects_other_tokenizer(tmp_path):
+    manifest, rows = make_manifest(tmp_path, texts=['abc'])
+    build_token_index(manifest, rows, CharTokenizer())
+    assert load_token_index(manifest, 1, CharTokenizer())[0].tolist() == [97, 98, 99]
+    with pytest.raises(ValueError):
+        load_token_index(manifest, 1, VoiceBpeTokenizer(VOCAB))
+
+
+def test_compact_manifest_tokens(tmp_path):
+    manifest = CompactManifest(has_codes=False, has_tokens=True)
+    # Two manifests, so token offsets have to be rebased when they are merged.
+    for name, texts in [('a.tsv', ['abc', 'unspeakable']), ('b.tsv', ['de', 'unspeakable', 'f'])]:
+        path, rows = make_manifest(tmp_path, name, texts)
+        build_token_index(path, rows, CharTokenizer())
+        manifest.extend(rows, load_token_index(path, len(rows), CharTokenizer()))
+    manifest.finalize(seed=0)
+    for i in range(len(manifest)):
+        text = manifest[i][1]
+        if text == 'unspeakable':
+            assert manifest.tokens(i) is None
+        else:
+            assert manifest.tokens(i).tolist() == [ord(c) for c in text]
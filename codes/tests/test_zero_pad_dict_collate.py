@@ -0,0 +1,35 @@
+import torch
+
+from data.zero_pad_dict_collate import ZeroPadDictCollate
+
+
+def make_batch():
+    return [{'clip': torch.ones(1, 5), 'scalar': torch.tensor(1.), 'index': 0, 'path': 'a.wav'},
+            {'clip': torch.ones(1, 3) * 2, 'scalar': torch.tensor(2.), 'index': 1, 'path': 'b.wav'}]
+
+
+def test_pads_to_longest():
+    collated = ZeroPadDictCollate()(make_batch())
+    assert collated['clip'].shape == (2, 1, 5)
+    assert torch.equal(collated['clip'][1, 0], torch.tensor([2., 2., 2., 0., 0.]))
+    assert torch.equal(collated['scalar'], torch.tensor([1., 2.]))
+
+
+def test_defaults_match_original_behavior():
+    collated = ZeroPadDictCollate()(make_batch())
+    assert 'clip_lengths' not in collated.keys()
+    assert collated['index'] == [0, 1]
+    assert collated['path'] == ['a.wav', 'b.wav']
+
+
+def test_emit_lengths_and_tensorize_numbers():
+    batch = make_batch()
+    collated = ZeroPadDictCollate(emit_lengths=True, tensorize_numbers=True)(batch)
+    assert torch.equal(collated['clip_lengths'], torch.tensor([5, 3]))
+    assert torch.equal(collated['index'], torch.tensor([0, 1]))
+    assert collated['path'] == ['a.wav', 'b.wav']
+    # Lengths provided by the dataset are not overwritten.
+    for b in batch:
+        b['clip_lengths'] = torch.tensor(4)
+    collated = ZeroPadDictCollate(emit_lengths=True)(batch)
+    assert torch.equal(collated['clip_lengths'], torch.tensor([4, 4]))
@@ -9,7 +9,7 @@ import shutil
 from tqdm import tqdm
 
 import torch
-from data.data_sampler import DistIterSampler
+from data.data_sampler import DistIterSampler, BucketBatchSampler, budget_batch_sizes
 from trainer.eval.evaluator import create_evaluator
 
 from utils import util, options as option
@@ -43,6 +43,7 @@ class Trainer:
         self.val_compute_fea = opt_get(opt, ['eval', 'compute_fea'], False)
         self.current_step = 0
         self.total_training_data_encountered = 0
+        self.dynamic_batching = False
 
         #### loading resume state if exists
         if opt['path'].get('resume_state', None):
@@ -119,14 +120,40 @@ class Trainer:
                 train_size = int(math.ceil(len(self.train_set) / dataset_opt['batch_size']))
                 total_iters = int(opt['train']['niter'])
                 self.total_epochs = int(math.ceil(total_iters / train_size))
-                if opt['dist']:
+                batch_sampler = None
+                self.dynamic_batching = getattr(self.train_set, 'max_batch_samples', None) is not None
+                if getattr(self.train_set, 'buckets', None) is not None:
+                    # Length-bucketed batches. The sampler seed must agree across ranks, so it does not use the
+                    # rank-offset seed above.
+                    num_replicas = self.world_size if opt['dist'] else 1
+                    bucket_batch_sizes = None
+                    if self.dynamic_batching:
+                        bucket_batch_sizes = budget_batch_sizes(self.train_set.bucket_wav_len, self.train_set.max_batch_samples,
+                                                                num_replicas * opt_get(opt, ['train', 'mega_batch_factor'], 1))
+                        if self.rank <= 0:
+                            self.logger.info('Dynamic batch sizes per bucket: {}'.format(
+                                dict(zip(self.train_set.bucket_wav_len, bucket_batch_sizes))))
+                    self.train_sampler = BucketBatchSampler(self.train_set.buckets, dataset_opt['batch_size'],
+                                                            num_replicas, self.rank,
+                                                            seed=opt_get(opt, ['train', 'manual_seed'], 0),
+                                                            batch_sizes=bucket_batch_sizes)
+                    batch_sampler = self.train_sampler
+                    train_size = len(self.train_sampler)
+                    self.total_epochs = int(math.ceil(total_iters / train_size))
+                    shuffle = False
+                elif isinstance(self.train_set, torch.utils.data.IterableDataset):
+                    # Streaming datasets split themselves across ranks and are shuffled through set_epoch().
+                    self.train_sampler = None
+                    shuffle = False
+                elif opt['dist']:
                     self.train_sampler = DistIterSampler(self.train_set, self.world_size, self.rank, dataset_ratio)
                     self.total_epochs = int(math.ceil(total_iters / (train_size * dataset_ratio)))
                     shuffle = False
                 else:
                     self.train_sampler = None
                     shuffle = True
-                self.train_loader = create_dataloader(self.train_set, dataset_opt, opt, self.train_sampler, collate_fn=collate_fn, shuffle=shuffle)
+                self.train_loader = create_dataloader(self.train_set, dataset_opt, opt, self.train_sampler, collate_fn=collate_fn,
+                                                      shuffle=shuffle, batch_sampler=batch_sampler)
                 if self.rank <= 0:
                     self.logger.info('Number of training data elements: {:,d}, iters: {:,d}'.format(
                         len(self.train_set), train_size))
@@ -197,11 +224,17 @@ class Trainer:
         opt = self.opt
         batch_size = self.opt['datasets']['train']['batch_size']  # It may seem weird to derive this from opt, rather than train_data. The reason this is done is
                                                                   # because train_data is process-local while the opt variant represents all of the data fed across all GPUs.
+        if self.dynamic_batching:
+            # Batch sizes vary per step, but the sampler hands every rank an equal slice of the same global batch.
+            local_batch_size = next(v for v in train_data.values() if isinstance(v, torch.Tensor)).shape[0]
+            batch_size = local_batch_size * (self.world_size if opt['dist'] else 1)
         self.current_step += 1
         self.total_training_data_encountered += batch_size
         will_log = self.current_step % opt['logger']['print_freq'] == 0
 
         #### update learning rate
+        # Schedulers match milestones and restarts exactly, so they are always stepped by optimizer steps (including
+        # with dynamic batching, where the data seen per step varies).
         self.model.update_learning_rate(self.current_step, warmup_iter=opt['train']['warmup_iter'])
 
         #### training
@@ -209,7 +242,10 @@ class Trainer:
             print("Update LR: %f" % (time() - _t))
         _t = time()
         self.model.feed_data(train_data, self.current_step)
-        gradient_norms_dict = self.model.optimize_parameters(self.current_step, return_grad_norms=will_log)
+        # Gradient norms can be sampled on only every Nth logging step, since computing them slows the step down.
+        grad_norm_sample_rate = opt_get(opt, ['logger', 'grad_norm_sample_rate'], 1)
+        log_grad_norms = will_log and (self.current_step // opt['logger']['print_freq']) % grad_norm_sample_rate == 0
+        gradient_norms_dict = self.model.optimize_parameters(self.current_step, return_grad_norms=log_grad_norms)
         iteration_rate = (time() - _t) / batch_size
         if self._profile:
             print("Model feed + step: %f" % (time() - _t))
@@ -277,7 +313,9 @@ class Trainer:
                         f"Leaving only {opt['upgrades']['number_of_checkpoints_to_save']} checkpoints and "
                         f"{number_of_states_to_save} states"
                     )
-                    self.model.limit_number_of_checkpoints_and_states(
+                    # Queued behind any checkpoint writes still in flight when async_checkpointing is enabled.
+                    self.model.checkpoint_io(
+                        self.model.limit_number_of_checkpoints_and_states,
                         next(iter(opt['networks'].keys())),
                         models_number=opt['upgrades']['number_of_checkpoints_to_save'],
                         state_number=opt['upgrades']['number_of_states_to_save'],
@@ -292,11 +330,7 @@ class Trainer:
                 else:
                     self.logger.info("State saving is disabled. Skipping state save, you won't be able to resume training from this session.")
             if 'alt_path' in opt['path'].keys():
-                import shutil
-                print("Synchronizing tb_logger to alt_path..")
-                alt_tblogger = os.path.join(opt['path']['alt_path'], "tb_logger")
-                shutil.rmtree(alt_tblogger, ignore_errors=True)
-                shutil.copytree(self.tb_logger_path, alt_tblogger)
+                self.model.checkpoint_io(self.sync_tb_logger_to_alt_path)
 
         do_eval = self.total_training_data_encountered > self.next_eval_step
         if do_eval:
@@ -340,25 +374,37 @@ class Trainer:
         for net in self.model.networks.values():
             net.zero_grad()
 
+    def sync_tb_logger_to_alt_path(self):
+        import shutil
+        print("Synchronizing tb_logger to alt_path..")
+        alt_tblogger = os.path.join(self.opt['path']['alt_path'], "tb_logger")
+        shutil.rmtree(alt_tblogger, ignore_errors=True)
+        shutil.copytree(self.tb_logger_path, alt_tblogger)
+
     def do_training(self):
         self.logger.info('Start training from epoch: {:d}, iter: {:d}'.format(self.start_epoch, self.current_step))
         for epoch in range(self.start_epoch, self.total_epochs + 1):
             self.epoch = epoch
-            if self.opt['dist']:
+            if self.train_sampler is not None:
                 self.train_sampler.set_epoch(epoch)
+            elif hasattr(self.train_set, 'set_epoch'):
+                self.train_set.set_epoch(epoch)
 
             tq_ldr = tqdm(self.train_loader) if self.rank <= 0 else self.train_loader
 
             _t = time()
             for train_data in tq_ldr:
                 self.do_step(train_data)
+        self.model.flush_checkpoints()
 
     def create_training_generator(self, index):
         self.logger.info('Start training from epoch: {:d}, iter: {:d}'.format(self.start_epoch, self.current_step))
         for epoch in range(self.start_epoch, self.total_epochs + 1):
             self.epoch = epoch
-            if self.opt['dist']:
+            if self.train_sampler is not None:
                 self.train_sampler.set_epoch(epoch)
+            elif hasattr(self.train_set, 'set_epoch'):
+                self.train_set.set_epoch(epoch)
             tq_ldr = tqdm(self.train_loader, position=index)
 
             _t = time()
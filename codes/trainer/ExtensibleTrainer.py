@@ -6,7 +6,6 @@ from time import time
 from pathlib import Path
 
 import torch
-from torch import distributed
 from torch.nn.parallel import DataParallel
 import torch.nn as nn
 
@@ -14,6 +13,7 @@ import trainer.lr_scheduler as lr_scheduler
 import trainer.networks as networks
 from trainer.base_model import BaseModel
 from trainer.batch_size_optimizer import create_batch_size_optimizer
+from trainer.ema import FusedEma, BackgroundCpuEma, infrequent_ema_rate
 from trainer.inject import create_injector
 from trainer.injectors.audio_injectors import normalize_mel
 from trainer.steps import ConfigurableStep
@@ -21,7 +21,7 @@ from trainer.experiments.experiments import get_experiment_for_name
 import torchvision.utils as utils
 
 from utils.loss_accumulator import LossAccumulator, InfStorageLossAccumulator
-from utils.util import opt_get, denormalize
+from utils.util import opt_get, denormalize, group_grad_norms, reduce_log_metrics
 
 from typing import Literal, Union
 import maybe_bnb as mbnb
@@ -64,6 +64,8 @@ class ExtensibleTrainer(BaseModel):
             # It does come at the cost of a round trip to CPU memory at every batch.
             self.do_emas = opt_get(train_opt, ['ema_enabled'], True)
             self.ema_on_cpu = opt_get(train_opt, ['ema_on_cpu'], False)
+            # CPU EMAs are updated in the background, but only every this many steps.
+            self.ema_on_cpu_every = opt_get(train_opt, ['ema_on_cpu_every'], 10)
         self.checkpointing_cache = opt['checkpointing_enabled']
         self.auto_recover = opt_get(opt, ['automatically_recover_nan_by_reverting_n_saves'], None)
         self.batch_size_optimizer = create_batch_size_optimizer(train_opt)
@@ -167,6 +169,8 @@ class ExtensibleTrainer(BaseModel):
         # Backpush the wrapped networks into the network dicts. Also build the EMA parameters.
         self.networks = {}
         self.emas = {}
+        self.ema_updaters = {}  # Built on first use, since load() may replace the EMA networks.
+        self.reduced_log_keys = None  # The metrics get_current_log() averages across ranks; agreed on first use.
         found = 0
         for dnet in dnets:
             for net_dict in [self.netsD, self.netsG]:
@@ -353,25 +357,14 @@ class ExtensibleTrainer(BaseModel):
                                     p.grad = p.grad * asb / sqrt(fan_in)
 
                 if return_grad_norms and train_step:
+                    pgroups = {}
                     for name in nets_to_train:
                         model = self.networks[name]
                         if hasattr(model.module, 'get_grad_norm_parameter_groups'):
-                            pgroups = {f'{name}_{k}': v for k, v in model.module.get_grad_norm_parameter_groups().items()}
+                            pgroups.update({f'{name}_{k}': v for k, v in model.module.get_grad_norm_parameter_groups().items()})
                         else:
-                            pgroups = {f'{name}_all_parameters': list(model.parameters())}
-                    for name in pgroups.keys():
-                        stacked_grads = []
-                        for p in pgroups[name]:
-                            if hasattr(p, 'grad') and p.grad is not None:
-                                stacked_grads.append(torch.norm(p.grad.detach(), 2))
-                        if not stacked_grads:
-                            continue
-                        grad_norms[name] = torch.norm(torch.stack(stacked_grads), 2)
-                        if distributed.is_available() and distributed.is_initialized():
-                            # Gather the metric from all devices if in a distributed setting.
-                            distributed.all_reduce(grad_norms[name], op=distributed.ReduceOp.SUM)
-                            grad_norms[name] /= distributed.get_world_size()
-                        grad_norms[name] = grad_norms[name].cpu()
+                            pgroups[f'{name}_all_parameters'] = list(model.parameters())
+                    grad_norms.update(group_grad_norms(pgroups))
 
                 self.consume_gradients(state, step, it)
 
@@ -426,21 +419,16 @@ class ExtensibleTrainer(BaseModel):
             if hasattr(net.module, "after_step"):
                 net.module.after_step(it)
             if self.do_emas:
-                # When the EMA is on the CPU, only update every 10 steps to save processing time.
-                if self.ema_on_cpu and it % 10 != 0:
+                # When the EMA is on the CPU, only update every few steps to save processing time.
+                if self.ema_on_cpu and it % self.ema_on_cpu_every != 0:
                     continue
-                ema_params = self.emas[name].parameters()
-                net_params = net.parameters()
-                for ep, np in zip(ema_params, net_params):
-                    ema_rate = self.ema_rate
-                    new_rate = 1 - ema_rate
-                    if self.ema_on_cpu:
-                        np = np.cpu()
-                        ema_rate = ema_rate ** 10  # Because it only happens every 10 steps.
-                        mid = (1 - (ema_rate+new_rate))/2
-                        ema_rate += mid
-                        new_rate += mid
-                    ep.detach().mul_(ema_rate).add_(np, alpha=1 - ema_rate)
+                if name not in self.ema_updaters.keys():
+                    ema_cls = BackgroundCpuEma if self.ema_on_cpu else FusedEma
+                    self.ema_updaters[name] = ema_cls(self.emas[name], net)
+                if self.ema_on_cpu:
+                    self.ema_updaters[name].update(infrequent_ema_rate(self.ema_rate, self.ema_on_cpu_every))
+                else:
+                    self.ema_updaters[name].update(self.ema_rate)
         [e.after_optimize(state) for e in self.experiments]
 
 
@@ -501,16 +489,8 @@ class ExtensibleTrainer(BaseModel):
         # The batch size optimizer also outputs loggable data.
         log.update(self.batch_size_optimizer.get_statistics())
 
-        # In distributed mode, get agreement on all single tensors.
-        if distributed.is_available() and distributed.is_initialized():
-            for k, v in log.items():
-                if not isinstance(v, torch.Tensor):
-                    continue
-                if len(v.shape) != 1 or v.dtype != torch.float:
-                    continue
-                distributed.all_reduce(v, op=distributed.ReduceOp.SUM)
-                log[k] = v / distributed.get_world_size()
-
+        # Metrics are accumulated on the device; average them across ranks and move them to the host in one go.
+        self.reduced_log_keys = reduce_log_metrics(log, self.device, self.reduced_log_keys)
         return log
 
     def get_current_visuals(self, need_GT=True):
@@ -539,6 +519,9 @@ class ExtensibleTrainer(BaseModel):
                 self.load_network(load_path, net, self.opt['path']['strict_load'], opt_get(self.opt, ['path', f'pretrain_base_path_{name}']))
                 load_path_ema = load_path.replace('.pth', '_ema.pth')
                 if self.is_train and self.do_emas:
+                    # The EMA network may be replaced below, so its updater is rebuilt on the next step.
+                    self.wait_for_emas()
+                    self.ema_updaters.pop(name, None)
                     ema_model = self.emas[name]
                     if os.path.exists(load_path_ema):
                         self.load_network(load_path_ema, ema_model, self.opt['path']['strict_load'], opt_get(self.opt, ['path', f'pretrain_base_path_{name}']))
@@ -583,7 +566,12 @@ class ExtensibleTrainer(BaseModel):
                 open(file_path, 'w').close()
                 os.remove(file_path)
 
+    def wait_for_emas(self):
+        for updater in self.ema_updaters.values():
+            updater.wait()
+
     def save(self, iter_step):
+        self.wait_for_emas()
         for name, net in self.networks.items():
             # Don't save non-trainable networks.
             if self.opt['networks'][name]['trainable']:
@@ -1,11 +1,12 @@
 import os
-from collections import OrderedDict
 import torch
 import torch.nn as nn
 from torch.distributed.optim import ZeroRedundancyOptimizer
 from torch.nn.parallel.distributed import DistributedDataParallel
 
 import utils.util
+from utils.checkpoint_writer import AsyncCheckpointWriter, atomic_save
+from utils.mmap_checkpoint import load_checkpoint, save_mmap_checkpoint
 from utils.util import opt_get, optimizer_to, map_to_device
 
 
@@ -24,6 +25,24 @@ class BaseModel():
         self.optimizers = []
         self.disc_optimizers = []
         self.save_history = {}
+        # When enabled, checkpoints are snapshotted to CPU memory on the training thread and written (and copied,
+        # uploaded and pruned) by a background thread.
+        self.checkpoint_writer = None
+        if opt_get(opt, ['logger', 'async_checkpointing'], False):
+            self.checkpoint_writer = AsyncCheckpointWriter(opt_get(opt, ['logger', 'async_checkpoint_queue_depth'], 2))
+
+    def checkpoint_io(self, fn, *args, **kwargs):
+        """
+        Runs checkpoint IO, in the background if async_checkpointing is enabled. Jobs always run in submission order.
+        """
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.submit(fn, *args, **kwargs)
+        else:
+            fn(*args, **kwargs)
+
+    def flush_checkpoints(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.flush()
 
     def feed_data(self, data):
         pass
@@ -90,45 +109,40 @@ class BaseModel():
         if isinstance(network, nn.DataParallel) or isinstance(network, DistributedDataParallel):
             network = network.module
         state_dict = network.state_dict()
-        for key, param in state_dict.items():
-            state_dict[key] = param.cpu()
-        torch.save(state_dict, save_path)
+        if self.checkpoint_writer is not None:
+            state_dict, lease = self.checkpoint_writer.snapshot(state_dict)
+        else:
+            for key, param in state_dict.items():
+                state_dict[key] = param.cpu()
         if network_label not in self.save_history.keys():
             self.save_history[network_label] = []
         self.save_history[network_label].append(save_path)
+        # Networks can be saved in the memory-mapped format of utils.mmap_checkpoint, which resumes much faster but
+        # can only be read back with utils.mmap_checkpoint.load_checkpoint() rather than torch.load().
+        self.checkpoint_io(self.write_checkpoint, state_dict, save_path, save_filename, 'models',
+                           mmap_format=opt_get(self.opt, ['logger', 'mmap_checkpoints'], False))
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.release(lease)
+        return save_path
 
+    def write_checkpoint(self, state, save_path, save_filename, remote_dir, alt_filename=None, mmap_format=False):
+        save_fn = save_mmap_checkpoint if mmap_format else atomic_save
+        save_fn(state, save_path)
         # Also save to the 'alt_path' which is useful for caching to Google Drive in colab, for example.
         if 'alt_path' in self.opt['path'].keys():
-            torch.save(state_dict, os.path.join(self.opt['path']['alt_path'], save_filename))
+            save_fn(state, os.path.join(self.opt['path']['alt_path'], alt_filename or save_filename))
         if self.opt['colab_mode']:
             utils.util.copy_files_to_server(self.opt['ssh_server'], self.opt['ssh_username'], self.opt['ssh_password'],
-                                            save_path, os.path.join(self.opt['remote_path'], 'models', save_filename))
-        return save_path
+                                            save_path, os.path.join(self.opt['remote_path'], remote_dir, save_filename))
 
     def load_network(self, load_path, network, strict=True, pretrain_base_path=None):
         # Sometimes networks are passed in as DDP modules, we want the raw parameters.
         if hasattr(network, 'module'):
             network = network.module
-        load_net = torch.load(load_path, map_location=utils.util.map_cuda_to_correct_device)
-
-        # Support loading torch.save()s for whole models as well as just state_dicts.
-        if 'state_dict' in load_net:
-            load_net = load_net['state_dict']
-        load_net_clean = OrderedDict()  # remove unnecessary 'module.'
-
-        if pretrain_base_path is not None:
-            t = load_net
-            load_net = {}
-            for k, v in t.items():
-                if k.startswith(pretrain_base_path):
-                    load_net[k[len(pretrain_base_path):]] = v
-
-        for k, v in load_net.items():
-            if k.startswith('module.'):
-                load_net_clean[k.replace('module.', '')] = v
-            else:
-                load_net_clean[k] = v
-        network.load_state_dict(load_net_clean, strict=strict)
+        # Memory-mapped where possible, so the weights are copied straight from the file into the parameters. Keys
+        # outside of pretrain_base_path are dropped (and not read) and 'module.' prefixes are removed.
+        load_net = load_checkpoint(load_path, pretrain_base_path, map_location=utils.util.map_cuda_to_correct_device)
+        network.load_state_dict(load_net, strict=strict)
 
 
     def consolidate_state(self):
@@ -148,17 +162,16 @@ class BaseModel():
             state['amp'] = amp.state_dict()
         save_filename = '{}.state'.format(utils.util.opt_get(state, ['iter'], 'no_step_provided'))
         save_path = os.path.join(self.opt['path']['training_state'], save_filename)
-        torch.save(map_to_device(state, 'cpu'), save_path)
+        if self.checkpoint_writer is not None:
+            state, lease = self.checkpoint_writer.snapshot(state)
+        else:
+            state = map_to_device(state, 'cpu')
         if '__state__' not in self.save_history.keys():
             self.save_history['__state__'] = []
         self.save_history['__state__'].append(save_path)
-
-        # Also save to the 'alt_path' which is useful for caching to Google Drive in colab, for example.
-        if 'alt_path' in self.opt['path'].keys():
-            torch.save(state, os.path.join(self.opt['path']['alt_path'], 'latest.state'))
-        if self.opt['colab_mode']:
-            utils.util.copy_files_to_server(self.opt['ssh_server'], self.opt['ssh_username'], self.opt['ssh_password'],
-                                            save_path, os.path.join(self.opt['remote_path'], 'training_state', save_filename))
+        self.checkpoint_io(self.write_checkpoint, state, save_path, save_filename, 'training_state', 'latest.state')
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.release(lease)
 
     def stash_optimizers(self):
         """
@@ -0,0 +1,116 @@
+import queue
+import sys
+import threading
+
+import torch
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
+
+
+def infrequent_ema_rate(ema_rate, every):
+    """
+    The decay to use when an EMA with decay [ema_rate] is only updated every [every] steps.
+    """
+    new_rate = 1 - ema_rate
+    decayed = ema_rate ** every
+    mid = (1 - (decayed + new_rate)) / 2
+    return decayed + mid
+
+
+def _group_by_type(ema_params, params, detach=True):
+    # foreach kernels only take their fast path on lists sharing a device and dtype. Detached aliases share storage
+    # with the parameters, so in-place ops on them update the parameters; rebinding their .data does not.
+    groups = {}
+    for ep, p in zip(ema_params, params):
+        key = (ep.device, ep.dtype, p.device, p.dtype)
+        if key not in groups.keys():
+            groups[key] = ([], [])
+        groups[key][0].append(ep.detach() if detach else ep)
+        groups[key][1].append(p.detach())
+    return list(groups.values())
+
+
+class FusedEma:
+    """
+    Updates the parameters of [ema] towards those of [model] with multi-tensor (foreach) kernels: a couple of kernel
+    launches per dtype rather than two python-dispatched ops per parameter.
+    """
+    def __init__(self, ema, model):
+        self.groups = _group_by_type(ema.parameters(), model.parameters())
+
+    def update(self, ema_rate):
+        for ema_params, params in self.groups:
+            torch._foreach_mul_(ema_params, ema_rate)
+            torch._foreach_add_(ema_params, params, alpha=1 - ema_rate)
+
+    def wait(self):
+        pass
+
+
+class BackgroundCpuEma:
+    """
+    An EMA kept in CPU memory and updated on a background thread.
+
+    The EMA's parameters are re-pointed into one flat buffer per dtype. On update(), the model parameters are
+    flattened in buckets of at most [bucket_numel] elements on their device and copied asynchronously into a pinned
+    staging buffer of the same layout. The worker thread waits for the copy, then applies the update to each flat
+    buffer with a single mul_/add_. Training only blocks when an update is requested while the previous one is still
+    running.
+
+    Call wait() before reading the EMA weights. An error in the worker thread is raised from the next wait() or update().
+    """
+    def __init__(self, ema, model, bucket_numel=2**25):
+        self.groups = []
+        pin = torch.cuda.is_available()
+        for ema_params, params in _group_by_type(ema.parameters(), model.parameters(), detach=False):
+            flat = _flatten_dense_tensors([ep.data for ep in ema_params])
+            # The EMA's own parameters are re-pointed, so that the module reads the buffer the worker updates.
+            for ep, view in zip(ema_params, _unflatten_dense_tensors(flat, ema_params)):
+                ep.data = view
+            staging = torch.empty(flat.shape, dtype=params[0].dtype, pin_memory=pin and params[0].is_cuda)
+            buckets, bucket, offset, numel = [], [], 0, 0
+            for p in params:
+                if bucket and numel + p.numel() > bucket_numel:
+                    buckets.append((offset, numel, bucket))
+                    offset, bucket, numel = offset + numel, [], 0
+                bucket.append(p)
+                numel += p.numel()
+            if bucket:
+                buckets.append((offset, numel, bucket))
+            self.groups.append((flat, staging, buckets))
+        self.queue = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='cpu_ema', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            event, ema_rate = self.queue.get()
+            try:
+                if event is not None:
+                    event.synchronize()
+                for flat, staging, _ in self.groups:
+                    flat.mul_(ema_rate).add_(staging.to(flat.dtype), alpha=1 - ema_rate)
+            except Exception as e:
+                print(f'Error updating CPU EMA: {sys.exc_info()}')
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def update(self, ema_rate):
+        self.wait()  # The staging buffers are still in use until the previous update completes.
+        event = None
+        for flat, staging, buckets in self.groups:
+            for offset, numel, bucket in buckets:
+                staging[offset:offset+numel].copy_(_flatten_dense_tensors(bucket), non_blocking=True)
+                if bucket[0].is_cuda and event is None:
+                    event = torch.cuda.Event()
+        if event is not None:
+            event.record()  # Marks the completion of all of the copies above.
+        self.queue.put((event, ema_rate))
+
+    def wait(self):
+        self.queue.join()
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('A background CPU EMA update failed.') from error
@@ -21,6 +21,7 @@ from models.audio.tts.tacotron2 import text_to_sequence
 from scripts.audio.gen.speech_synthesis_utils import load_discrete_vocoder_diffuser, wav_to_mel, load_speech_dvae, \
     convert_mel_to_codes, load_univnet_vocoder, wav_to_univnet_mel, load_clvp
 from trainer.injectors.audio_injectors import denormalize_mel, TorchMelSpectrogramInjector, normalize_mel
+from utils.audio_resampler import resample
 from utils.util import ceil_multiple, opt_get, load_model_from_config, pad_or_truncate
 
 
@@ -102,7 +103,7 @@ class AudioDiffusionFid(evaluator.Evaluator):
             self.local_modules['vocoder'] = load_univnet_vocoder().cpu()
 
     def perform_diffusion_tts(self, audio, codes, text, sample_rate=5500):
-        real_resampled = torchaudio.functional.resample(audio, 22050, sample_rate).unsqueeze(0)
+        real_resampled = resample(audio, 22050, sample_rate).unsqueeze(0)
         aligned_codes_compression_factor = sample_rate * 221 // 11025
         output_size = codes.shape[-1]*aligned_codes_compression_factor
         padded_size = ceil_multiple(output_size, 2048)
@@ -121,7 +122,7 @@ class AudioDiffusionFid(evaluator.Evaluator):
         mel_codes = convert_mel_to_codes(self.local_modules['dvae'], mel)
         back_to_mel = self.local_modules['dvae'].decode(mel_codes)[0]
         orig_audio = audio
-        real_resampled = torchaudio.functional.resample(audio, 22050, sample_rate).unsqueeze(0)
+        real_resampled = resample(audio, 22050, sample_rate).unsqueeze(0)
 
         output_size = real_resampled.shape[-1]
         aligned_mel_compression_factor = output_size // back_to_mel.shape[-1]
@@ -136,8 +137,8 @@ class AudioDiffusionFid(evaluator.Evaluator):
                                                   'conditioning_input': orig_audio.unsqueeze(0)})
 
         # Pop it back down to 5.5kHz for an accurate comparison with the other diffusers.
-        real_resampled = torchaudio.functional.resample(real_resampled.squeeze(0), sample_rate, 5500).unsqueeze(0)
-        gen = torchaudio.functional.resample(gen.squeeze(0), sample_rate, 5500).unsqueeze(0)
+        real_resampled = resample(real_resampled.squeeze(0), sample_rate, 5500).unsqueeze(0)
+        gen = resample(gen.squeeze(0), sample_rate, 5500).unsqueeze(0)
         return gen, real_resampled, 5500
 
 
@@ -145,7 +146,7 @@ class AudioDiffusionFid(evaluator.Evaluator):
         mel = wav_to_mel(audio)
         mel_codes = convert_mel_to_codes(self.local_modules['dvae'], mel)
         text_codes = text_to_sequence(text)
-        real_resampled = torchaudio.functional.resample(audio, 22050, sample_rate).unsqueeze(0)
+        real_resampled = resample(audio, 22050, sample_rate).unsqueeze(0)
 
         output_size = real_resampled.shape[-1]
         aligned_codes_compression_factor = output_size // mel_codes.shape[-1]
@@ -180,7 +181,7 @@ class AudioDiffusionFid(evaluator.Evaluator):
         SAMPLE_RATE = 24000
         mel = wav_to_mel(audio)
         mel_codes = self.tts9_codegen(mel, text)
-        real_resampled = torchaudio.functional.resample(audio, 22050, SAMPLE_RATE).unsqueeze(0)
+        real_resampled = resample(audio, 22050, SAMPLE_RATE).unsqueeze(0)
         univnet_mel = wav_to_univnet_mel(real_resampled, do_normalization=False)  # to be used for a conditioning input, but also guides output shape.
         output_shape = univnet_mel.shape
         gen_mel = self.diffuser.p_sample_loop(self.model, output_shape,
@@ -198,7 +199,7 @@ class AudioDiffusionFid(evaluator.Evaluator):
         text_codes = torch.LongTensor(self.bpe_tokenizer.encode(text)).unsqueeze(0).to(audio.device)
         clvp_latent = self.local_modules['clvp'].embed_text(text_codes)
 
-        real_resampled = torchaudio.functional.resample(audio, 22050, SAMPLE_RATE).unsqueeze(0)
+        real_resampled = resample(audio, 22050, SAMPLE_RATE).unsqueeze(0)
         univnet_mel = wav_to_univnet_mel(real_resampled, do_normalization=True)
         output_shape = univnet_mel.shape
         cond_mel = TorchMelSpectrogramInjector({'n_mel_channels': 100, 'mel_fmax': 11000, 'filter_length': 8000, 'normalize': True,
@@ -215,7 +216,7 @@ class AudioDiffusionFid(evaluator.Evaluator):
 
     def perform_diffusion_tfd(self, audio, codes, text):
         SAMPLE_RATE = 24000
-        audio_resampled = torchaudio.functional.resample(audio, 22050, SAMPLE_RATE).unsqueeze(0)
+        audio_resampled = resample(audio, 22050, SAMPLE_RATE).unsqueeze(0)
         vmel = wav_to_mel(audio)
         umel = wav_to_univnet_mel(audio_resampled, do_normalization=True)
         gen_mel = self.diffuser.p_sample_loop(self.model, umel.shape,
@@ -229,7 +230,7 @@ class AudioDiffusionFid(evaluator.Evaluator):
 
     def perform_diffusion_tfd_ar_prior(self, audio, codes, text):
         SAMPLE_RATE = 24000
-        audio_resampled = torchaudio.functional.resample(audio, 22050, SAMPLE_RATE).unsqueeze(0)
+        audio_resampled = resample(audio, 22050, SAMPLE_RATE).unsqueeze(0)
         vmel = wav_to_mel(audio)
         umel = wav_to_univnet_mel(audio_resampled, do_normalization=True)
 
@@ -263,7 +264,7 @@ class AudioDiffusionFid(evaluator.Evaluator):
         return model
 
     def project(self, projector, sample, sample_rate):
-        sample = torchaudio.functional.resample(sample, sample_rate, 22050)
+        sample = resample(sample, sample_rate, 22050)
         mel = wav_to_mel(sample)
         return projector.get_speech_projection(mel).squeeze(0)  # Getting rid of the batch dimension means it's just [hidden_dim]
 
@@ -277,7 +278,7 @@ class AudioDiffusionFid(evaluator.Evaluator):
         text_codes = torch.tensor(text_to_sequence(real_text), device=sample.device)
         results = []
         for s in [sample, real_sample]:
-            s = torchaudio.functional.resample(s, sample_rate, 16000)
+            s = resample(s, sample_rate, 16000)
             norm_s = (s - s.mean()) / torch.sqrt(s.var() + 1e-7)
             norm_s = norm_s.squeeze(1)
             loss = w2v(input_values=norm_s, labels=text_codes).loss
@@ -5,6 +5,8 @@ import pkgutil
 import re
 import sys
 
+from utils.registry_cache import resolve_registered
+
 
 class Evaluator:
     def __init__(self, model, opt_eval, env, uses_all_ddp=True):
@@ -51,8 +53,8 @@ class CreateEvaluatorError(Exception):
 
 
 def create_evaluator(model, opt_eval, env):
-    evaluators = find_registered_evaluators()
     type = opt_eval['type']
-    if type not in evaluators.keys():
-        raise CreateEvaluatorError(type, list(evaluators.keys()))
-    return evaluators[opt_eval['type']](model, opt_eval, env)
+    evaluator, available = resolve_registered('trainer/eval', 'evaluator', find_registered_evaluators, type)
+    if evaluator is None:
+        raise CreateEvaluatorError(type, available)
+    return evaluator(model, opt_eval, env)
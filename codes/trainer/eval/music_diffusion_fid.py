@@ -21,6 +21,7 @@ from trainer.injectors.audio_injectors import denormalize_torch_mel, TorchMelSpe
     KmeansQuantizerInjector, normalize_torch_mel
 from utils.music_utils import get_music_codegen, get_cheater_decoder, get_cheater_encoder, \
     get_mel2wav_v3_model, get_ar_prior
+from utils.audio_resampler import resample
 from utils.util import opt_get, load_model_from_config
 
 
@@ -248,7 +249,7 @@ class MusicDiffusionFid(evaluator.Evaluator):
         return gen_wav, real_wav.squeeze(0), stage2, mel_norm, sample_rate, torch.tensor([0])
 
     def project(self, sample, sample_rate):
-        sample = torchaudio.functional.resample(sample, sample_rate, 22050)
+        sample = resample(sample, sample_rate, 22050)
         mel = self.spec_fn({'in': sample})['out']
         projection = self.projector.project(mel)
         return projection.squeeze(0)  # Getting rid of the batch dimension means it's just [hidden_dim]
@@ -6,6 +6,8 @@ import sys
 
 import torch.nn
 
+from utils.registry_cache import resolve_registered
+
 
 # Base class for all other injectors.
 class Injector(torch.nn.Module):
@@ -58,8 +60,8 @@ class CreateInjectorError(Exception):
 
 # Injectors are a way to synthesize data within a step that can then be used (and reused) by loss functions.
 def create_injector(opt_inject, env):
-    injectors = find_registered_injectors()
     type = opt_inject['type']
-    if type not in injectors.keys():
-        raise CreateInjectorError(type, list(injectors.keys()))
-    return injectors[opt_inject['type']](opt_inject, env)
+    injector, available = resolve_registered('trainer/injectors', 'injector', find_registered_injectors, type)
+    if injector is None:
+        raise CreateInjectorError(type, available)
+    return injector(opt_inject, env)
@@ -0,0 +1,199 @@
+import random
+from math import pi
+
+import torch
+
+from data.audio.unsupervised_audio_dataset import load_audio
+from data.util import load_paths_from_cache, find_files_of_type, is_audio_file
+from trainer.inject import Injector
+from utils.util import opt_get
+
+
+def load_noise_bank(paths, count, max_length, sampling_rate):
+    """
+    Loads [count] random clips from [paths], each randomly cropped to at most [max_length] samples. Returns the clips
+    zero-padded into one (count, max_length) tensor, and their lengths.
+    """
+    bank = torch.zeros((count, max_length))
+    lengths = torch.zeros((count,), dtype=torch.long)
+    loaded = 0
+    attempts = 0
+    while loaded < count and attempts < count * 4:
+        attempts += 1
+        try:
+            clip = load_audio(random.choice(paths), sampling_rate)[0]
+        except:
+            continue
+        if clip.shape[-1] > max_length:
+            start = random.randint(0, clip.shape[-1] - max_length)
+            clip = clip[start:start+max_length]
+        bank[loaded, :clip.shape[-1]] = clip
+        lengths[loaded] = clip.shape[-1]
+        loaded += 1
+    assert loaded > 0, f'Unable to load any clips from {paths[:5]}..'
+    return bank[:loaded], lengths[:loaded]
+
+
+def _place(source, source_lengths, start, place, count, length):
+    """
+    Builds a (b, length) tensor where row i holds source[i, start[i]:start[i]+count[i]] beginning at position place[i]
+    and zeros elsewhere. All arguments are per-row tensors on the same device.
+    """
+    t = torch.arange(length, device=source.device).unsqueeze(0)
+    src = start.unsqueeze(1) + t - place.unsqueeze(1)
+    valid = (t >= place.unsqueeze(1)) & (t < (place + count).unsqueeze(1)) & (src < source_lengths.unsqueeze(1))
+    src = src.clamp(0, source.shape[-1]-1)
+    return torch.gather(source, 1, src) * valid
+
+
+def _smooth_envelope(place, count, length):
+    """
+    Vectorized form of _integration_fn_smooth from the noise dataset: a sinusoidal ramp up to a held peak and back
+    down, with random positions and durations, over the [count] samples starting at [place].
+    """
+    device = place.device
+    b = place.shape[0]
+    n = count.float().clamp(min=4)
+    center = 1 + torch.rand(b, device=device) * (n - 3)
+    max_duration = n - center - 1
+    duration = max_duration * (.25 + torch.rand(b, device=device) * .75)
+    end = center + duration
+    ramp_up = n * (1/16 + torch.rand(b, device=device) * (1/4 - 1/16))
+    ramp_down = n * (1/16 + torch.rand(b, device=device) * (1/4 - 1/16))
+    u = torch.arange(length, device=device).unsqueeze(0) - place.unsqueeze(1)
+    up = torch.sin(pi/2 * ((u - center.unsqueeze(1) + ramp_up.unsqueeze(1)) / ramp_up.unsqueeze(1)).clamp(0, 1))
+    down = torch.sin(pi/2 * ((end.unsqueeze(1) + ramp_down.unsqueeze(1) - u) / ramp_down.unsqueeze(1)).clamp(0, 1))
+    return up * down
+
+
+class AudioNoiseAugmentationInjector(Injector):
+    """
+    Batched version of the augmentation performed by the unsupervised_audio_with_noise dataset. Use it with a plain
+    unsupervised_audio dataset: rather than mixing noise into each clip in a dataloader worker, the whole batch is
+    augmented at once on the training device.
+
+    Every clip gets a random volume and one of the following labels:
+        0: no augmentation
+        1: environmental noise, from a bank of clips loaded from env_noise_paths
+        2: music (at half volume), from a bank of clips loaded from music_paths
+        3: a second voice, taken from another clip in the batch. It either talks over the clip or, when there is enough
+           padding room, follows it after a short silence.
+        4: reverb, by convolving with a room impulse response from openair_path
+
+    Noise banks are loaded on the first forward pass (and every bank_refresh_steps steps after that, if set).
+
+    Outputs the augmented clip to 'out', plus 'label_key', 'augvol_key', 'clipvol_key' and, when 'lengths_key' is set,
+    the new clip lengths to 'lengths_out_key'.
+    """
+    def __init__(self, opt, env):
+        super().__init__(opt, env)
+        self.lengths_key = opt_get(opt, ['lengths_key'], None)
+        self.lengths_out_key = opt_get(opt, ['lengths_out_key'], None)
+        self.label_key = opt_get(opt, ['label_key'], 'label')
+        self.augvol_key = opt_get(opt, ['augvol_key'], 'augvol')
+        self.clipvol_key = opt_get(opt, ['clipvol_key'], 'clipvol')
+        self.sampling_rate = opt_get(opt, ['sampling_rate'], 22050)
+        self.min_volume = opt_get(opt, ['min_noise_volume'], .2)
+        self.max_volume = opt_get(opt, ['max_noise_volume'], .5)
+        self.bank_size = opt_get(opt, ['bank_size'], 256)
+        self.bank_clip_length = opt_get(opt, ['bank_clip_length'], self.sampling_rate * 20)
+        self.bank_refresh_steps = opt_get(opt, ['bank_refresh_steps'], 0)
+        self.env_noise_paths = load_paths_from_cache(opt['env_noise_paths'], opt['env_noise_cache'])
+        self.music_paths = load_paths_from_cache(opt['music_paths'], opt['music_cache'])
+        self.openair_paths = find_files_of_type('img', opt['openair_path'], qualifier=is_audio_file)[0]
+        self.banks = None
+        self.banks_loaded_at = 0
+
+    def load_banks(self, device):
+        from data.audio.audio_with_noise_dataset import load_rir_convolver
+        env_noise, env_noise_lengths = load_noise_bank(self.env_noise_paths, self.bank_size, self.bank_clip_length, self.sampling_rate)
+        music, music_lengths = load_noise_bank(self.music_paths, self.bank_size, self.bank_clip_length, self.sampling_rate)
+        self.banks = {
+            1: (env_noise.to(device), env_noise_lengths.to(device)),
+            2: (music.to(device), music_lengths.to(device)),
+            'rir': load_rir_convolver(self.openair_paths, self.sampling_rate, self.sampling_rate*2).to(device),
+        }
+
+    def mix_bank(self, bank, bank_lengths, lengths, L):
+        # Pick a clip from the bank, crop it to fit the clip if it is longer, or place it randomly if it is shorter.
+        b = lengths.shape[0]
+        device = lengths.device
+        idx = torch.randint(0, bank.shape[0], (b,), device=device)
+        src_lengths = bank_lengths[idx]
+        count = torch.minimum(src_lengths, lengths)
+        start = (torch.rand(b, device=device) * (src_lengths - count + 1).float()).long()
+        place = (torch.rand(b, device=device) * (lengths - count).float()).long()
+        return _place(bank[idx], src_lengths, start, place, count, L), place, count
+
+    def reverb(self, clips, lengths):
+        convolver = self.banks['rir']
+        out = convolver(clips, torch.randint(0, len(convolver), (clips.shape[0],), device=clips.device))
+        return out * (torch.arange(clips.shape[-1], device=clips.device).unsqueeze(0) < lengths.unsqueeze(1))
+
+    def forward(self, state):
+        inp = state[self.input]
+        squeeze = len(inp.shape) == 3
+        clips = inp.squeeze(1) if squeeze else inp
+        b, L = clips.shape
+        device = clips.device
+        if self.banks is None or (self.bank_refresh_steps > 0 and self.env['step'] - self.banks_loaded_at >= self.bank_refresh_steps):
+            self.load_banks(device)
+            self.banks_loaded_at = self.env['step']
+        lengths = state[self.lengths_key].to(device).long() if self.lengths_key is not None else \
+            torch.full((b,), L, dtype=torch.long, device=device)
+
+        with torch.no_grad():
+            clipvol = torch.rand(b, device=device) * (.8-.5) + .5
+            out = clips * clipvol.unsqueeze(1)
+            label = torch.randint(0, 5, (b,), device=device)  # Currently excludes GSM corruption.
+            augvol = torch.rand(b, device=device) * (self.max_volume-self.min_volume) + self.min_volume
+            augvol = torch.where((label > 0) & (label < 4), augvol, torch.zeros_like(augvol))
+            augvol = torch.where(label == 2, augvol * .5, augvol)  # Music is often severely in the background.
+            new_lengths = lengths.clone()
+
+            for l in [1, 2]:
+                sel = torch.nonzero(label == l).squeeze(1)
+                if sel.shape[0] == 0:
+                    continue
+                aug, _, _ = self.mix_bank(*self.banks[l], lengths[sel], L)
+                out[sel] = out[sel] + aug * augvol[sel].unsqueeze(1)
+
+            sel = torch.nonzero(label == 3).squeeze(1)
+            if sel.shape[0] > 0:
+                # The other voice comes from the next clip in the batch.
+                other = (sel + 1) % b
+                src, src_lengths = clips[other], lengths[other]
+                padding_room = L - lengths[sel]
+                separate = (padding_room >= 22000) & (torch.rand(sel.shape[0], device=device) < .5)
+                # (1) The voices talk over one another, using either a smooth or a flat envelope.
+                count = torch.minimum(src_lengths, lengths[sel])
+                start = (torch.rand(sel.shape[0], device=device) * (src_lengths - count + 1).float()).long()
+                place = (torch.rand(sel.shape[0], device=device) * (lengths[sel] - count).float()).long()
+                overlap = _place(src, src_lengths, start, place, count, L)
+                smooth = torch.rand(sel.shape[0], device=device) < .5
+                envelope = torch.where(smooth.unsqueeze(1), _smooth_envelope(place, count, L), torch.ones_like(overlap))
+                overlap = overlap * envelope * augvol[sel].unsqueeze(1)
+                # (2) The second voice follows the first after 20-4000 samples of silence, fit into the padding room.
+                # Like the dataset, this form is not scaled by augvol.
+                follow_place = lengths[sel] + torch.randint(20, 4001, (sel.shape[0],), device=device)
+                follow_count = torch.minimum(src_lengths, (L - follow_place).clamp(min=0))
+                follow = _place(src, src_lengths, torch.zeros_like(follow_count), follow_place, follow_count, L)
+                out[sel] = out[sel] + torch.where(separate.unsqueeze(1), follow, overlap)
+                new_lengths[sel] = torch.where(separate, torch.minimum(follow_place + follow_count, torch.full_like(follow_place, L)),
+                                               lengths[sel])
+
+            sel = torch.nonzero(label == 4).squeeze(1)
+            if sel.shape[0] > 0:
+                # Reverb, to simulate being in a large room with an omni-mic.
+                out[sel] = self.reverb(out[sel], lengths[sel])
+
+            out = out.clamp(-1, 1)
+            out = out * (torch.arange(L, device=device).unsqueeze(0) < new_lengths.unsqueeze(1))
+
+        res = {self.output: out.unsqueeze(1) if squeeze else out,
+               self.label_key: label,
+               self.augvol_key: augvol,
+               self.clipvol_key: clipvol}
+        if self.lengths_out_key is not None:
+            res[self.lengths_out_key] = new_lengths
+        return res
@@ -6,6 +6,7 @@ import torchaudio
 
 from models.audio.music.cheater_gen_ar import ConditioningAR
 from trainer.inject import Injector
+from utils.audio_resampler import resample
 from utils.music_utils import get_music_codegen
 from utils.util import opt_get, load_model_from_config, pad_or_truncate
 
@@ -167,19 +168,34 @@ class AudioResampleInjector(Injector):
 
     def forward(self, state):
         inp = state[self.input]
-        return {self.output: torchaudio.functional.resample(inp, self.input_sr, self.output_sr)}
+        return {self.output: resample(inp, self.input_sr, self.output_sr)}
 
 
 class DiscreteTokenInjector(Injector):
+    """
+    Converts MELs into DVAE codes. When 'cached_codes_key' is specified and that key is present in the state (e.g. the
+    dataset was configured with 'dvae_code_cache'), the cached codes are passed through and the DVAE is never loaded.
+    """
     def __init__(self, opt, env):
         super().__init__(opt, env)
-        cfg = opt_get(opt, ['dvae_config'], "../experiments/train_diffusion_vocoder_22k_level.yml")
-        dvae_name = opt_get(opt, ['dvae_name'], 'dvae')
-        self.dvae = load_model_from_config(cfg, dvae_name, device=f'cuda:{env["device"]}').eval()
+        self.dvae_cfg = opt_get(opt, ['dvae_config'], "../experiments/train_diffusion_vocoder_22k_level.yml")
+        self.dvae_name = opt_get(opt, ['dvae_name'], 'dvae')
+        self.cached_codes_key = opt_get(opt, ['cached_codes_key'], None)
+        self.dvae = None
+        if self.cached_codes_key is None:
+            self.dvae = self.load_dvae()
+
+    def load_dvae(self):
+        device = f'cuda:{self.env["device"]}' if 'device' in self.env.keys() else None
+        return load_model_from_config(self.dvae_cfg, self.dvae_name, device=device).eval()
 
     def forward(self, state):
+        if self.cached_codes_key is not None and self.cached_codes_key in state.keys():
+            return {self.output: state[self.cached_codes_key]}
         inp = state[self.input]
         with torch.no_grad():
+            if self.dvae is None:
+                self.dvae = self.load_dvae()
             self.dvae = self.dvae.to(inp.device)
             codes = self.dvae.get_codebook_indices(inp)
             return {self.output: codes}
@@ -266,13 +282,13 @@ class ReverseUnivnetInjector(Injector):
                 original_audio = original_audio + torch.rand_like(original_audio) * random.random() * .005
                 decoded_mel = decoded_mel + torch.rand_like(decoded_mel) * random.random() * .005
                 if(random.random() < .5):
-                    original_audio = torchaudio.functional.resample(torchaudio.functional.resample(original_audio, 24000, 10000), 10000, 24000)
+                    original_audio = resample(resample(original_audio, 24000, 10000), 10000, 24000)
                 if(random.random() < .5):
-                    decoded_mel = torchaudio.functional.resample(torchaudio.functional.resample(decoded_mel, 24000, 10000), 10000, 24000)
+                    decoded_mel = resample(resample(decoded_mel, 24000, 10000), 10000, 24000)
                 if(random.random() < .5):
-                    original_audio = torchaudio.functional.resample(original_audio, 24000, 22000 + random.randint(0,2000))
+                    original_audio = resample(original_audio, 24000, 22000 + random.randint(0,2000), cache=False)
                 if(random.random() < .5):
-                    decoded_mel = torchaudio.functional.resample(decoded_mel, 24000, 22000 + random.randint(0,2000))
+                    decoded_mel = resample(decoded_mel, 24000, 22000 + random.randint(0,2000), cache=False)
 
                 smallest_dim = min(original_audio.shape[-1], decoded_mel.shape[-1])
                 original_audio = original_audio[:,:,:smallest_dim]
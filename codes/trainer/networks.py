@@ -7,6 +7,8 @@ import sys
 from collections import OrderedDict
 from inspect import isfunction, getmembers, signature
 
+from utils.registry_cache import resolve_registered
+
 logger = logging.getLogger('base')
 
 
@@ -65,11 +67,11 @@ def create_model(opt, opt_net, other_nets=None):
         which_model = opt_net['which_model_G']
     if not which_model:
         which_model = opt_net['which_model_D']
-    registered_fns = find_registered_model_fns()
-    if which_model not in registered_fns.keys():
-        raise CreateModelError(which_model, list(registered_fns.keys()))
-    num_params = len(signature(registered_fns[which_model]).parameters)
+    model_fn, available = resolve_registered('models', 'model', find_registered_model_fns, which_model)
+    if model_fn is None:
+        raise CreateModelError(which_model, available)
+    num_params = len(signature(model_fn).parameters)
     if num_params == 2:
-        return registered_fns[which_model](opt_net, opt)
+        return model_fn(opt_net, opt)
     else:
-        return registered_fns[which_model](opt_net, opt, other_nets)
+        return model_fn(opt_net, opt, other_nets)
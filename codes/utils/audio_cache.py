@@ -0,0 +1,153 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+
+from utils.util import opt_get
+
+
+# Caches opened in this process, by (path, max_size_gb, dtype). Datasets sharing a store share one instance.
+_caches = {}
+
+
+class DecodedAudioCache:
+    """
+    On-disk store of decoded, resampled, mono audio clips keyed by (path, mtime, sample_rate), so repeated epochs skip
+    decoding and resampling. Entries are stored as int16 (or float16) .npy files. The total size of the store is capped;
+    when it is exceeded the least recently used entries (by file mtime, which is bumped on every hit) are evicted.
+
+    The total size is tracked in a small counter file in the store, updated by every process that adds an entry, so
+    opening the store never walks it. Concurrent updates can occasionally lose an increment; the store is only walked
+    (and the counter corrected) when the counter exceeds the cap and entries need to be evicted.
+
+    Hit/miss counters are kept per process and printed every [report_every] lookups.
+    """
+    SIZE_FILE = 'size.json'
+
+    def __init__(self, cache_dir, max_size_gb=50, dtype='int16', report_every=10000):
+        assert dtype in ['int16', 'float16']
+        self.cache_dir = cache_dir
+        self.max_size_bytes = int(max_size_gb * 1024 ** 3)
+        self.dtype = dtype
+        self.report_every = report_every
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def scan(self):
+        entries = []
+        total = 0
+        for dirpath, _, fnames in os.walk(self.cache_dir):
+            for fname in fnames:
+                if not fname.endswith('.npy'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(dirpath, fname))
+                except FileNotFoundError:
+                    continue  # Evicted by another process.
+                entries.append((st.st_mtime, st.st_size, os.path.join(dirpath, fname)))
+                total += st.st_size
+        return entries, total
+
+    def read_size(self):
+        try:
+            with open(os.path.join(self.cache_dir, self.SIZE_FILE), 'r', encoding='utf-8') as f:
+                return json.load(f)['bytes']
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+    def write_size(self, total):
+        size_path = os.path.join(self.cache_dir, self.SIZE_FILE)
+        tmp = f'{size_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'bytes': total}, f)
+        os.replace(tmp, size_path)
+
+    def add_size(self, nbytes):
+        total = self.read_size()
+        if total is None:
+            total = self.scan()[1]  # Only for a store written before the counter existed (or a lost counter).
+        else:
+            total += nbytes
+        self.write_size(total)
+        return total
+
+    def entry_path(self, path, sample_rate):
+        mtime = os.stat(path).st_mtime_ns
+        key = hashlib.sha1(f'{os.path.abspath(path)}|{mtime}|{sample_rate}|{self.dtype}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f'{key}.npy')
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total > 0 else 0}
+
+    def _count(self, hit):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.report_every > 0 and (self.hits + self.misses) % self.report_every == 0:
+            print(f'Decoded audio cache (pid {os.getpid()}): {self.stats()}')
+
+    def get(self, path, sample_rate):
+        entry = self.entry_path(path, sample_rate)
+        try:
+            data = np.load(entry)
+        except (FileNotFoundError, ValueError, OSError):
+            # ValueError/OSError cover entries that are being written or were truncated.
+            self._count(False)
+            return None
+        try:
+            os.utime(entry)  # Mark as recently used.
+        except FileNotFoundError:
+            pass
+        self._count(True)
+        if data.dtype == np.int16:
+            return torch.from_numpy(data.astype(np.float32) / 32767)
+        return torch.from_numpy(data.astype(np.float32))
+
+    def put(self, path, sample_rate, audio):
+        entry = self.entry_path(path, sample_rate)
+        audio = audio.detach().cpu().numpy()
+        if self.dtype == 'int16':
+            audio = (np.clip(audio, -1, 1) * 32767).round().astype(np.int16)
+        else:
+            audio = audio.astype(np.float16)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp = f'{entry}.{os.getpid()}.tmp.npy'
+        np.save(tmp, audio)
+        os.replace(tmp, entry)
+        # Count the file size (including the .npy header), which is what scan() measures.
+        if self.add_size(os.path.getsize(entry)) > self.max_size_bytes:
+            self.evict()
+
+    def evict(self):
+        # Other processes write to the same store (and the counter is approximate), so re-measure before deciding what
+        # to drop. Evict down to 90% of the cap so that this does not run on every put.
+        entries, total = self.scan()
+        entries.sort()
+        target = int(self.max_size_bytes * .9)
+        for mtime, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.write_size(total)
+
+
+def get_audio_cache(cache_opt):
+    """
+    Returns the decoded audio cache described by a dataset's `decoded_audio_cache: {path, max_size_gb, dtype}` option,
+    or None if [cache_opt] is None.
+    """
+    if cache_opt is None:
+        return None
+    key = (cache_opt['path'], opt_get(cache_opt, ['max_size_gb'], 50), opt_get(cache_opt, ['dtype'], 'int16'))
+    if key not in _caches.keys():
+        _caches[key] = DecodedAudioCache(*key)
+    return _caches[key]
@@ -1,7 +1,59 @@
+from collections import OrderedDict
+
 import torch
+import torchaudio
 import numpy as np
 from scipy import special
 
+
+# Resamplers built by get_resampler(), most recently used last, and the total size of their kernels. The cache is
+# bounded by kernel bytes rather than entries: the kernel of a rate pair with a small GCD (e.g. 24000->22001) is far
+# larger than that of a common pair like 44100->22050.
+_resamplers = OrderedDict()
+_cached_kernel_bytes = 0
+MAX_CACHED_KERNEL_BYTES = 256 * 1024 * 1024
+
+
+def _kernel_bytes(resampler):
+    return resampler.kernel.numel() * resampler.kernel.element_size()
+
+
+def get_resampler(orig_sr, new_sr, device='cpu', dtype=torch.float32):
+    """
+    Returns a torchaudio Resample transform for (orig_sr, new_sr) on [device]. The sinc kernel is built once per rate
+    pair, device and dtype and then reused; torchaudio.functional.resample() rebuilds it on every call.
+    """
+    global _cached_kernel_bytes
+    key = (int(orig_sr), int(new_sr), str(device), dtype)
+    if key in _resamplers.keys():
+        _resamplers.move_to_end(key)
+        return _resamplers[key]
+    resampler = torchaudio.transforms.Resample(int(orig_sr), int(new_sr), dtype=dtype).to(device)
+    size = _kernel_bytes(resampler)
+    if size > MAX_CACHED_KERNEL_BYTES:
+        return resampler
+    _resamplers[key] = resampler
+    _cached_kernel_bytes += size
+    while _cached_kernel_bytes > MAX_CACHED_KERNEL_BYTES:
+        _, evicted = _resamplers.popitem(last=False)
+        _cached_kernel_bytes -= _kernel_bytes(evicted)
+    return resampler
+
+
+def resample(audio, orig_sr, new_sr, cache=True):
+    """
+    Drop-in replacement for torchaudio.functional.resample() (with its default filter) that reuses cached kernels.
+    [audio] can have any number of leading (batch/channel) dimensions; the last dimension is time.
+
+    Pass cache=False for rates that are rarely repeated (e.g. random ones): their kernels would only evict useful ones.
+    """
+    if int(orig_sr) == int(new_sr):
+        return audio
+    if not cache:
+        return torchaudio.functional.resample(audio, int(orig_sr), int(new_sr))
+    return get_resampler(orig_sr, new_sr, audio.device, audio.dtype)(audio)
+
+
 # Courtesy of https://www.kaggle.com/smallyellowduck/fast-audio-resampling-layer-in-pytorch
 class AudioResampler(torch.nn.Module):
     """
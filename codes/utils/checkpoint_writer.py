@@ -0,0 +1,149 @@
+import atexit
+import os
+import queue
+import sys
+import threading
+
+import torch
+
+
+class PinnedBufferPool:
+    """
+    CPU buffers for snapshot_to_cpu(), kept between saves so that every checkpoint doesn't allocate (and pin) a fresh
+    copy of the model and optimizer state. Buffers are keyed by their position in the snapshotted object, shape, dtype
+    and whether they are pinned. A buffer returns to the pool only when the lease it was handed out in is released, i.e.
+    once nothing reads the snapshot anymore.
+    """
+    def __init__(self):
+        self.free = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key):
+        with self.lock:
+            if self.free.get(key):
+                return self.free[key].pop()
+        _, shape, dtype, pin = key
+        return torch.empty(shape, dtype=dtype, device='cpu', pin_memory=pin)
+
+    def release(self, lease):
+        with self.lock:
+            for key, buf in lease:
+                self.free.setdefault(key, []).append(buf)
+
+
+def snapshot_to_cpu(obj, pool=None, lease=None):
+    """
+    Copies every tensor in [obj] (nested dicts, lists and tuples) into CPU memory, pinned when CUDA is available so
+    device tensors are copied asynchronously. The result no longer aliases anything the training loop will modify, so it
+    can be serialized on another thread while training continues.
+
+    With a PinnedBufferPool, buffers are taken from [pool] and appended with their keys to the list [lease], which must
+    be passed to pool.release() once the snapshot is no longer needed.
+    """
+    pin = torch.cuda.is_available()
+    copied_from_cuda = []
+
+    def snapshot(o, name):
+        if isinstance(o, torch.Tensor):
+            key = (name, tuple(o.shape), o.dtype, pin and o.is_cuda)
+            if pool is not None:
+                out = pool.acquire(key)
+                lease.append((key, out))
+            else:
+                out = torch.empty(o.shape, dtype=o.dtype, device='cpu', pin_memory=pin and o.is_cuda)
+            out.copy_(o.detach(), non_blocking=o.is_cuda)
+            if o.is_cuda:
+                copied_from_cuda.append(o.device)
+            return out
+        elif isinstance(o, dict):
+            out = type(o)((k, snapshot(v, f'{name}.{k}')) for k, v in o.items())
+            if hasattr(o, '_metadata'):
+                out._metadata = o._metadata  # Module versions recorded by state_dict().
+            return out
+        elif isinstance(o, list) or type(o) is tuple:
+            return type(o)(snapshot(v, f'{name}.{i}') for i, v in enumerate(o))
+        return o
+
+    result = snapshot(obj, '')
+    for device in set(copied_from_cuda):
+        torch.cuda.synchronize(device)
+    return result
+
+
+def atomic_save(obj, path):
+    # Never leave a truncated checkpoint behind if training dies mid-write.
+    tmp = f'{path}.tmp'
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+
+class AsyncCheckpointWriter:
+    """
+    Runs checkpoint IO (serialization, copies and uploads, pruning of old checkpoints) on a background thread, in the
+    order it was submitted. At most [max_pending] jobs can be queued: submit() blocks once that many are waiting, which
+    bounds the memory held by snapshots that have not been written yet.
+
+    Pending jobs are flushed when the process exits. If a job fails, the error is raised from the next call to submit()
+    or flush() so that failed checkpoints are not silently lost.
+    """
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.buffers = PinnedBufferPool()
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='checkpoint_writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                fn, args, kwargs = job
+                fn(*args, **kwargs)
+            except Exception as e:
+                print(f'Error in background checkpoint writer: {sys.exc_info()}')
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('A background checkpoint write failed.') from error
+
+    def submit(self, fn, *args, **kwargs):
+        self.raise_error()
+        if not self.thread.is_alive():
+            fn(*args, **kwargs)
+            return
+        self.queue.put((fn, args, kwargs))
+
+    def snapshot(self, obj):
+        """
+        Returns (snapshot, lease): [obj] copied into CPU buffers from this writer's pool. Pass the lease to release()
+        after submitting the jobs that use the snapshot.
+        """
+        lease = []
+        return snapshot_to_cpu(obj, self.buffers, lease), lease
+
+    def release(self, lease):
+        """
+        Returns the buffers of [lease] to the pool once every job submitted before this call has completed.
+        """
+        self.submit(self.buffers.release, lease)
+
+    def flush(self):
+        """
+        Blocks until every job submitted so far has completed.
+        """
+        if self.thread.is_alive():
+            self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
@@ -0,0 +1,72 @@
+import math
+
+import torch
+import torch.nn.functional as F
+
+
+def next_pow2(n):
+    return 1 << (int(n) - 1).bit_length()
+
+
+class FftConvolver:
+    """
+    Causally convolves signals with kernels from a fixed bank of long kernels (e.g. room impulse responses), using FFTs.
+    Costs O(N log K) per signal rather than the O(N*K) of conv1d, which matters for kernels that are seconds long.
+
+    Signals no longer than [block_size] are convolved with a single FFT; longer signals are split into blocks of
+    [block_size] which are convolved separately and overlap-added. The spectra of the kernels are computed once per
+    FFT size and cached.
+
+    Arguments:
+        kernels: (num_kernels, kernel_length) tensor, in natural (not flipped) order. Shorter kernels are zero-padded.
+        block_size: overlap-add block size. Defaults to the kernel length rounded up to a power of two.
+    """
+    def __init__(self, kernels, block_size=None):
+        if len(kernels.shape) == 1:
+            kernels = kernels.unsqueeze(0)
+        self.kernels = kernels
+        self.kernel_length = kernels.shape[-1]
+        self.block_size = block_size or next_pow2(self.kernel_length)
+        self.spectra = {}
+
+    def __len__(self):
+        return self.kernels.shape[0]
+
+    def to(self, device):
+        self.kernels = self.kernels.to(device)
+        self.spectra = {}
+        return self
+
+    def spectrum(self, n_fft):
+        if n_fft not in self.spectra.keys():
+            self.spectra[n_fft] = torch.fft.rfft(self.kernels, n=n_fft)
+        return self.spectra[n_fft]
+
+    def __call__(self, signal, kernel_index):
+        """
+        Convolves every row of [signal] ((b, n) or (n,)) with kernel kernel_index[row] (an int applies one kernel to
+        all rows). Returns a tensor shaped like [signal]: the tail of the convolution past n is dropped.
+        """
+        squeeze = len(signal.shape) == 1
+        if squeeze:
+            signal = signal.unsqueeze(0)
+        if signal.device != self.kernels.device:
+            self.to(signal.device)
+        b, n = signal.shape
+        if isinstance(kernel_index, int):
+            kernel_index = torch.full((b,), kernel_index, dtype=torch.long, device=signal.device)
+
+        if n <= self.block_size:
+            n_fft = next_pow2(n + self.kernel_length - 1)
+            out = torch.fft.irfft(torch.fft.rfft(signal, n=n_fft) * self.spectrum(n_fft)[kernel_index], n=n_fft)[:, :n]
+        else:
+            n_fft = next_pow2(self.block_size + self.kernel_length - 1)
+            num_blocks = math.ceil(n / self.block_size)
+            blocks = F.pad(signal, (0, num_blocks * self.block_size - n)).view(b, num_blocks, self.block_size)
+            spectra = torch.fft.rfft(blocks, n=n_fft) * self.spectrum(n_fft)[kernel_index].unsqueeze(1)
+            out_blocks = torch.fft.irfft(spectra, n=n_fft)  # (b, num_blocks, n_fft)
+            # Overlap-add: block i starts at i*block_size in the output.
+            out = F.fold(out_blocks.transpose(1, 2), output_size=(1, (num_blocks-1) * self.block_size + n_fft),
+                         kernel_size=(1, n_fft), stride=(1, self.block_size))
+            out = out.view(b, -1)[:, :n]
+        return out.squeeze(0) if squeeze else out
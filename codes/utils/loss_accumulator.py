@@ -5,6 +5,12 @@ from torch import distributed
 
 
 class LossAccumulator:
+    """
+    Buffers live on the device of the first value added to them, so add_loss() itself does not synchronize with the
+    host. (Callers may still do so; e.g. ConfigurableStep checks every loss with isfinite().)
+    as_dict() also returns device tensors; callers should move them to the host together (see
+    ExtensibleTrainer.get_current_log).
+    """
     def __init__(self, buffer_sz=50):
         self.buffer_sz = buffer_sz
         self.buffers = {}
@@ -12,17 +18,18 @@ class LossAccumulator:
 
     def add_loss(self, name, tensor):
         if name not in self.buffers.keys():
+            device = tensor.device if isinstance(tensor, torch.Tensor) else 'cpu'
             if "_histogram" in name:
-                tensor = torch.flatten(tensor.detach().cpu())
-                self.buffers[name] = (0, torch.zeros((self.buffer_sz, tensor.shape[0])), False)
+                tensor = torch.flatten(tensor.detach())
+                self.buffers[name] = (0, torch.zeros((self.buffer_sz, tensor.shape[0]), device=device), False)
             else:
-                self.buffers[name] = (0, torch.zeros(self.buffer_sz), False)
+                self.buffers[name] = (0, torch.zeros(self.buffer_sz, device=device), False)
         i, buf, filled = self.buffers[name]
         # Can take tensors or just plain python numbers.
         if '_histogram' in name:
-            buf[i] = torch.flatten(tensor.detach().cpu())
+            buf[i] = torch.flatten(tensor.detach())
         elif isinstance(tensor, torch.Tensor):
-            buf[i] = tensor.detach().cpu()
+            buf[i] = tensor.detach()
         else:
             buf[i] = tensor
         filled = i+1 >= self.buffer_sz or filled
@@ -0,0 +1,137 @@
+import inspect
+import json
+import os
+import struct
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+# File layout: MAGIC, the length of the header as a little-endian uint64, the utf-8 JSON header, then the raw data of
+# every tensor, each aligned to ALIGNMENT bytes. The header maps every key to its dtype, shape and data offset.
+MAGIC = b'DLASMMAP'
+ALIGNMENT = 64
+
+# dtype name -> (numpy dtype the data is mapped as, torch dtype it is viewed as). numpy has no bfloat16.
+_DTYPES = {
+    'float64': (np.float64, torch.float64),
+    'float32': (np.float32, torch.float32),
+    'float16': (np.float16, torch.float16),
+    'bfloat16': (np.int16, torch.bfloat16),
+    'int64': (np.int64, torch.int64),
+    'int32': (np.int32, torch.int32),
+    'int16': (np.int16, torch.int16),
+    'int8': (np.int8, torch.int8),
+    'uint8': (np.uint8, torch.uint8),
+    'bool': (np.bool_, torch.bool),
+}
+_DTYPE_NAMES = {torch_dtype: name for name, (_, torch_dtype) in _DTYPES.items()}
+
+# torch.load() can memory-map zipfile checkpoints itself from torch 2.1.
+TORCH_LOAD_SUPPORTS_MMAP = 'mmap' in inspect.signature(torch.load).parameters
+
+
+def _align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+def save_mmap_checkpoint(state_dict, path):
+    """
+    Writes a state dict of tensors in the memory-mappable format read by load_mmap_checkpoint().
+    """
+    tensors = OrderedDict((k, v.detach().cpu().contiguous()) for k, v in state_dict.items())
+    entries = OrderedDict()
+    size = 0
+    for k, t in tensors.items():
+        entries[k] = {'dtype': _DTYPE_NAMES[t.dtype], 'shape': list(t.shape), 'offset': size}
+        size += _align(t.numel() * t.element_size())
+    header = json.dumps({'tensors': entries, 'metadata': getattr(state_dict, '_metadata', None)}).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for k, t in tensors.items():
+            f.seek(data_start + entries[k]['offset'])
+            if t.numel() > 0:
+                data = t.view(torch.int16) if t.dtype == torch.bfloat16 else t
+                f.write(memoryview(data.reshape(-1).numpy()).cast('B'))
+        f.truncate(data_start + size)
+    os.replace(tmp, path)
+
+
+def is_mmap_checkpoint(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _rename(key, prefix):
+    # Returns the key with [prefix] and any DDP 'module.' prefixes removed, or None if it does not start with [prefix].
+    if prefix is not None:
+        if not key.startswith(prefix):
+            return None
+        key = key[len(prefix):]
+    if key.startswith('module.'):
+        key = key.replace('module.', '')
+    return key
+
+
+def load_mmap_checkpoint(path, prefix=None):
+    """
+    Returns the state dict stored at [path] with every tensor memory-mapped from the file rather than read into memory.
+    Pages are only read when a tensor is used, e.g. when load_state_dict() copies it into a parameter, so weights
+    stream from disk into the model without any intermediate copy.
+
+    Only keys starting with [prefix] are returned, with the prefix removed; 'module.' prefixes are always removed. The
+    data of other keys is never read.
+    """
+    with open(path, 'rb') as f:
+        assert f.read(len(MAGIC)) == MAGIC, f'{path} is not a memory-mappable checkpoint.'
+        header_len = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_len).decode('utf-8'))
+    data_start = _align(len(MAGIC) + 8 + header_len)
+    # Copy-on-write, so the tensors are writable without ever modifying the file.
+    data = np.memmap(path, dtype=np.uint8, mode='c', offset=data_start) if os.path.getsize(path) > data_start else None
+    state_dict = OrderedDict()
+    for key, entry in header['tensors'].items():
+        name = _rename(key, prefix)
+        if name is None:
+            continue
+        np_dtype, torch_dtype = _DTYPES[entry['dtype']]
+        numel = int(np.prod(entry['shape']))
+        if numel == 0:
+            state_dict[name] = torch.zeros(entry['shape'], dtype=torch_dtype)
+            continue
+        nbytes = numel * np.dtype(np_dtype).itemsize
+        arr = data[entry['offset']:entry['offset']+nbytes].view(np_dtype).reshape(entry['shape'])
+        state_dict[name] = torch.from_numpy(arr).view(torch_dtype)
+    if header['metadata'] is not None and prefix is None:
+        state_dict._metadata = OrderedDict((_rename(k, None), v) for k, v in header['metadata'].items())
+    return state_dict
+
+
+def load_checkpoint(path, prefix=None, map_location=None):
+    """
+    Loads a network checkpoint for load_state_dict(): memory-mapped if it was written by save_mmap_checkpoint() (or is a
+    torch zipfile checkpoint and torch supports mapping those), otherwise with torch.load(). Keys are filtered and
+    renamed as in load_mmap_checkpoint().
+    """
+    if is_mmap_checkpoint(path):
+        return load_mmap_checkpoint(path, prefix)
+    if TORCH_LOAD_SUPPORTS_MMAP:
+        try:
+            state_dict = torch.load(path, map_location='cpu', mmap=True)
+        except RuntimeError:
+            state_dict = torch.load(path, map_location=map_location)  # Legacy (non-zipfile) serialization.
+    else:
+        state_dict = torch.load(path, map_location=map_location)
+    # Support loading torch.save()s for whole models as well as just state_dicts.
+    if 'state_dict' in state_dict:
+        state_dict = state_dict['state_dict']
+    renamed = OrderedDict()
+    for k, v in state_dict.items():
+        name = _rename(k, prefix)
+        if name is not None:
+            renamed[name] = v
+    return renamed
@@ -0,0 +1,87 @@
+import hashlib
+import importlib
+import json
+import os
+import sys
+
+REGISTRY_VERSION = 1
+_loaded = {}  # manifest path -> (fingerprint, {name: [module, attribute]})
+
+
+def registry_manifest_path(base_path, kind):
+    return os.path.join(base_path, f'.{kind}_registry.json')
+
+
+def source_fingerprint(base_path):
+    """
+    Hashes the path, mtime and size of every python file under [base_path]. Only stat() is needed, so this is much
+    cheaper than importing the modules.
+    """
+    h = hashlib.sha1()
+    for root, dirs, files in os.walk(base_path):
+        dirs.sort()
+        for f in sorted(files):
+            if f.endswith('.py'):
+                p = os.path.join(root, f)
+                st = os.stat(p)
+                h.update(f'{p}:{st.st_mtime_ns}:{st.st_size}\n'.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _scan(manifest_path, fingerprint, scan_fn):
+    entries = {name: [obj.__module__, obj.__qualname__] for name, obj in scan_fn().items()}
+    _loaded[manifest_path] = (fingerprint, entries)
+    try:
+        tmp = f'{manifest_path}.{os.getpid()}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'version': REGISTRY_VERSION, 'fingerprint': fingerprint, 'entries': entries}, f, indent=1)
+        os.replace(tmp, manifest_path)
+    except OSError:
+        print(f'Unable to write registry manifest {manifest_path}: {sys.exc_info()}')
+    return entries
+
+
+def load_registry(base_path, kind, scan_fn):
+    """
+    Returns {name: [module, attribute]} for everything registered under [base_path]. [scan_fn] performs the full
+    import-everything walk and returns {name: object}; it is only called (and its result saved next to the sources)
+    when no manifest exists or a python file under [base_path] was added, removed or modified since it was written.
+    """
+    manifest_path = registry_manifest_path(base_path, kind)
+    fingerprint = source_fingerprint(base_path)
+    if manifest_path in _loaded.keys() and _loaded[manifest_path][0] == fingerprint:
+        return _loaded[manifest_path][1]
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['version'] == REGISTRY_VERSION and manifest['fingerprint'] == fingerprint:
+            _loaded[manifest_path] = (fingerprint, manifest['entries'])
+            return manifest['entries']
+    except (OSError, ValueError, KeyError):
+        pass
+    return _scan(manifest_path, fingerprint, scan_fn)
+
+
+def _import_attribute(module, attribute):
+    obj = importlib.import_module(module)
+    for part in attribute.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def resolve_registered(base_path, kind, scan_fn, name):
+    """
+    Returns the object registered as [name] under [base_path], importing only the module that defines it (or None if
+    nothing is registered under that name), along with the list of all registered names.
+    """
+    entries = load_registry(base_path, kind, scan_fn)
+    if name not in entries.keys():
+        return None, list(entries.keys())
+    try:
+        return _import_attribute(*entries[name]), list(entries.keys())
+    except (ImportError, AttributeError):
+        # The manifest is stale in a way the fingerprint cannot see (e.g. a module outside base_path changed).
+        entries = _scan(registry_manifest_path(base_path, kind), source_fingerprint(base_path), scan_fn)
+        if name not in entries.keys():
+            return None, list(entries.keys())
+        return _import_attribute(*entries[name]), list(entries.keys())
@@ -13,7 +13,6 @@ from collections import OrderedDict
 import numpy as np
 import cv2
 import torch
-import torchaudio
 from audio2numpy import open_audio
 from torch import nn
 from torch.nn.parallel import DistributedDataParallel
@@ -27,6 +26,8 @@ from torch import inf
 import yaml
 
 from trainer import networks
+from utils.audio_resampler import resample
+from utils.mmap_checkpoint import load_checkpoint
 
 try:
     from yaml import CLoader as Loader, CDumper as Dumper
@@ -430,6 +431,94 @@ def get_mask_from_lengths(lengths, max_len=None):
     return mask
 
 
+def group_grad_norms(param_groups: dict) -> dict:
+    """
+    Computes the L2 norm of the gradients of each named parameter group in [param_groups], averaged across DDP ranks.
+    Per-parameter norms use multi-tensor kernels, and all group norms are packed into one buffer so that only a single
+    all_reduce and a single device->host transfer are needed. Groups without gradients are omitted.
+    """
+    names, norms = [], []
+    for name, params in param_groups.items():
+        grads = [p.grad.detach() for p in params if getattr(p, 'grad', None) is not None]
+        if not grads:
+            continue
+        if hasattr(torch, '_foreach_norm'):
+            per_param = torch._foreach_norm(grads)
+        else:
+            per_param = [torch.norm(g, 2) for g in grads]
+        names.append(name)
+        norms.append(torch.norm(torch.stack([n.to(per_param[0].device) for n in per_param]), 2))
+    if not norms:
+        return {}
+    packed = torch.stack([n.to(norms[0].device) for n in norms])
+    if torch.distributed.is_available() and torch.distributed.is_initialized():
+        # Gather the metric from all devices if in a distributed setting.
+        torch.distributed.all_reduce(packed, op=torch.distributed.ReduceOp.SUM)
+        packed /= torch.distributed.get_world_size()
+    packed = packed.cpu()
+    return {name: packed[i] for i, name in enumerate(names)}
+
+
+def reduce_log_metrics(log: dict, device, agreed_keys=None):
+    """
+    Replaces every scalar or 1D float tensor in [log] with its CPU copy, averaged across DDP ranks. All of them are
+    packed into one buffer, so a single all_reduce and a single device->host transfer are needed.
+
+    [agreed_keys] is the return value of the previous call (None at first). It records the metric layout the ranks
+    agreed on, so that they only exchange their metric names again when one of them logs a new metric.
+    """
+    local_keys = {k: tuple(v.shape) for k, v in log.items() if isinstance(v, torch.Tensor) and len(v.shape) <= 1
+                  and v.dtype == torch.float}
+    reduce = torch.distributed.is_available() and torch.distributed.is_initialized()
+    if not reduce:
+        packed_keys = sorted(local_keys.items())
+    else:
+        # The buffer layout has to be the same on every rank, but ranks can log different metrics (e.g. a loss whose
+        # 'after' step has only been reached on some of them). The union of all ranks' keys is agreed on once and
+        # reused; each rank fills in zeros for keys it lacks and a presence flag per key, so every value is averaged
+        # over the ranks that have it. A rank that sees a key outside the agreed set raises a flag in the same
+        # buffer, which makes every rank agree on the keys again on the next call.
+        if agreed_keys is None:
+            all_keys = [None] * torch.distributed.get_world_size()
+            torch.distributed.all_gather_object(all_keys, local_keys)
+            union = {}
+            for o in all_keys:
+                union.update(o)
+            agreed_keys = sorted((k, shape) for k, shape in union.items()
+                                 if all(o.get(k, shape) == shape for o in all_keys))
+        packed_keys = agreed_keys
+    # With DDP, the buffer is exchanged even without any agreed keys, so that a newly logged metric is still flagged.
+    if packed_keys or reduce:
+        present = [local_keys.get(k) == shape for k, shape in packed_keys]
+        parts = [log[k].detach().reshape(-1).to(device) if p else torch.zeros(math.prod(shape), device=device)
+                 for (k, shape), p in zip(packed_keys, present)]
+        if reduce:
+            agreed = set(k for k, _ in packed_keys)
+            stale = any(k not in agreed for k in local_keys.keys())
+            parts.append(torch.tensor(present + [stale], dtype=torch.float, device=device))
+        packed = torch.cat(parts)
+        if reduce:
+            torch.distributed.all_reduce(packed, op=torch.distributed.ReduceOp.SUM)
+        packed = packed.cpu()
+        if reduce:
+            counts, stale = packed[-len(packed_keys)-1:-1], packed[-1].item() > 0
+            if stale:
+                agreed_keys = None
+        offset = 0
+        for i, (k, shape) in enumerate(packed_keys):
+            n = math.prod(shape)
+            if not reduce:
+                log[k] = packed[offset:offset+n].reshape(shape)
+            elif counts[i] > 0:
+                log[k] = packed[offset:offset+n].reshape(shape) / counts[i]
+            offset += n
+    # Anything left on the device (metrics outside the agreed set) is logged unreduced.
+    for k, v in log.items():
+        if isinstance(v, torch.Tensor) and v.device.type != 'cpu':
+            log[k] = v.cpu()
+    return agreed_keys
+
+
 def clip_grad_norm(parameters: list, parameter_names: list, max_norm: float, norm_type: float = 2.0) -> torch.Tensor:
     r"""
     Equivalent to torch.nn.utils.clip_grad_norm_() but with the following changes:
@@ -494,7 +583,7 @@ def load_model_from_config(cfg_file=None, model_name=None, also_load_savepoint=T
         load_path = opt['path'][f'pretrain_model_{model_name}']
     if load_path is not None:
         print(f"Loading from {load_path}")
-        sd = torch.load(load_path, map_location=device)
+        sd = load_checkpoint(load_path, map_location=device)
         model.load_state_dict(sd, strict=strict_load)
     return model
 
@@ -562,8 +651,18 @@ def find_audio_files(base_path, globs=['*.wav', '*.mp3', '*.ogg', '*.flac']):
     return paths
 
 
-def load_audio(audiopath, sampling_rate, raw_data=None):
+def load_audio(audiopath, sampling_rate, raw_data=None, cache=None):
+    """
+    [cache] is an optional utils.audio_cache.DecodedAudioCache. It is not used for [raw_data].
+    """
     audiopath = str(audiopath)
+    if raw_data is not None:
+        cache = None
+    if cache is not None:
+        audio = cache.get(audiopath, sampling_rate)
+        if audio is not None:
+            return audio
+
     if raw_data is not None:
         # Assume the data is wav format. SciPy's reader can read raw WAV data from a BytesIO wrapper.
         audio, lsr = load_wav_to_torch(raw_data)
@@ -597,7 +696,7 @@ def load_audio(audiopath, sampling_rate, raw_data=None):
             audio = audio[:, 0]
 
     if lsr != sampling_rate:
-        audio = torchaudio.functional.resample(audio, lsr, sampling_rate)
+        audio = resample(audio, lsr, sampling_rate)
 
     # Check some assumptions about audio range. This should be automatically fixed in load_wav_to_torch, but might not be in some edge cases, where we should squawk.
     # '2' is arbitrarily chosen since it seems like audio will often "overdrive" the [-1,1] bounds.
@@ -605,6 +704,8 @@ def load_audio(audiopath, sampling_rate, raw_data=None):
         print(f"Error with {audiopath}. Max={audio.max()} min={audio.min()}")
     audio.clip_(-1, 1)
 
+    if cache is not None:
+        cache.put(audiopath, sampling_rate, audio)
     return audio
 
 